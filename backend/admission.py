@@ -0,0 +1,157 @@
+"""Admission control for expensive endpoints.
+
+Generation requests hold a worker for seconds to minutes, so accepting them
+past capacity only makes every request in flight time out together. This
+ASGI middleware watches three signals — event-loop lag (measured by a
+sampler task), the number of generation requests in flight, and the depth
+of the default thread-pool queue — and turns new generation requests away
+with `503` and `Retry-After` while any of them is over its threshold.
+Everything else (health, status lookups, downloads) is always admitted.
+"""
+import asyncio
+import logging
+import math
+import os
+import time
+from typing import Any, Dict, Optional
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+MAX_LOOP_LAG_MS = float(os.getenv("ADMISSION_MAX_LOOP_LAG_MS", "250"))
+MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+MAX_EXECUTOR_QUEUE = int(os.getenv("ADMISSION_MAX_EXECUTOR_QUEUE", "32"))
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("ADMISSION_SAMPLE_SECONDS", "0.1"))
+MIN_RETRY_AFTER_SECONDS = 1
+MAX_RETRY_AFTER_SECONDS = 30
+# Smoothing of the lag signal, so one slow callback doesn't shed a burst of requests
+LAG_SMOOTHING = 0.3
+
+GUARDED_METHODS = ("POST",)
+GUARDED_PREFIXES = ("/api/generate/", "/api/convert/")
+
+
+def is_guarded(scope: Dict[str, Any]) -> bool:
+    return scope["method"] in GUARDED_METHODS and scope["path"].startswith(GUARDED_PREFIXES)
+
+
+class LoadMonitor:
+    def __init__(self):
+        self.loop_lag_ms = 0.0
+        self.max_loop_lag_ms = 0.0
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed: Dict[str, int] = {"loop_lag": 0, "in_flight": 0, "executor_queue": 0}
+        self._sampler: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._sampler is None:
+            self._sampler = asyncio.create_task(self._sample_loop_lag())
+
+    async def stop(self) -> None:
+        if self._sampler is not None:
+            self._sampler.cancel()
+            self._sampler = None
+
+    async def _sample_loop_lag(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + SAMPLE_INTERVAL_SECONDS
+            await asyncio.sleep(SAMPLE_INTERVAL_SECONDS)
+            lag_ms = max(0.0, (loop.time() - scheduled) * 1000)
+            self.loop_lag_ms += LAG_SMOOTHING * (lag_ms - self.loop_lag_ms)
+            self.max_loop_lag_ms = max(self.max_loop_lag_ms, lag_ms)
+
+    @staticmethod
+    def executor_queue_depth() -> int:
+        """Work items waiting for a thread in the loop's default executor"""
+        try:
+            executor = getattr(asyncio.get_running_loop(), "_default_executor", None)
+        except RuntimeError:
+            return 0
+        work_queue = getattr(executor, "_work_queue", None)
+        return work_queue.qsize() if work_queue is not None else 0
+
+    def overload_reason(self) -> Optional[str]:
+        if MAX_LOOP_LAG_MS and self.loop_lag_ms > MAX_LOOP_LAG_MS:
+            return "loop_lag"
+        if MAX_IN_FLIGHT and self.in_flight >= MAX_IN_FLIGHT:
+            return "in_flight"
+        if MAX_EXECUTOR_QUEUE and self.executor_queue_depth() > MAX_EXECUTOR_QUEUE:
+            return "executor_queue"
+        return None
+
+    def retry_after(self, reason: str) -> int:
+        """Seconds until capacity is likely back, scaled by how far over the limit we are"""
+        if reason == "loop_lag":
+            overshoot = self.loop_lag_ms / MAX_LOOP_LAG_MS
+        elif reason == "in_flight":
+            overshoot = (self.in_flight + 1) / MAX_IN_FLIGHT
+        else:
+            overshoot = self.executor_queue_depth() / MAX_EXECUTOR_QUEUE
+        return int(min(MAX_RETRY_AFTER_SECONDS, max(MIN_RETRY_AFTER_SECONDS, math.ceil(overshoot * 2))))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "loop_lag_ms": round(self.loop_lag_ms, 1),
+            "max_loop_lag_ms": round(self.max_loop_lag_ms, 1),
+            "in_flight": self.in_flight,
+            "executor_queue": self.executor_queue_depth(),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "thresholds": {
+                "max_loop_lag_ms": MAX_LOOP_LAG_MS,
+                "max_in_flight": MAX_IN_FLIGHT,
+                "max_executor_queue": MAX_EXECUTOR_QUEUE,
+            },
+        }
+
+
+monitor = LoadMonitor()
+
+
+class AdmissionMiddleware:
+    """Shed generation requests while the process is overloaded"""
+
+    def __init__(self, app, load_monitor: LoadMonitor = monitor):
+        self.app = app
+        self.monitor = load_monitor
+        self._last_shed_log = 0.0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not is_guarded(scope):
+            await self.app(scope, receive, send)
+            return
+
+        reason = self.monitor.overload_reason()
+        if reason is not None:
+            await self._reject(reason, send)
+            return
+
+        self.monitor.admitted += 1
+        self.monitor.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.monitor.in_flight -= 1
+
+    async def _reject(self, reason: str, send) -> None:
+        self.monitor.shed[reason] += 1
+        retry_after = self.monitor.retry_after(reason)
+        now = time.monotonic()
+        if now - self._last_shed_log > 5:
+            self._last_shed_log = now
+            logger.warning(f"Shedding generation requests ({reason}): {self.monitor.snapshot()}")
+
+        body = orjson.dumps({"detail": "Server is at capacity, retry later", "reason": reason})
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,273 @@
+"""Cold tier for old generated images.
+
+A compaction pass (every ARCHIVE_INTERVAL_SECONDS, when ARCHIVE_DIR is set)
+leases completed image generations older than ARCHIVE_AFTER_DAYS, one at a
+time, and for each image:
+
+- re-encodes the original as WebP (ARCHIVE_QUALITY) unless that isn't
+  smaller, and appends it to the current segment file;
+- stores an ARCHIVE_THUMBNAIL_PX WebP thumbnail in the hot blob store,
+  which the history list links to;
+- records `{"archive": {segment, offset, length, sha256}}` in place of the
+  blob reference, once the segment bytes are fsynced.
+
+Segments are append-only files named per writer, so workers sharing
+ARCHIVE_DIR (it must be shared storage when the API runs on several hosts)
+never write to the same file. Each one has a JSON-lines `.idx` listing its
+records, enough to rebuild references without Mongo. `load_image` reads
+either tier, so `/api/generations/{id}` doesn't care where an image lives.
+
+Blob store entries are content-addressed and may be shared (prompt cache
+reuse), so archived originals are not deleted right away: they are queued
+in `archive_pending` and deleted on a later pass, after
+ARCHIVE_DELETE_GRACE_SECONDS, if no hot generation references them by then.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from datetime import timedelta
+from io import BytesIO
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+import blobstore
+import lifecycle
+from lifecycle import utcnow
+from media import ImageData, StoredImage
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "")
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", "7"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "200"))
+ARCHIVE_SEGMENT_BYTES = int(os.getenv("ARCHIVE_SEGMENT_MB", "256")) * 1024 * 1024
+ARCHIVE_QUALITY = int(os.getenv("ARCHIVE_QUALITY", "80"))
+ARCHIVE_THUMBNAIL_PX = int(os.getenv("ARCHIVE_THUMBNAIL_PX", "256"))
+ARCHIVE_DELETE_GRACE_SECONDS = int(os.getenv("ARCHIVE_DELETE_GRACE_SECONDS", "3600"))
+
+
+def enabled() -> bool:
+    return bool(ARCHIVE_DIR)
+
+
+def reencode(data: bytes, mime_type: str) -> Tuple[bytes, str, Optional[bytes]]:
+    """(archived bytes, their type, WebP thumbnail); originals PIL can't read are kept as-is"""
+    from PIL import Image
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            image.load()
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+            compact = BytesIO()
+            image.save(compact, format="WEBP", quality=ARCHIVE_QUALITY, method=4)
+            thumbnail = image.copy()
+            thumbnail.thumbnail((ARCHIVE_THUMBNAIL_PX, ARCHIVE_THUMBNAIL_PX))
+            small = BytesIO()
+            thumbnail.save(small, format="WEBP", quality=70)
+    except Exception as e:
+        logger.warning(f"Archiving image unchanged, could not re-encode it: {e}")
+        return data, mime_type, None
+    if compact.tell() >= len(data):
+        return data, mime_type, small.getvalue()
+    return compact.getvalue(), "image/webp", small.getvalue()
+
+
+class SegmentWriter:
+    """Appends records to this process's current segment, rolling over at ARCHIVE_SEGMENT_BYTES"""
+
+    def __init__(self, directory: str, max_bytes: int = ARCHIVE_SEGMENT_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.name: Optional[str] = None
+        self.size = 0
+        self._lock = threading.Lock()
+
+    def _roll(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.name = f"{utcnow():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.size = 0
+
+    def append(self, generation_id: str, records: List[Tuple[bytes, str]]) -> List[Dict[str, Any]]:
+        """Write one generation's images durably; returns their locations"""
+        with self._lock:
+            if self.name is None or self.size >= self.max_bytes:
+                self._roll()
+            locations = []
+            base = os.path.join(self.directory, self.name)
+            try:
+                with open(f"{base}.seg", "ab") as segment, open(f"{base}.idx", "ab") as index:
+                    for position, (data, mime_type) in enumerate(records):
+                        # The file's own end, not a running count a failed write could have left behind
+                        location = {"segment": self.name, "offset": segment.tell(), "length": len(data),
+                                    "sha256": hashlib.sha256(data).hexdigest()}
+                        segment.write(data)
+                        index.write(orjson.dumps({"generation_id": generation_id, "image": position,
+                                                  "mime_type": mime_type, **location}) + b"\n")
+                        locations.append(location)
+                    segment.flush()
+                    index.flush()
+                    os.fsync(segment.fileno())
+                    os.fsync(index.fileno())
+                    self.size = segment.tell()
+            except BaseException:
+                # A partial record may sit at the end of this segment: leave it, the next append starts a new one
+                self.name = None
+                raise
+            return locations
+
+
+def read_record(location: Dict[str, Any]) -> bytes:
+    with open(os.path.join(ARCHIVE_DIR, f"{location['segment']}.seg"), "rb") as segment:
+        segment.seek(location["offset"])
+        data = segment.read(location["length"])
+    if len(data) != location["length"]:
+        raise OSError(f"Archive segment {location['segment']} is truncated")
+    if hashlib.sha256(data).hexdigest() != location["sha256"]:
+        raise OSError(f"Archive segment {location['segment']} is corrupt at offset {location['offset']}")
+    return data
+
+
+async def load_image(db, entry: Any) -> Optional[StoredImage]:
+    """Resolve an `images` entry of a generation document, from whichever tier holds it"""
+    if isinstance(entry, dict) and "archive" in entry:
+        try:
+            data = await asyncio.to_thread(read_record, entry["archive"])
+        except OSError as e:
+            logger.error(f"Archived image unreadable: {e}")
+            return None
+        return ImageData(entry["mime_type"], data)
+    return await blobstore.load_image(db, entry)
+
+
+def image_key(entry: Any) -> Optional[str]:
+    """Identity of an image entry's bytes, without reading them"""
+    if not isinstance(entry, dict):
+        return None
+    if "archive" in entry:
+        return entry["archive"]["sha256"]
+    return entry.get("blob_id")
+
+
+def thumbnail_id(entry: Any) -> Optional[str]:
+    """Hot blob to show in listings: the original, or the thumbnail once archived"""
+    if not isinstance(entry, dict):
+        return None
+    return entry.get("thumbnail_blob_id") or entry.get("blob_id")
+
+
+writer = SegmentWriter(ARCHIVE_DIR)
+archived_total = 0
+
+
+async def ensure_indexes(db) -> None:
+    await db.generations.create_index("images.blob_id", sparse=True)
+    await db.generations.create_index([("type", 1), ("status", 1), ("archived_at", 1), ("created_at", 1)])
+    await db.archive_pending.create_index("created_at")
+
+
+async def archive_generation(db, generation: Dict[str, Any]) -> bool:
+    """Move one leased generation's images to the cold tier"""
+    generation_id = generation["generation_id"]
+    entries = generation.get("images") or []
+    originals = [entry for entry in entries if isinstance(entry, dict) and "blob_id" in entry]
+    if len(originals) != len(entries):
+        # Inline (pre-blob-store) images: nothing hot to reclaim, leave them be
+        return await lifecycle.release(db.generations, generation, {"archived_at": utcnow()})
+
+    records, thumbnails = [], []
+    for entry in originals:
+        data = await blobstore.read_blob(db, entry["blob_id"])
+        if data is None:
+            logger.warning(f"Not archiving {generation_id}: blob {entry['blob_id']} is missing")
+            return await lifecycle.release(db.generations, generation, {"archived_at": utcnow(), "archive_error": "blob missing"})
+        compact, mime_type, thumbnail = await asyncio.to_thread(reencode, data, entry["mime_type"])
+        records.append((compact, mime_type))
+        thumbnails.append(thumbnail)
+
+    locations = await asyncio.to_thread(writer.append, generation_id, records)
+    archived = []
+    for entry, (compact, mime_type), location, thumbnail in zip(originals, records, locations, thumbnails):
+        archived_entry = {"archive": location, "mime_type": mime_type, "size": len(compact),
+                          "original_size": entry.get("size")}
+        if thumbnail is not None:
+            blob = await blobstore.store_bytes(db, thumbnail, "image/webp", filename=f"{generation_id}-thumbnail",
+                                               metadata={"generation_id": generation_id, "thumbnail": True})
+            archived_entry["thumbnail_blob_id"] = blob["blob_id"]
+        archived.append(archived_entry)
+
+    if not await lifecycle.release(db.generations, generation, {"images": archived, "archived_at": utcnow()}):
+        # Lost the lease; the segment bytes are orphaned but harmless
+        return False
+    now = utcnow()
+    for entry in originals:
+        await db.archive_pending.update_one({"_id": entry["blob_id"]}, {"$setOnInsert": {"created_at": now}}, upsert=True)
+    return True
+
+
+async def delete_unreferenced_originals(db) -> int:
+    """Delete archived originals past their grace period that nothing hot points to any more"""
+    deleted = 0
+    cutoff = utcnow() - timedelta(seconds=ARCHIVE_DELETE_GRACE_SECONDS)
+    async for pending in db.archive_pending.find({"created_at": {"$lte": cutoff}}).limit(ARCHIVE_BATCH):
+        sha256 = pending["_id"]
+        if not await db.generations.find_one({"images.blob_id": sha256}, {"_id": 1}):
+            file_doc = await blobstore.find_blob(db, sha256)
+            # Only blobs written as generation output; uploads with the same bytes stay
+            if file_doc is not None and (file_doc.get("metadata") or {}).get("generation_id"):
+                await blobstore.bucket(db).delete(file_doc["_id"])
+                deleted += 1
+        await db.archive_pending.delete_one({"_id": sha256})
+    return deleted
+
+
+async def compact(db) -> int:
+    global archived_total
+    cutoff = utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    query = {"type": "image", "status": "completed", "archived_at": {"$exists": False}, "created_at": {"$lt": cutoff}}
+    archived = 0
+    for _ in range(ARCHIVE_BATCH):
+        generation = await lifecycle.claim(db.generations, query, sort=[("created_at", 1)])
+        if generation is None:
+            break
+        try:
+            if await archive_generation(db, generation):
+                archived += 1
+        except Exception as e:
+            # Likely the disk or the blob store; retry on the next pass rather than skip it for good
+            logger.error(f"Archiving {generation['generation_id']} failed: {e}")
+            await lifecycle.release(db.generations, generation, {})
+            break
+    archived_total += archived
+    return archived
+
+
+async def compaction_loop(db) -> None:
+    while True:
+        try:
+            archived = await compact(db)
+            deleted = await delete_unreferenced_originals(db)
+            if archived or deleted:
+                logger.info(f"Archived {archived} generation(s), deleted {deleted} hot original(s)")
+        except Exception as e:
+            logger.error(f"Archive compaction error: {e}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+def stats() -> Dict[str, Any]:
+    segments = []
+    if ARCHIVE_DIR and os.path.isdir(ARCHIVE_DIR):
+        segments = [name for name in os.listdir(ARCHIVE_DIR) if name.endswith(".seg")]
+    return {
+        "enabled": enabled(),
+        "archive_after_days": ARCHIVE_AFTER_DAYS,
+        "segments": len(segments),
+        "bytes": sum(os.path.getsize(os.path.join(ARCHIVE_DIR, name)) for name in segments),
+        "current_segment": writer.name,
+        "archived_by_this_worker": archived_total,
+    }
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Async load generator: fixed concurrency, fixed request count per scenario.
+
+Reports throughput, latency percentiles, errors and the peak RSS of the
+server process while the scenario ran. Usable on its own against any
+running API:
+
+    python benchmarks/loadgen.py --url http://127.0.0.1:8001 --scenario health --requests 500
+"""
+import argparse
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+import httpx
+
+
+class Scenario(NamedTuple):
+    name: str
+    method: str
+    path: str
+    body: Optional[Dict[str, Any]] = None
+    needs_db: bool = False
+    # Writes blobs, which the in-memory Mongo stand-in can't store
+    needs_gridfs: bool = False
+
+
+SCENARIOS = [
+    Scenario("health", "GET", "/api/health"),
+    Scenario("models", "GET", "/api/models"),
+    Scenario("image_xai", "POST", "/api/generate/image", {"prompt": "a lighthouse at dusk", "model": "xai", "num_images": 2},
+             needs_gridfs=True),
+    Scenario("image_gemini", "POST", "/api/generate/image", {"prompt": "a lighthouse at dusk", "model": "gemini", "num_images": 2},
+             needs_gridfs=True),
+    Scenario("image_groq", "POST", "/api/generate/image", {"prompt": "a lighthouse at dusk", "model": "groq", "num_images": 1},
+             needs_gridfs=True),
+    Scenario("video_enqueue", "POST", "/api/generate/video", {"prompt": "waves", "model": "runway", "duration": 5},
+             needs_db=True),
+    Scenario("status", "GET", "/api/generations/{generation_id}", needs_db=True),
+    Scenario("history", "GET", "/api/generations?limit=20", needs_db=True),
+]
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def read_rss_kb(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def failed(response: httpx.Response) -> bool:
+    # Image generation reports failures in a 200 body; `success` is the first key written
+    return response.status_code >= 400 or b'"success":false' in response.content[:64]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int,
+                       server_pid: Optional[int] = None, path_params: Optional[Dict[str, str]] = None,
+                       on_response: Optional[Callable[[httpx.Response], None]] = None) -> Dict[str, Any]:
+    path = scenario.path.format(**(path_params or {}))
+    latencies: List[float] = []
+    errors = 0
+    statuses: Dict[int, int] = {}
+    remaining = requests
+    peak_rss = read_rss_kb(server_pid) if server_pid else 0
+    sampling = True
+
+    async def sample_rss():
+        nonlocal peak_rss
+        while sampling:
+            peak_rss = max(peak_rss, read_rss_kb(server_pid))
+            await asyncio.sleep(0.05)
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            started = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, path, json=scenario.body)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if failed(response):
+                errors += 1
+            elif on_response:
+                on_response(response)
+
+    sampler = asyncio.create_task(sample_rss()) if server_pid else None
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    sampling = False
+    if sampler:
+        await sampler
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "errors": errors,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+        "peak_rss_mb": round(peak_rss / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8001")
+    parser.add_argument("--scenario", choices=[scenario.name for scenario in SCENARIOS], default="health")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pid", type=int, help="server process to sample RSS from")
+    parser.add_argument("--generation-id", default="unknown", help="for the status scenario")
+    args = parser.parse_args()
+
+    scenario = next(scenario for scenario in SCENARIOS if scenario.name == args.scenario)
+
+    async def run():
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=args.url, timeout=300, limits=limits) as client:
+            return await run_scenario(client, scenario, args.requests, args.concurrency, args.pid,
+                                      {"generation_id": args.generation_id})
+
+    print(asyncio.run(run()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Bytes per cached generation: loose dicts vs compact records.
+
+`dict` is what the generation cache held before records.py: the status
+response dict, its header dict and the document's `images` entries.
+`record` is a GenerationRecord. Image payloads are left out of both; they
+are cached separately and cost the same either way. So are the per-record
+strings (ids, ETags), which both layouts share with the samples here; what
+is measured is the containers holding them.
+
+Each mode runs in a fresh interpreter and is measured with tracemalloc.
+
+    python benchmarks/record_memory.py --records 20000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+import uuid
+from datetime import datetime, timezone
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def sample(index: int, images: int):
+    """A finished generation as the status endpoint sees it: (status, headers, images entries)"""
+    generation_id = str(uuid.uuid4())
+    failed = index % 20 == 0
+    status = {
+        "generation_id": generation_id,
+        "status": "failed" if failed else "completed",
+        "progress": 100,
+        "result_url": None,
+        "error": "XAI API request failed" if failed else None,
+    }
+    headers = {
+        "etag": f'"{uuid.uuid4().hex[:24]}"',
+        "cache-control": "private, max-age=3600",
+        "last-modified": datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT"),
+    }
+    entries = [{"blob_id": uuid.uuid4().hex + uuid.uuid4().hex, "mime_type": "image/png",
+                "size": 1_500_000} for _ in range(images)]
+    return status, headers, entries
+
+
+def run_mode(mode: str, count: int, images: int) -> None:
+    import records
+
+    samples = [sample(index, images) for index in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    if mode == "dict":
+        kept = [(dict(status), dict(headers), [dict(entry) for entry in entries])
+                for status, headers, entries in samples]
+    else:
+        kept = [records.GenerationRecord(status, headers, entries) for status, headers, entries in samples]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(json.dumps({"mode": mode, "records": len(kept), "bytes_per_record": round((after - before) / count)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=20000)
+    parser.add_argument("--images", type=int, default=1, help="image references per generation")
+    parser.add_argument("--mode", choices=["dict", "record"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.records, args.images)
+        return
+
+    print(f"{args.records} finished generation(s), {args.images} image(s) each")
+    results = {}
+    for mode in ("dict", "record"):
+        out = subprocess.run([sys.executable, __file__, "--mode", mode, "--records", str(args.records),
+                              "--images", str(args.images)], capture_output=True, text=True, check=True)
+        results[mode] = json.loads(out.stdout)
+        print(f"{mode:>7}: {results[mode]['bytes_per_record']} bytes/record, "
+              f"{results[mode]['bytes_per_record'] * args.records / 1024 / 1024:.1f} MB total")
+    print(f"records use {results['record']['bytes_per_record'] / results['dict']['bytes_per_record']:.0%} of the dict size")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Peak RSS per image response: legacy data-URL path vs streamed media path.
+
+Each mode runs in a fresh interpreter so peaks don't leak between runs.
+
+    python benchmarks/response_memory.py --images 4 --size-mb 2
+"""
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+from typing import List, Optional
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def rss_kb(field: str) -> int:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def legacy_body(images: List[bytes]) -> int:
+    """The pre-media path: base64 bytes -> str -> f-string -> Pydantic -> json"""
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import BaseModel
+
+    class GenerationResponse(BaseModel):
+        success: bool
+        message: str
+        model_used: str
+        prompt: str
+        generation_id: str
+        images: Optional[List[str]] = None
+        video_url: Optional[str] = None
+        error: Optional[str] = None
+
+    encoded = []
+    for image_bytes in images:
+        base64_str = base64.b64encode(image_bytes).decode('utf-8')
+        encoded.append(f"data:image/png;base64,{base64_str}")
+    response = GenerationResponse(success=True, message="ok", model_used="bench", prompt="bench",
+                                  generation_id="bench", images=encoded)
+    # What FastAPI's JSONResponse does with the returned model
+    body = json.dumps(jsonable_encoder(response), ensure_ascii=False, allow_nan=False,
+                      indent=None, separators=(",", ":")).encode("utf-8")
+    return len(body)
+
+
+def streamed_body(images: List[bytes]) -> int:
+    from media import ImageData, json_with_images
+
+    payload = {"success": True, "message": "ok", "model_used": "bench", "prompt": "bench",
+               "generation_id": "bench", "video_url": None, "error": None}
+    return sum(len(chunk) for chunk in json_with_images(payload, [ImageData("image/png", b) for b in images]))
+
+
+def run_mode(mode: str, count: int, size: int) -> None:
+    # Import everything up front so only the response path counts
+    import fastapi.encoders  # noqa: F401
+    import media  # noqa: F401
+
+    images = [os.urandom(size) for _ in range(count)]
+    baseline = rss_kb("VmRSS")
+    length = legacy_body(images) if mode == "legacy" else streamed_body(images)
+    peak = rss_kb("VmHWM")
+    print(json.dumps({"mode": mode, "body_bytes": length, "peak_delta_kb": max(peak - baseline, 0)}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--size-mb", type=float, default=2.0)
+    parser.add_argument("--mode", choices=["legacy", "streamed"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    size = int(args.size_mb * 1024 * 1024)
+
+    if args.mode:
+        run_mode(args.mode, args.images, size)
+        return
+
+    print(f"{args.images} image(s) x {args.size_mb} MB raw")
+    results = {}
+    for mode in ("legacy", "streamed"):
+        out = subprocess.run([sys.executable, __file__, "--mode", mode, "--images", str(args.images),
+                              "--size-mb", str(args.size_mb)], capture_output=True, text=True, check=True)
+        results[mode] = json.loads(out.stdout)
+        print(f"{mode:>9}: peak RSS +{results[mode]['peak_delta_kb'] / 1024:.1f} MB "
+              f"(body {results[mode]['body_bytes'] / 1024 / 1024:.1f} MB)")
+    if results["legacy"]["body_bytes"] != results["streamed"]["body_bytes"]:
+        print("body sizes differ between modes")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Run the API for a benchmark with a chosen database setup.
+
+    --mongo none    no database (image generation skips persistence)
+    --mongo memory  in-memory stand-in (needs mongomock-motor; no GridFS, so
+                    endpoints that store blobs fail)
+    --mongo url     the real MongoDB at MONGO_URL
+"""
+import argparse
+import os
+import sys
+
+import uvicorn
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--mongo", choices=["none", "memory", "url"], default="none")
+    args = parser.parse_args()
+
+    import server
+
+    if args.mongo == "none":
+        def no_database(*_args, **_kwargs):
+            raise ConnectionError("database disabled for this benchmark run")
+
+        server.AsyncIOMotorClient = no_database
+    elif args.mongo == "memory":
+        from mongomock_motor import AsyncMongoMockClient
+
+        server.AsyncIOMotorClient = lambda url, **_kwargs: AsyncMongoMockClient(url, tz_aware=True)
+
+    uvicorn.run(server.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
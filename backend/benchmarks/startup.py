@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Worker startup cost: import time, per-module import cost and time-to-ready.
+
+Each run is a fresh interpreter. `import server` is profiled with
+`python -X importtime`, and the modules server.py imports directly are
+ranked by cumulative cost. Time-to-ready is measured from spawning
+benchmarks/run_server.py to the first 200 from /api/health.
+
+The budget is the "startup-<mongo>" entry of benchmarks/baselines.json.
+The run fails when the median import or ready time exceeds it by more than
+--tolerance. It also fails when `import server` loads any of LAZY_MODULES,
+which must wait for their first use.
+
+    python benchmarks/startup.py                     # compare, exit 1 over budget
+    python benchmarks/startup.py --update-baseline   # record this machine's numbers
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List, Tuple
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from suite import BASELINE_FILE, free_port, load_baselines  # noqa: E402
+
+# Provider SDKs and the like: loaded by the first request that needs them, never at import
+LAZY_MODULES = ("PIL", "emergentintegrations", "httpx", "cassette", "google", "numpy")
+IMPORT_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( +)(\S+)$")
+PROBE = ("import json, sys; import server; "
+         f"print(json.dumps(sorted(m for m in {LAZY_MODULES!r} if m in sys.modules)))")
+
+
+def parse_importtime(stderr: str) -> Tuple[float, Dict[str, float]]:
+    """(`import server` ms, {module server imports directly: cumulative ms})"""
+    children: Dict[str, float] = {}
+    for line in stderr.splitlines():
+        match = IMPORT_LINE.match(line)
+        if match is None:
+            continue
+        cumulative_us, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        # Children are printed before their parent, one level (two spaces) deeper
+        if indent == 1:
+            if name == "server":
+                return cumulative_us / 1000, children
+            children = {}
+        elif indent == 3:
+            children[name] = cumulative_us / 1000
+    raise RuntimeError("`import server` missing from the importtime output")
+
+
+def profile_import() -> Tuple[float, Dict[str, float], List[str]]:
+    out = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE], cwd=BACKEND_DIR,
+                         capture_output=True, text=True, check=True)
+    total, modules = parse_importtime(out.stderr)
+    return total, modules, json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def time_to_ready(mongo: str, timeout: float = 60) -> float:
+    port = free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, "run_server.py"), "--port", str(port),
+                                "--mongo", mongo], cwd=BACKEND_DIR,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = started + timeout
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"server exited with code {process.returncode} before becoming ready")
+            # http.client rather than httpx: a new httpx client per poll costs enough CPU to slow the server down
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            try:
+                connection.request("GET", "/api/health")
+                if connection.getresponse().status == 200:
+                    return (time.perf_counter() - started) * 1000
+            except OSError:
+                pass
+            finally:
+                connection.close()
+            time.sleep(0.01)
+        raise RuntimeError(f"server not ready after {timeout}s")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--mongo", choices=["none", "memory", "url"], default="none")
+    parser.add_argument("--top", type=int, default=12, help="modules to list by import cost")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    imports, module_costs, eager = [], {}, set()
+    for _ in range(args.runs):
+        total, modules, loaded = profile_import()
+        imports.append(total)
+        eager.update(loaded)
+        for name, cost in modules.items():
+            module_costs.setdefault(name, []).append(cost)
+    ready = [time_to_ready(args.mongo) for _ in range(args.runs)]
+
+    result = {
+        "import_ms": round(statistics.median(imports), 1),
+        "ready_ms": round(statistics.median(ready), 1),
+        "modules_ms": {name: round(statistics.median(costs), 1) for name, costs in sorted(
+            module_costs.items(), key=lambda item: -statistics.median(item[1]))[:args.top]},
+    }
+    print(f"import server: {result['import_ms']} ms, time-to-ready: {result['ready_ms']} ms "
+          f"(median of {args.runs}, --mongo {args.mongo})")
+    for name, cost in result["modules_ms"].items():
+        print(f"  {cost:8.1f} ms  {name}")
+
+    failures = [f"`import server` loaded {name}; it must be imported on first use" for name in sorted(eager)]
+    profile = f"startup-{args.mongo}"
+    baselines = load_baselines()
+    if args.update_baseline and not failures:
+        baselines[profile] = result
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline for {profile} written to {BASELINE_FILE}")
+        return 0
+
+    if profile in baselines:
+        budget = baselines[profile]
+        for key in ("import_ms", "ready_ms"):
+            if result[key] > budget[key] * (1 + args.tolerance):
+                failures.append(f"{key} {result[key]} > budget {budget[key]}")
+    else:
+        print(f"No baseline for {profile}; run with --update-baseline to record one")
+    for failure in failures:
+        print(f"❌ REGRESSION {failure}")
+    if not failures:
+        print(f"✅ Within {args.tolerance:.0%} of the startup budget")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
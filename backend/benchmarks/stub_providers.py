@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the XAI and Gemini (Imagen) image APIs.
+
+Responses follow the real wire formats closely enough for server.py's
+provider functions; latency, jitter, error rate and image size are
+configurable so load tests can model a slow or flaky upstream offline.
+
+    python benchmarks/stub_providers.py --port 8199 --latency-ms 800 --error-rate 0.05
+
+Point the API at it with XAI_API_BASE=http://127.0.0.1:8199/v1 and
+GEMINI_API_BASE=http://127.0.0.1:8199/v1beta.
+"""
+import argparse
+import asyncio
+import base64
+import os
+import random
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+class StubConfig:
+    def __init__(self, latency_ms: float = 200, jitter_ms: float = 50, error_rate: float = 0.0,
+                 error_status: int = 500, image_kb: int = 256, download_ms: float = 20, xai_format: str = "url"):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.download_ms = download_ms
+        self.xai_format = xai_format
+        # Random bytes: incompressible, like real JPEG/PNG data
+        self.image = os.urandom(image_kb * 1024)
+        self.image_b64 = base64.b64encode(self.image).decode()
+
+    async def delay(self) -> None:
+        await asyncio.sleep(max(0.0, random.gauss(self.latency_ms, self.jitter_ms)) / 1000)
+
+    def failed(self) -> bool:
+        return random.random() < self.error_rate
+
+
+def create_app(config: StubConfig) -> Starlette:
+    async def xai_generate(request: Request):
+        body = await request.json()
+        await config.delay()
+        if config.failed():
+            return JSONResponse({"error": "stub failure"}, status_code=config.error_status)
+        count = min(int(body.get("num_images", 1)), 10)
+        if config.xai_format == "b64":
+            data = [{"b64_json": config.image_b64} for _ in range(count)]
+        else:
+            base = str(request.base_url).rstrip("/")
+            data = [{"url": f"{base}/files/{i}.jpg"} for i in range(count)]
+        return JSONResponse({"data": data}, headers={"x-ratelimit-remaining-requests": "1000"})
+
+    async def download(request: Request):
+        await asyncio.sleep(config.download_ms / 1000)
+        return Response(config.image, media_type="image/jpeg")
+
+    async def imagen_predict(request: Request):
+        body = await request.json()
+        await config.delay()
+        if config.failed():
+            return JSONResponse({"error": {"code": config.error_status, "message": "stub failure"}},
+                                status_code=config.error_status)
+        count = int((body.get("parameters") or {}).get("sampleCount", 1))
+        predictions = [{"mimeType": "image/png", "bytesBase64Encoded": config.image_b64} for _ in range(count)]
+        return JSONResponse({"predictions": predictions})
+
+    async def health(request: Request):
+        return JSONResponse({"status": "ok"})
+
+    return Starlette(routes=[
+        Route("/v1/images/generations", xai_generate, methods=["POST"]),
+        Route("/files/{name}", download),
+        Route("/v1beta/models/{model}:predict", imagen_predict, methods=["POST"]),
+        Route("/health", health),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8199)
+    parser.add_argument("--latency-ms", type=float, default=200)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--image-kb", type=int, default=256)
+    parser.add_argument("--download-ms", type=float, default=20)
+    parser.add_argument("--xai-format", choices=["url", "b64"], default="url")
+    args = parser.parse_args()
+
+    config = StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status,
+                        args.image_kb, args.download_ms, args.xai_format)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
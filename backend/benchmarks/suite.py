@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark suite: stub providers + API server + load generator.
+
+Starts benchmarks/stub_providers.py and the API (benchmarks/run_server.py)
+on free local ports, runs every scenario that the chosen database setup
+supports, prints RPS, p50/p95/p99 latency and peak server RSS per endpoint,
+and compares them against benchmarks/baselines.json. A scenario regresses
+when its RPS drops, or its p95 or peak RSS grows, by more than --tolerance,
+and fails outright when any of its requests errors (baselines never hold errors).
+
+    python benchmarks/suite.py                      # compare, exit 1 on regression
+    python benchmarks/suite.py --update-baseline    # record this machine's numbers
+
+--upstream record/replay runs the API with UPSTREAM_MODE set (see
+upstream.py): record captures the stub traffic into --cassette, replay serves
+a cassette back with its original timing, e.g. one recorded in production
+with UPSTREAM_MODE=record, instead of talking to the stub.
+
+Baselines are keyed by profile (database setup + concurrency) and are only
+meaningful on the machine that recorded them.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from loadgen import SCENARIOS, run_scenario  # noqa: E402
+
+BASELINE_FILE = os.path.join(BENCH_DIR, "baselines.json")
+WARMUP_REQUESTS = 5
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url: str, process: subprocess.Popen, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{url} exited with code {process.returncode} before becoming ready")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def start_processes(args) -> List[subprocess.Popen]:
+    stub_port, api_port = free_port(), free_port()
+    stub = subprocess.Popen([
+        sys.executable, os.path.join(BENCH_DIR, "stub_providers.py"), "--port", str(stub_port),
+        "--latency-ms", str(args.stub_latency_ms), "--error-rate", str(args.stub_error_rate),
+        "--image-kb", str(args.image_kb),
+    ])
+    env = {
+        **os.environ,
+        "XAI_API_BASE": f"http://127.0.0.1:{stub_port}/v1",
+        "XAI_API_KEY": "bench-key",
+        "GEMINI_API_BASE": f"http://127.0.0.1:{stub_port}/v1beta",
+        "GEMINI_API_KEY": "bench-key",
+        "VIDEO_PROVIDER_OVERRIDE": "stub",
+        "UPSTREAM_MODE": args.upstream,
+        "UPSTREAM_CASSETTE": os.path.abspath(args.cassette),
+    }
+    api = subprocess.Popen(
+        [sys.executable, os.path.join(BENCH_DIR, "run_server.py"), "--port", str(api_port), "--mongo", args.mongo],
+        env=env, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL if not args.verbose else None,
+    )
+    wait_ready(f"http://127.0.0.1:{stub_port}/health", stub)
+    wait_ready(f"http://127.0.0.1:{api_port}/api/health", api)
+    args.api_url = f"http://127.0.0.1:{api_port}"
+    return [stub, api]
+
+
+async def run_all(args, api_pid: int) -> Dict[str, Dict[str, Any]]:
+    selected = [scenario for scenario in SCENARIOS if not args.scenarios or scenario.name in args.scenarios]
+    if args.mongo == "none":
+        selected = [scenario for scenario in selected if not scenario.needs_db]
+    elif args.mongo == "memory":
+        selected = [scenario for scenario in selected if not scenario.needs_gridfs]
+
+    generation_ids = []
+
+    def remember_generation(response: httpx.Response) -> None:
+        if len(generation_ids) < 1:
+            generation_ids.append(response.json().get("generation_id"))
+
+    results = {}
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.api_url, timeout=300, limits=limits) as client:
+        for scenario in selected:
+            params = {"generation_id": generation_ids[0] if generation_ids else "unknown"}
+            hook = remember_generation if scenario.name == "video_enqueue" else None
+            await run_scenario(client, scenario, WARMUP_REQUESTS, 1, None, params, hook)
+            results[scenario.name] = await run_scenario(client, scenario, args.requests, args.concurrency,
+                                                        api_pid, params, hook)
+            print_row(scenario.name, results[scenario.name])
+    return results
+
+
+def print_row(name: str, result: Dict[str, Any]) -> None:
+    print(f"{name:<15}{result['rps']:>9}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}"
+          f"{result['peak_rss_mb']:>10}{result['errors']:>8}")
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], tolerance: float) -> List[str]:
+    regressions = []
+    for name, result in results.items():
+        # Failed requests are fast, so a baseline with errors in it would reward them: any error fails
+        if result["errors"]:
+            regressions.append(f"{name}: {result['errors']} errors")
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: RPS {result['rps']} < baseline {base['rps']}")
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss_mb']}MB > baseline {base['peak_rss_mb']}MB")
+    return regressions
+
+
+def load_baselines() -> Dict[str, Any]:
+    if not os.path.exists(BASELINE_FILE):
+        return {}
+    with open(BASELINE_FILE) as f:
+        return json.load(f)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mongo", choices=["none", "memory", "url"], default="none")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--scenarios", nargs="*", help="subset of scenario names")
+    parser.add_argument("--stub-latency-ms", type=float, default=100)
+    parser.add_argument("--stub-error-rate", type=float, default=0.0)
+    parser.add_argument("--image-kb", type=int, default=256)
+    parser.add_argument("--upstream", choices=["live", "record", "replay"], default="live")
+    parser.add_argument("--cassette", default=os.path.join(BENCH_DIR, "cassette"))
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--verbose", action="store_true", help="show server logs")
+    args = parser.parse_args()
+
+    profile = f"{args.mongo}-c{args.concurrency}" + (f"-{args.upstream}" if args.upstream == "replay" else "")
+    processes = start_processes(args)
+    try:
+        print(f"profile {profile}, {args.requests} requests per scenario")
+        print(f"{'scenario':<15}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'rss MB':>10}{'errors':>8}")
+        results = asyncio.run(run_all(args, processes[1].pid))
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    baselines = load_baselines()
+    if args.update_baseline:
+        failed = [name for name, result in results.items() if result["errors"]]
+        if failed:
+            print(f"❌ Not recording a baseline with errors in {', '.join(failed)}")
+            return 1
+        baselines[profile] = {**baselines.get(profile, {}), **results}
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline for {profile} written to {BASELINE_FILE}")
+        return 0
+
+    if profile not in baselines:
+        print(f"No baseline for {profile}; run with --update-baseline to record one")
+        return 0
+    regressions = compare(results, baselines[profile], args.tolerance)
+    for regression in regressions:
+        print(f"❌ REGRESSION {regression}")
+    if not regressions:
+        print(f"✅ Within {args.tolerance:.0%} of baseline")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""Content-addressed blob storage on GridFS.
+
+Blobs are written chunk by chunk while their SHA-256 is computed, so uploads
+never sit in memory as a whole. Identical content is stored once: the
+`sha256` field of `blobs.files` has a unique index and a finished upload
+that collides with an existing blob is discarded in favour of it. Every
+write or dedupe hit extends the blob's `expire_at` (see retention.py).
+"""
+import hashlib
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+
+from motor.motor_asyncio import AsyncIOMotorGridFSBucket
+from pymongo.errors import DuplicateKeyError
+
+import retention
+from media import ImageData, StoredImage, image_from_doc
+
+BUCKET_NAME = "blobs"
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+GRIDFS_CHUNK_BYTES = 255 * 1024
+DOWNLOAD_CHUNK_BYTES = 4 * GRIDFS_CHUNK_BYTES
+ALLOWED_UPLOAD_PREFIXES = ("image/", "video/")
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+class BlobDigestMismatch(Exception):
+    pass
+
+
+def bucket(db) -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name=BUCKET_NAME, chunk_size_bytes=GRIDFS_CHUNK_BYTES)
+
+
+async def ensure_indexes(db) -> None:
+    await db[f"{BUCKET_NAME}.files"].create_index("sha256", unique=True, sparse=True)
+
+
+def blob_info(file_doc: Dict[str, Any], deduplicated: bool = False) -> Dict[str, Any]:
+    metadata = file_doc.get("metadata") or {}
+    return {
+        "blob_id": file_doc["sha256"],
+        "size": file_doc["length"],
+        "content_type": metadata.get("content_type", "application/octet-stream"),
+        "filename": file_doc.get("filename"),
+        "deduplicated": deduplicated,
+    }
+
+
+async def find_blob(db, sha256: str) -> Optional[Dict[str, Any]]:
+    return await db[f"{BUCKET_NAME}.files"].find_one({"sha256": sha256})
+
+
+async def touch(db, sha256: str) -> Optional[Dict[str, Any]]:
+    """Find a blob and keep it alive for as long as a new reference to it"""
+    expire_at = retention.expires_at()
+    if expire_at is None:
+        return await find_blob(db, sha256)
+    return await db[f"{BUCKET_NAME}.files"].find_one_and_update(
+        {"sha256": sha256}, {"$max": {"expire_at": expire_at}}
+    )
+
+
+async def store_stream(db, chunks: AsyncIterator[bytes], content_type: str, filename: str = "upload",
+                       max_bytes: int = MAX_UPLOAD_BYTES, expected_sha256: Optional[str] = None,
+                       metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Stream `chunks` into GridFS, hashing as it goes; returns `blob_info`"""
+    if expected_sha256:
+        # The client told us the hash up front: skip the transfer entirely
+        existing = await touch(db, expected_sha256)
+        if existing:
+            return blob_info(existing, deduplicated=True)
+
+    hasher = hashlib.sha256()
+    size = 0
+    grid_in = bucket(db).open_upload_stream(
+        filename, metadata={"content_type": content_type, **(metadata or {})}
+    )
+    try:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > max_bytes:
+                raise BlobTooLarge(f"Upload exceeds {max_bytes} bytes")
+            hasher.update(chunk)
+            await grid_in.write(chunk)
+
+        digest = hasher.hexdigest()
+        if expected_sha256 and digest != expected_sha256:
+            raise BlobDigestMismatch("Uploaded content does not match the declared SHA-256")
+
+        existing = await touch(db, digest)
+        if existing:
+            await grid_in.abort()
+            return blob_info(existing, deduplicated=True)
+
+        await grid_in.set("sha256", digest)
+        await grid_in.set("expire_at", retention.expires_at())
+        try:
+            await grid_in.close()
+        except DuplicateKeyError:
+            # A concurrent upload of the same content won the race
+            await grid_in.abort()
+            return blob_info(await touch(db, digest), deduplicated=True)
+    except BaseException:
+        if not grid_in.closed:
+            await grid_in.abort()
+        raise
+
+    return blob_info(await find_blob(db, digest))
+
+
+async def store_bytes(db, data: bytes, content_type: str, filename: str = "blob",
+                      metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    async def single():
+        yield data
+
+    return await store_stream(db, single(), content_type, filename=filename,
+                              max_bytes=len(data), metadata=metadata)
+
+
+async def store_image(db, image: ImageData, generation_id: str) -> Dict[str, Any]:
+    """Store a generated image; returns the reference kept on the generation"""
+    blob = await store_bytes(db, image.data, image.mime_type, filename=f"{generation_id}",
+                             metadata={"generation_id": generation_id})
+    return {"blob_id": blob["blob_id"], "mime_type": image.mime_type, "size": blob["size"]}
+
+
+async def read_blob(db, sha256: str) -> Optional[bytes]:
+    file_doc = await find_blob(db, sha256)
+    if file_doc is None:
+        return None
+    grid_out = await bucket(db).open_download_stream(file_doc["_id"])
+    return await grid_out.read()
+
+
+async def load_image(db, entry: Any) -> Optional[StoredImage]:
+    """Resolve an `images` entry of a generation document to image data"""
+    if isinstance(entry, dict) and "blob_id" in entry:
+        data = await read_blob(db, entry["blob_id"])
+        return ImageData(entry["mime_type"], data) if data is not None else None
+    return image_from_doc(entry)
+
+
+async def open_blob(db, sha256: str):
+    """Return (file document, async chunk iterator) or (None, None)"""
+    file_doc = await find_blob(db, sha256)
+    if file_doc is None:
+        return None, None
+
+    async def chunks():
+        grid_out = await bucket(db).open_download_stream(file_doc["_id"])
+        while True:
+            chunk = await grid_out.read(DOWNLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            yield chunk
+
+    return file_doc, chunks()
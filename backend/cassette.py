@@ -0,0 +1,148 @@
+"""Record/replay transports for the shared provider client (see upstream.py).
+
+A cassette is `requests.jsonl` (one line per exchange, no request headers,
+so no credentials) plus `bodies/`, where bodies are stored once per SHA-256
+and zlib-compressed when that helps. Replay matches on method, URL path and
+request body hash, ignoring host and query string so a cassette survives a
+different API base; repeated matches (polling) are served in recorded order,
+the last one repeating once they run out.
+
+Replay keeps the recorded shape of each response in time: its headers arrive
+after `headers_seconds`, its body once `total_seconds` have passed.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import defaultdict, deque
+from typing import Any, AsyncIterator, Deque, Dict, Tuple
+
+import httpx
+import orjson
+
+UPSTREAM_REPLAY_SPEED = float(os.getenv("UPSTREAM_REPLAY_SPEED", "1"))
+
+# Session cookies are the only credentials a provider sends back; every other header is kept
+UNRECORDED_RESPONSE_HEADERS = ("set-cookie",)
+
+
+class ReplayMiss(httpx.TransportError):
+    """The cassette has no response for a request; fails it like a network error"""
+
+
+def _match_key(method: str, url: httpx.URL, body: bytes) -> str:
+    return f"{method} {url.path} {hashlib.sha256(body).hexdigest()[:16]}"
+
+
+class Cassette:
+    def __init__(self, path: str):
+        self.path = path
+        self.bodies = os.path.join(path, "bodies")
+        self.index = os.path.join(path, "requests.jsonl")
+        self._lock = threading.Lock()
+
+    def _body_path(self, digest: str) -> str:
+        return os.path.join(self.bodies, digest[:2], digest)
+
+    def write_body(self, body: bytes) -> Tuple[str, bool]:
+        digest = hashlib.sha256(body).hexdigest()
+        path = self._body_path(digest)
+        compressed = zlib.compress(body, 6)
+        is_compressed = len(compressed) < len(body) * 0.9
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(compressed if is_compressed else body)
+        return digest, is_compressed
+
+    def read_body(self, digest: str, is_compressed: bool) -> bytes:
+        with open(self._body_path(digest), "rb") as f:
+            data = f.read()
+        return zlib.decompress(data) if is_compressed else data
+
+    def append(self, entry: Dict[str, Any]) -> None:
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self.index, "ab") as f:
+                f.write(orjson.dumps(entry) + b"\n")
+
+    def load(self) -> Dict[str, Deque[Dict[str, Any]]]:
+        entries: Dict[str, Deque[Dict[str, Any]]] = defaultdict(deque)
+        with open(self.index, "rb") as f:
+            for line in f:
+                entry = orjson.loads(line)
+                entries[entry["key"]].append(entry)
+        return entries
+
+
+class RecordingTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, wrapped: httpx.AsyncBaseTransport):
+        self.cassette = cassette
+        self.wrapped = wrapped
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        started = time.perf_counter()
+        response = await self.wrapped.handle_async_request(request)
+        headers_after = time.perf_counter() - started
+        # Buffers the whole body, so recording large video downloads costs memory
+        content = b"".join([chunk async for chunk in response.aiter_raw()])
+        await response.aclose()
+        total = time.perf_counter() - started
+
+        headers = response.headers.multi_items()
+        digest, is_compressed = await asyncio.to_thread(self.cassette.write_body, content)
+        await asyncio.to_thread(self.cassette.append, {
+            "key": _match_key(request.method, request.url, body),
+            "method": request.method,
+            "url": str(request.url.copy_with(query=None)),
+            "status": response.status_code,
+            "headers": [(name, value) for name, value in headers if name.lower() not in UNRECORDED_RESPONSE_HEADERS],
+            "body": digest,
+            "compressed": is_compressed,
+            "size": len(content),
+            "headers_seconds": round(headers_after, 4),
+            "total_seconds": round(total, 4),
+            "recorded_at": time.time(),
+        })
+        # Raw bytes, still content-encoded; the client decodes them as it would live ones
+        return httpx.Response(response.status_code, headers=headers, content=content)
+
+    async def aclose(self) -> None:
+        await self.wrapped.aclose()
+
+
+class DelayedBody(httpx.AsyncByteStream):
+    """A recorded body that arrives `delay` seconds after the response headers"""
+
+    def __init__(self, content: bytes, delay: float):
+        self.content = content
+        self.delay = delay
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if self.delay > 0:
+            await asyncio.sleep(self.delay)
+        yield self.content
+
+
+class ReplayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, cassette: Cassette, speed: float = UPSTREAM_REPLAY_SPEED):
+        self.cassette = cassette
+        self.speed = speed
+        self.entries = cassette.load()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        body = await request.aread()
+        key = _match_key(request.method, request.url, body)
+        queue = self.entries.get(key)
+        if not queue:
+            raise ReplayMiss(f"No recorded response for {request.method} {request.url.path}")
+        entry = queue.popleft() if len(queue) > 1 else queue[0]
+        headers_seconds = entry.get("headers_seconds", entry["total_seconds"])
+        if self.speed:
+            await asyncio.sleep(headers_seconds * self.speed)
+        content = await asyncio.to_thread(self.cassette.read_body, entry["body"], entry["compressed"])
+        body_seconds = (entry["total_seconds"] - headers_seconds) * self.speed
+        return httpx.Response(entry["status"], headers=entry["headers"], stream=DelayedBody(content, body_seconds))
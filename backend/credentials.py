@@ -0,0 +1,192 @@
+"""Pools of upstream API keys.
+
+A provider configured with several keys (`XAI_API_KEYS=key1,key2`, falling
+back to the single `XAI_API_KEY`) spreads its calls over all of them: each
+call takes the least-loaded usable key, i.e. the one with the fewest calls
+in flight and in the last minute. A key that gets a 429 is quarantined for
+the upstream's Retry-After (doubling on repeats), one that gets a 401/403
+for longer, so a revoked or exhausted key stops taking traffic without a
+restart. Keys are never logged or reported; stats use a short fingerprint.
+"""
+import hashlib
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, List, Mapping, Optional
+
+logger = logging.getLogger(__name__)
+
+RATE_WINDOW_SECONDS = 60.0
+QUARANTINE_RATE_LIMITED_SECONDS = float(os.getenv("KEY_QUARANTINE_429_SECONDS", "30"))
+QUARANTINE_MAX_SECONDS = float(os.getenv("KEY_QUARANTINE_MAX_SECONDS", "600"))
+QUARANTINE_UNAUTHORIZED_SECONDS = float(os.getenv("KEY_QUARANTINE_AUTH_SECONDS", "900"))
+
+# Error texts SDKs use for the statuses we react to, when they don't expose the status code
+RATE_LIMITED_MARKERS = ("429", "resource_exhausted", "rate limit", "quota")
+UNAUTHORIZED_MARKERS = ("401", "403", "permission_denied", "api key not valid", "unauthenticated")
+
+
+class NoKeyAvailable(Exception):
+    pass
+
+
+class ApiKey:
+    def __init__(self, secret: str, requests_per_minute: int = 0):
+        self.secret = secret
+        self.key_id = "key-" + hashlib.sha256(secret.encode()).hexdigest()[:8]
+        self.requests_per_minute = requests_per_minute
+        self.recent: Deque[float] = deque()
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.rate_limited = 0
+        self.unauthorized = 0
+        self.quarantined_until = 0.0
+        self.quarantine_seconds = QUARANTINE_RATE_LIMITED_SECONDS
+        self.upstream_remaining: Optional[int] = None
+
+    def _trim(self, now: float) -> None:
+        while self.recent and self.recent[0] <= now - RATE_WINDOW_SECONDS:
+            self.recent.popleft()
+
+    def usable(self, now: float) -> bool:
+        if now < self.quarantined_until:
+            return False
+        self._trim(now)
+        return not self.requests_per_minute or len(self.recent) < self.requests_per_minute
+
+    def load(self) -> tuple:
+        return (self.in_flight, len(self.recent))
+
+    def quarantine(self, seconds: float, reason: str) -> None:
+        self.quarantined_until = time.monotonic() + seconds
+        logger.warning(f"API key {self.key_id} quarantined for {seconds:.0f}s ({reason})")
+
+    def observe(self, status_code: int, headers: Optional[Mapping[str, str]] = None) -> None:
+        """Record the upstream response to a call made with this key"""
+        headers = headers or {}
+        remaining = headers.get("x-ratelimit-remaining-requests")
+        if remaining is not None and remaining.isdigit():
+            self.upstream_remaining = int(remaining)
+            if self.upstream_remaining == 0 and status_code < 400:
+                # Upstream told us this was the last call in its window
+                self.quarantine(self.quarantine_seconds, "rate limit window exhausted")
+        if status_code == 429:
+            self.rate_limited += 1
+            retry_after = headers.get("retry-after", "")
+            seconds = float(retry_after) if retry_after.isdigit() else self.quarantine_seconds
+            self.quarantine(min(seconds, QUARANTINE_MAX_SECONDS), "rate limited")
+            self.quarantine_seconds = min(self.quarantine_seconds * 2, QUARANTINE_MAX_SECONDS)
+        elif status_code in (401, 403):
+            self.unauthorized += 1
+            self.quarantine(QUARANTINE_UNAUTHORIZED_SECONDS, f"HTTP {status_code}")
+        elif status_code < 400:
+            self.quarantine_seconds = QUARANTINE_RATE_LIMITED_SECONDS
+        if status_code >= 400:
+            self.failures += 1
+
+    def observe_error(self, error: BaseException) -> None:
+        """Classify an SDK exception that carries no status code"""
+        message = str(error).lower()
+        if any(marker in message for marker in UNAUTHORIZED_MARKERS):
+            self.observe(401)
+        elif any(marker in message for marker in RATE_LIMITED_MARKERS):
+            self.observe(429)
+        else:
+            self.failures += 1
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        self._trim(now)
+        return {
+            "key_id": self.key_id,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "calls_last_minute": len(self.recent),
+            "failures": self.failures,
+            "rate_limited": self.rate_limited,
+            "unauthorized": self.unauthorized,
+            "quarantined_seconds": max(0, round(self.quarantined_until - now)),
+            "upstream_remaining": self.upstream_remaining,
+        }
+
+
+class KeyLease:
+    """One call's use of a key"""
+
+    def __init__(self, key: ApiKey):
+        self.key = key
+        self.secret = key.secret
+        self.observed = False
+
+    def observe(self, status_code: int, headers: Optional[Mapping[str, str]] = None) -> None:
+        self.observed = True
+        self.key.observe(status_code, headers)
+
+
+class KeyPool:
+    def __init__(self, provider: str, secrets: List[str], requests_per_minute: int = 0):
+        self.provider = provider
+        self.keys = [ApiKey(secret, requests_per_minute) for secret in dict.fromkeys(secrets)]
+
+    def __bool__(self) -> bool:
+        return bool(self.keys)
+
+    def acquire(self) -> ApiKey:
+        if not self.keys:
+            raise NoKeyAvailable(f"No {self.provider} API key configured")
+        now = time.monotonic()
+        candidates = [key for key in self.keys if key.usable(now)]
+        if not candidates:
+            raise NoKeyAvailable(f"All {self.provider} API keys are rate limited or quarantined")
+        key = min(candidates, key=ApiKey.load)
+        key.in_flight += 1
+        key.calls += 1
+        key.recent.append(now)
+        return key
+
+    @contextmanager
+    def use(self):
+        """Lease a key for one upstream call; errors raised by the call are attributed to it"""
+        key = self.acquire()
+        lease = KeyLease(key)
+        try:
+            yield lease
+        except Exception as e:
+            if not lease.observed:
+                key.observe_error(e)
+            raise
+        finally:
+            key.in_flight -= 1
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.monotonic()
+        return [key.stats(now) for key in self.keys]
+
+
+def _secrets_from_env(name: str) -> List[str]:
+    pooled = os.getenv(f"{name}S", "")
+    secrets = [secret.strip() for secret in pooled.split(",") if secret.strip()]
+    if not secrets and os.getenv(name):
+        secrets = [os.getenv(name)]
+    return secrets
+
+
+def _pool_from_env(provider: str, env_name: str) -> KeyPool:
+    rpm = int(os.getenv(f"{provider.upper()}_KEY_RPM", "0"))
+    return KeyPool(provider, _secrets_from_env(env_name), rpm)
+
+
+POOLS = {
+    "gemini": _pool_from_env("gemini", "GEMINI_API_KEY"),
+    "xai": _pool_from_env("xai", "XAI_API_KEY"),
+}
+
+
+def pool(provider: str) -> KeyPool:
+    return POOLS[provider]
+
+
+def stats() -> Dict[str, List[Dict[str, Any]]]:
+    return {provider: key_pool.stats() for provider, key_pool in POOLS.items()}
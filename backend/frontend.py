@@ -0,0 +1,204 @@
+"""Serving the React build (frontend/build) from the API process.
+
+Mounted at `/` when SERVE_FRONTEND is set, after every API route.
+
+- Compressible files are served as brotli or gzip when the client accepts
+  it. A `.br`/`.gz` file next to the original is used when it is at least
+  as new as the original (see `precompress`). Otherwise the variant is
+  compressed in the background into FRONTEND_COMPRESS_CACHE, and the
+  original is served until it is ready.
+- Content-hashed files (`main.3f2a1b4c.js`) are cached for a year as
+  immutable. Everything else, `index.html` included, is revalidated with
+  its ETag and answered with 304 when unchanged.
+- Extensionless paths that aren't files get `index.html`, so client-side
+  routes survive a reload. Missing assets and `/api/*` paths stay 404.
+
+    python frontend.py precompress ../frontend/build    # after `yarn build`
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Set, Tuple
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+import http_cache
+
+try:
+    import brotli
+except ImportError:  # gzip only; prebuilt .br files are still served
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+SERVE_FRONTEND = os.getenv("SERVE_FRONTEND", "false").lower() in ("1", "true", "yes")
+FRONTEND_BUILD_DIR = os.getenv(
+    "FRONTEND_BUILD_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "frontend", "build"),
+)
+FRONTEND_COMPRESS_CACHE = os.getenv("FRONTEND_COMPRESS_CACHE", os.path.join(tempfile.gettempdir(), "lotaya-frontend"))
+
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "application/manifest+json",
+                      "application/xml", "image/svg+xml", "application/wasm")
+# Brotli first: typically 15-20% smaller than gzip for JS and CSS
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# CRA's `name.<8+ hex>.ext` and `name.<hex>.chunk.ext`
+HASHED_NAME = re.compile(r"\.[0-9a-f]{8,}\.(chunk\.)?[a-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def compressible(path: str) -> bool:
+    media_type, encoding = mimetypes.guess_type(path)
+    return encoding is None and (media_type or "").startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def accepted_encodings(headers: Headers) -> List[str]:
+    accepted = []
+    for part in headers.get("accept-encoding", "").split(","):
+        name, _, params = part.strip().partition(";")
+        params = params.replace(" ", "")
+        if name and params not in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            accepted.append(name.lower())
+    return accepted
+
+
+def precompress(directory: str) -> int:
+    """Write `.br` (if brotli is installed) and `.gz` next to every compressible file"""
+    written = 0
+    for root, _dirs, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            if not compressible(path) or os.path.getsize(path) < MIN_COMPRESS_BYTES:
+                continue
+            with open(path, "rb") as f:
+                data = f.read()
+            for encoding, suffix in ENCODINGS:
+                if encoding == "br" and brotli is None:
+                    continue
+                with open(path + suffix, "wb") as f:
+                    f.write(compress(data, encoding))
+                written += 1
+    return written
+
+
+class FrontendFiles(StaticFiles):
+    def __init__(self, directory: str = FRONTEND_BUILD_DIR, cache_dir: str = FRONTEND_COMPRESS_CACHE):
+        super().__init__(directory=directory, html=True)
+        self.cache_dir = cache_dir
+        self._compressor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="frontend-compress")
+        self._pending: Set[str] = set()
+        self._lock = threading.Lock()
+
+    async def get_response(self, path: str, scope) -> FileResponse:
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as e:
+            if e.status_code != 404 or not self.is_client_route(path):
+                raise
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, "index.html")
+        if stat_result is None:
+            raise HTTPException(status_code=404)
+        return self.file_response(full_path, stat_result, scope)
+
+    @staticmethod
+    def is_client_route(path: str) -> bool:
+        first = path.split(os.sep, 1)[0]
+        return first not in ("api", "static") and "." not in os.path.basename(path)
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200):
+        request_headers = Headers(scope=scope)
+        full_path = str(full_path)
+        media_type = mimetypes.guess_type(full_path)[0] or "text/plain"
+        cache_control = IMMUTABLE if HASHED_NAME.search(os.path.basename(full_path)) else REVALIDATE
+        headers = {"cache-control": cache_control}
+
+        served_path, served_stat, encoding = full_path, stat_result, None
+        if compressible(full_path) and stat_result.st_size >= MIN_COMPRESS_BYTES:
+            headers["vary"] = "Accept-Encoding"
+            variant = self.variant(full_path, stat_result, accepted_encodings(request_headers))
+            if variant is not None:
+                served_path, served_stat, encoding = variant
+                headers["content-encoding"] = encoding
+
+        # The ETag comes from the served file's stat, so each encoding has its own
+        response = FileResponse(served_path, status_code=status_code, stat_result=served_stat, method=scope["method"],
+                                headers=headers, media_type=media_type)
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def is_not_modified(self, response_headers: Headers, request_headers: Headers) -> bool:
+        # Starlette's own check only matches a single exact tag
+        return http_cache.not_modified(request_headers, response_headers.get("etag", ""),
+                                       response_headers.get("last-modified"))
+
+    def variant(self, full_path: str, stat_result: os.stat_result,
+                accepted: List[str]) -> Optional[Tuple[str, os.stat_result, str]]:
+        """An up-to-date compressed copy in an accepted encoding, if one exists yet"""
+        for encoding, suffix in ENCODINGS:
+            if encoding not in accepted:
+                continue
+            for candidate in (full_path + suffix, self.cache_path(full_path, stat_result, suffix)):
+                try:
+                    candidate_stat = os.stat(candidate)
+                except OSError:
+                    continue
+                if candidate_stat.st_mtime >= stat_result.st_mtime:
+                    return candidate, candidate_stat, encoding
+            if encoding != "br" or brotli is not None:
+                self.schedule(full_path, stat_result, encoding, suffix)
+        return None
+
+    def cache_path(self, full_path: str, stat_result: os.stat_result, suffix: str) -> str:
+        key = hashlib.sha1(f"{full_path}\0{stat_result.st_mtime_ns}\0{stat_result.st_size}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + suffix)
+
+    def schedule(self, full_path: str, stat_result: os.stat_result, encoding: str, suffix: str) -> None:
+        target = self.cache_path(full_path, stat_result, suffix)
+        with self._lock:
+            if target in self._pending:
+                return
+            self._pending.add(target)
+        self._compressor.submit(self._compress_file, full_path, target, encoding)
+
+    def _compress_file(self, full_path: str, target: str, encoding: str) -> None:
+        try:
+            with open(full_path, "rb") as f:
+                data = compress(f.read(), encoding)
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Written aside and renamed, so a reader never sees a partial file
+            temporary = f"{target}.{threading.get_ident()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, target)
+        except OSError as e:
+            logger.error(f"Could not compress {full_path}: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(target)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "precompress":
+        sys.exit(f"usage: {sys.argv[0]} precompress [build directory]")
+    count = precompress(sys.argv[2] if len(sys.argv) > 2 else FRONTEND_BUILD_DIR)
+    print(f"Wrote {count} compressed file(s)" + ("" if brotli else " (gzip only: brotli is not installed)"))
@@ -0,0 +1,153 @@
+"""Conditional GET helpers and the in-process cache of finished generations.
+
+Read endpoints send an ETag (and Last-Modified when the resource can no
+longer change) and answer a matching If-None-Match / If-Modified-Since with
+304 before doing any further work. A generation is immutable once
+`completed` or `failed`, so it is cached in two LRUs: a compact record (see
+records.py) for up to GENERATION_CACHE_MAX_ENTRIES generations, which
+answers 304s and locates the images without Mongo, and the image bytes of
+the most recent ones within GENERATION_CACHE_MAX_MB, which skip GridFS too.
+"""
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from fastapi.responses import Response
+from starlette.datastructures import Headers
+
+from media import StoredImage
+from records import GenerationRecord
+
+GENERATION_CACHE_MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", "50000"))
+GENERATION_CACHE_MAX_BYTES = int(os.getenv("GENERATION_CACHE_MAX_MB", "64")) * 1024 * 1024
+# Bounds how long a cached generation outlives its deletion by retention
+GENERATION_CACHE_TTL_SECONDS = float(os.getenv("GENERATION_CACHE_TTL_SECONDS", "600"))
+TERMINAL_STATUSES = ("completed", "failed")
+TERMINAL_CACHE_CONTROL = "private, max-age=3600"
+
+
+def etag(*parts: Any) -> str:
+    digest = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()}"'
+
+
+def http_date(value: datetime) -> str:
+    # Mongo hands back its own UTC tzinfo (or naive UTC); format_datetime wants timezone.utc
+    value = value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+    return format_datetime(value, usegmt=True)
+
+
+def etag_matches(if_none_match: str, current: str) -> bool:
+    """Weak comparison against an If-None-Match list, as RFC 9110 asks for GET"""
+    current = current.removeprefix("W/")
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in candidates or current in candidates
+
+
+def not_modified(request_headers: Headers, current_etag: str, last_modified: Optional[str] = None) -> bool:
+    if_none_match = request_headers.get("if-none-match")
+    if if_none_match is not None:
+        # If-None-Match takes precedence; If-Modified-Since is ignored when it is present
+        return etag_matches(if_none_match, current_etag)
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_modified_since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+class CachedGeneration(NamedTuple):
+    record: GenerationRecord
+    # None when only the record is cached
+    images: Optional[List[StoredImage]]
+
+    @property
+    def headers(self) -> Dict[str, str]:
+        return self.record.headers(TERMINAL_CACHE_CONTROL)
+
+
+def _image_size(image: StoredImage) -> int:
+    return len(image) if isinstance(image, str) else len(image.data)
+
+
+class GenerationCache:
+    def __init__(self, max_entries: int = GENERATION_CACHE_MAX_ENTRIES, max_bytes: int = GENERATION_CACHE_MAX_BYTES,
+                 ttl_seconds: float = GENERATION_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.records: "OrderedDict[str, GenerationRecord]" = OrderedDict()
+        self.payloads: "OrderedDict[str, List[StoredImage]]" = OrderedDict()
+        self.payload_sizes: Dict[str, int] = {}
+        self.bytes = 0
+        self.hits = 0
+        self.record_hits = 0
+        self.misses = 0
+
+    def get(self, generation_id: str) -> Optional[CachedGeneration]:
+        record = self.records.get(generation_id)
+        if record is not None and time.monotonic() - record.loaded_at > self.ttl_seconds:
+            self._drop(generation_id)
+            record = None
+        if record is None:
+            self.misses += 1
+            return None
+        self.records.move_to_end(generation_id)
+        images = self.payloads.get(generation_id)
+        if images is None:
+            self.record_hits += 1
+        else:
+            self.payloads.move_to_end(generation_id)
+            self.hits += 1
+        return CachedGeneration(record, images)
+
+    def put(self, record: GenerationRecord, images: Optional[List[StoredImage]] = None) -> None:
+        generation_id = record.generation_id
+        self._drop(generation_id)
+        self.records[generation_id] = record
+        while len(self.records) > self.max_entries:
+            self._drop(next(iter(self.records)))
+        if images is not None:
+            self.put_images(generation_id, images)
+
+    def put_images(self, generation_id: str, images: List[StoredImage]) -> None:
+        """Keep the payload of a cached record, within the byte budget"""
+        size = sum(_image_size(image) for image in images)
+        # One huge generation shouldn't flush everything else
+        if generation_id not in self.records or size > self.max_bytes // 8:
+            return
+        self._drop_payload(generation_id)
+        self.payloads[generation_id] = images
+        self.payload_sizes[generation_id] = size
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            self._drop_payload(next(iter(self.payloads)))
+
+    def _drop(self, generation_id: str) -> None:
+        self.records.pop(generation_id, None)
+        self._drop_payload(generation_id)
+
+    def _drop_payload(self, generation_id: str) -> None:
+        if self.payloads.pop(generation_id, None) is not None:
+            self.bytes -= self.payload_sizes.pop(generation_id)
+
+    def stats(self) -> Dict[str, object]:
+        return {"entries": len(self.records), "payloads": len(self.payloads), "bytes": self.bytes,
+                "max_bytes": self.max_bytes, "hits": self.hits, "record_hits": self.record_hits,
+                "misses": self.misses}
+
+
+generations = GenerationCache()
@@ -0,0 +1,165 @@
+"""Idempotency keys for generation POSTs.
+
+A client-supplied `Idempotency-Key` maps to the first generation started
+with it. The mapping lives in the `idempotency_keys` collection (the `_id`
+is the scoped key, so the unique index arbitrates between workers) and in
+an in-process LRU, so replays on the same worker don't touch the database.
+A replay of a finished request gets the original result; a replay of one
+still running waits for it instead of starting new work. Requests that fail
+release their key so the client can retry, and so does a request whose
+worker died: its key is taken over once the generation has failed or its
+lease has run out, instead of answering 409 until the record expires.
+"""
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import orjson
+from pymongo.errors import DuplicateKeyError
+
+import retention
+from lifecycle import LEASE_SECONDS, utcnow
+
+IDEMPOTENCY_TTL_SECONDS = int(float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24")) * 3600)
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "120"))
+LOCAL_CACHE_SIZE = 10000
+MAX_KEY_LENGTH = 255
+
+_local: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_finished: Dict[str, asyncio.Event] = {}
+
+
+class IdempotencyConflict(Exception):
+    pass
+
+
+class IdempotencyTimeout(Exception):
+    pass
+
+
+def fingerprint(body: Dict[str, Any]) -> str:
+    return hashlib.sha256(orjson.dumps(body, option=orjson.OPT_SORT_KEYS)).hexdigest()
+
+
+def record_id(scope: str, key: str) -> str:
+    return f"{scope}:{key}"
+
+
+async def ensure_indexes(db) -> None:
+    await retention.ensure_ttl_index(db.idempotency_keys, IDEMPOTENCY_TTL_SECONDS)
+
+
+def _remember(record: Dict[str, Any]) -> None:
+    _local[record["_id"]] = record
+    _local.move_to_end(record["_id"])
+    while len(_local) > LOCAL_CACHE_SIZE:
+        _local.popitem(last=False)
+
+
+async def _abandoned(db, record: Dict[str, Any]) -> bool:
+    """Whether an in-progress record's request died with its worker (crash, OOM kill)"""
+    now = utcnow()
+    generation = await db.generations.find_one({"generation_id": record["generation_id"]},
+                                               {"status": 1, "lease_owner": 1})
+    if generation is not None and generation.get("status") == "failed":
+        return True
+    if generation is not None and generation.get("lease_owner") is not None:
+        # Leased work is alive for as long as its worker heartbeats
+        return await db.generations.count_documents(
+            {"_id": generation["_id"], "lease_expires_at": {"$lte": now}}, limit=1) > 0
+    # Nothing heartbeats for it: the request had a lease period to hand off its work and finish
+    return await db.idempotency_keys.count_documents(
+        {"_id": record["_id"], "created_at": {"$lte": now - timedelta(seconds=LEASE_SECONDS)}}, limit=1) > 0
+
+
+async def claim(db, scope: str, key: str, body: Dict[str, Any], generation_id: str) -> Optional[Dict[str, Any]]:
+    """Bind `key` to `generation_id`; returns the earlier record if the key was already used"""
+    if len(key) > MAX_KEY_LENGTH:
+        raise IdempotencyConflict(f"Idempotency-Key longer than {MAX_KEY_LENGTH} characters")
+    rid = record_id(scope, key)
+    body_fingerprint = fingerprint(body)
+
+    existing = _local.get(rid)
+    while existing is None:
+        record = {"_id": rid, "fingerprint": body_fingerprint, "generation_id": generation_id,
+                  "status": "in_progress", "response": None, "created_at": utcnow()}
+        try:
+            if db is not None:
+                await db.idempotency_keys.insert_one(record)
+        except DuplicateKeyError:
+            existing = await db.idempotency_keys.find_one({"_id": rid})
+            if (existing is not None and existing["status"] == "in_progress" and rid not in _finished
+                    and await _abandoned(db, existing)):
+                await db.idempotency_keys.delete_one({"_id": rid, "generation_id": existing["generation_id"],
+                                                      "status": "in_progress"})
+                existing = None
+            # None: the owner released the key in between, so try to take it again
+            continue
+        _remember(record)
+        _finished[rid] = asyncio.Event()
+        return None
+
+    if existing["fingerprint"] != body_fingerprint:
+        raise IdempotencyConflict("Idempotency-Key was already used with a different request body")
+    if existing["status"] == "completed":
+        _remember(existing)
+    return existing
+
+
+async def finish(db, scope: str, key: str, response: Optional[Dict[str, Any]] = None) -> None:
+    rid = record_id(scope, key)
+    record = _local.get(rid)
+    if record is not None:
+        record.update(status="completed", response=response)
+    if db is not None:
+        await db.idempotency_keys.update_one({"_id": rid}, {"$set": {"status": "completed", "response": response}})
+    event = _finished.pop(rid, None)
+    if event:
+        event.set()
+
+
+async def release(db, scope: str, key: str) -> None:
+    """Forget a key whose request failed, so a retry starts fresh"""
+    rid = record_id(scope, key)
+    _local.pop(rid, None)
+    # Local waiters first: this also runs on cancellation, where the delete below may not get to finish
+    event = _finished.pop(rid, None)
+    if event:
+        event.set()
+    if db is not None:
+        await db.idempotency_keys.delete_one({"_id": rid})
+
+
+async def wait(db, record: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Wait for the original request; returns its final record, or None if it released the key"""
+    rid = record["_id"]
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    delay = 0.1
+    while record is not None and record["status"] != "completed":
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise IdempotencyTimeout("The original request with this Idempotency-Key is still in progress")
+        event = _finished.get(rid)
+        if event is not None:
+            # Running on this worker: no polling needed
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+            record = _local.get(rid)
+        elif db is not None:
+            await asyncio.sleep(min(delay, remaining))
+            delay = min(delay * 2, 2.0)
+            record = await db.idempotency_keys.find_one({"_id": rid})
+            if record is not None and record["status"] != "completed" and await _abandoned(db, record):
+                return None
+        else:
+            record = _local.get(rid)
+            if record is not None and record["status"] != "completed":
+                # Owner is gone (no event, no database): nothing to wait for
+                return None
+    return record
@@ -0,0 +1,244 @@
+"""Durable video generation jobs.
+
+Jobs live in the `video_jobs` collection, keyed by generation ID (scene jobs
+of a text-to-video pipeline carry a `scene` reference instead). A worker
+claims a due job by taking a lifecycle lease on it, runs one step (submit
+the task upstream, or poll it), writes progress back to the generation
+document and releases the lease together with the time of the next step. A
+job whose worker died is claimed again once its lease expires, so upstream
+tasks that were in flight resume polling after a restart.
+"""
+import asyncio
+import logging
+import os
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+import blobstore
+import lifecycle
+import metrics
+from lifecycle import WORKER_ID, utcnow
+from video_providers import UpstreamError, UpstreamStatus, get_provider, provider_by_name, stream_result
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = int(os.getenv("VIDEO_JOB_LEASE_SECONDS", "60"))
+WORKER_CONCURRENCY = int(os.getenv("VIDEO_WORKER_CONCURRENCY", "4"))
+MIN_POLL_SECONDS = float(os.getenv("VIDEO_POLL_MIN_SECONDS", "2"))
+MAX_POLL_SECONDS = float(os.getenv("VIDEO_POLL_MAX_SECONDS", "30"))
+MAX_ATTEMPTS = int(os.getenv("VIDEO_JOB_MAX_ATTEMPTS", "5"))
+IDLE_SECONDS = 1.0
+
+ACTIVE_STATUSES = ["queued", "submitted"]
+
+# Step functions for job kinds other than plain upstream video jobs
+STEP_HANDLERS = {}
+
+
+async def ensure_indexes(db) -> None:
+    await db.video_jobs.create_index([("status", 1), ("next_run_at", 1)])
+
+
+async def enqueue(db, job_id: str, model: str, job_input: Dict[str, Any], kind: str = "video", **fields) -> None:
+    now = utcnow()
+    await db.video_jobs.insert_one({
+        "_id": job_id,
+        "kind": kind,
+        "model": model,
+        "input": job_input,
+        "status": "queued",
+        "upstream_id": None,
+        "provider": None,
+        "attempts": 0,
+        "poll_interval": MIN_POLL_SECONDS,
+        "next_run_at": now,
+        "lease_owner": None,
+        "lease_expires_at": None,
+        "lease_epoch": 0,
+        "created_at": now,
+        "updated_at": now,
+        **fields,
+    })
+
+
+def next_poll_interval(interval: float, progressed: bool, eta_seconds: Optional[float]) -> float:
+    """Poll often while a task moves, back off while it sits in a queue"""
+    if eta_seconds is not None:
+        interval = eta_seconds / 2
+    elif progressed:
+        interval = interval * 0.75
+    else:
+        interval = interval * 1.5
+    return min(max(interval, MIN_POLL_SECONDS), MAX_POLL_SECONDS)
+
+
+async def claim(db) -> Optional[Dict[str, Any]]:
+    """Atomically lease the most overdue job, if any"""
+    return await lifecycle.claim(
+        db.video_jobs,
+        {"status": {"$in": ACTIVE_STATUSES}, "next_run_at": {"$lte": utcnow()}},
+        LEASE_SECONDS,
+        sort=[("next_run_at", 1)],
+    )
+
+
+async def release(db, job: Dict[str, Any], updates: Dict[str, Any]) -> bool:
+    return await lifecycle.release(db.video_jobs, job, updates)
+
+
+async def complete(db, job: Dict[str, Any], updates: Dict[str, Any]) -> bool:
+    return await lifecycle.complete(db.video_jobs, job, updates)
+
+
+async def still_owned(db, job: Dict[str, Any]) -> bool:
+    """Renew the lease after a slow upstream call; False if another worker took over"""
+    if await lifecycle.heartbeat(db.video_jobs, job, LEASE_SECONDS):
+        return True
+    logger.warning(f"Video job {job['_id']} lease lost by {WORKER_ID}, dropping step")
+    return False
+
+
+async def wake(db, job_id: str) -> None:
+    """Make a waiting job due now"""
+    await db.video_jobs.update_one({"_id": job_id, "status": {"$in": ACTIVE_STATUSES}}, {"$set": {"next_run_at": utcnow()}})
+
+
+async def update_target(db, job: Dict[str, Any], fields: Dict[str, Any]) -> None:
+    """Write job state to its generation document, or to its scene entry"""
+    scene = job.get("scene")
+    if scene is None:
+        await db.generations.update_one({"generation_id": job["_id"]}, {"$set": fields})
+        return
+    await db.generations.update_one(
+        {"generation_id": scene["generation_id"]},
+        {"$set": {f"scenes.{scene['index']}.{key}": value for key, value in fields.items()}},
+    )
+    if fields.get("status") in ("completed", "failed"):
+        await wake(db, scene["generation_id"])
+
+
+async def fail(db, job: Dict[str, Any], error: str) -> None:
+    logger.error(f"Video job {job['_id']} failed: {error}")
+    await update_target(db, job, {"status": "failed", "error": error})
+    await lifecycle.fail(db.video_jobs, job, error)
+
+
+async def _complete(db, job: Dict[str, Any], provider, status: UpstreamStatus) -> None:
+    video_url = status.result_url
+    request = provider.result_request(job["upstream_id"], status)
+    if request and request["url"]:
+        # Upstream result URLs expire or need credentials; keep our own copy. A large download can outlast
+        # the lease, so heartbeat it meanwhile and only write the result if the job is still ours
+        async with lifecycle.keep_alive(db.video_jobs, job, LEASE_SECONDS):
+            blob = await blobstore.store_stream(db, stream_result(request), "video/mp4", filename=f"{job['_id']}.mp4")
+        if not await still_owned(db, job):
+            return
+        video_url = f"/api/uploads/{blob['blob_id']}"
+    if job.get("cache_key"):
+        await db.scene_cache.update_one(
+            {"_id": job["cache_key"]},
+            {"$set": {"video_url": video_url, "model": job["model"], "created_at": utcnow()}},
+            upsert=True,
+        )
+    await update_target(db, job, {"status": "completed", "progress": 100, "video_url": video_url})
+    await complete(db, job, {"progress": 100})
+
+
+async def run_step(db, job: Dict[str, Any]) -> None:
+    """Advance one job by a single submit or poll"""
+    handler = STEP_HANDLERS.get(job.get("kind", "video"))
+    if handler is not None:
+        await handler(db, job)
+        return
+
+    now = utcnow()
+    try:
+        # A submitted task is polled where it was submitted, even if the model now maps elsewhere
+        provider = provider_by_name(job["provider"]) if job.get("upstream_id") else get_provider(job["model"])
+        if not job.get("upstream_id"):
+            upstream_id = await provider.submit(job["input"])
+            if not await still_owned(db, job):
+                return
+            await update_target(db, job, {"status": "processing", "progress": 0, "provider": provider.name, "upstream_id": upstream_id})
+            await release(db, job, {
+                "status": "submitted",
+                "upstream_id": upstream_id,
+                "provider": provider.name,
+                "attempts": 0,
+                "poll_interval": MIN_POLL_SECONDS,
+                "next_run_at": now + timedelta(seconds=MIN_POLL_SECONDS),
+            })
+            return
+
+        status = await provider.poll(job["upstream_id"])
+        if not await still_owned(db, job):
+            return
+        if status.state == "completed":
+            await _complete(db, job, provider, status)
+            return
+        if status.state == "failed":
+            await fail(db, job, status.error or "Upstream generation failed")
+            return
+
+        progressed = status.progress is not None and status.progress > job.get("progress", 0)
+        interval = next_poll_interval(job.get("poll_interval", MIN_POLL_SECONDS), progressed, status.eta_seconds)
+        updates = {"attempts": 0, "poll_interval": interval, "next_run_at": now + timedelta(seconds=interval)}
+        if status.progress is not None:
+            updates["progress"] = status.progress
+            await update_target(db, job, {"progress": status.progress})
+        await release(db, job, updates)
+    except Exception as e:
+        attempts = job.get("attempts", 0) + 1
+        if (isinstance(e, UpstreamError) and not e.retryable) or attempts >= MAX_ATTEMPTS:
+            await fail(db, job, str(e))
+            return
+        backoff = min(MIN_POLL_SECONDS * 2 ** attempts, MAX_POLL_SECONDS * 4)
+        logger.error(f"Video job {job['_id']} step failed (attempt {attempts}): {e}")
+        await release(db, job, {"attempts": attempts, "last_error": str(e), "next_run_at": now + timedelta(seconds=backoff)})
+
+
+class JobWorker:
+    """Runs WORKER_CONCURRENCY claim/step loops in this process"""
+
+    def __init__(self, db, concurrency: int = WORKER_CONCURRENCY):
+        self.db = db
+        self.concurrency = concurrency
+        self.tasks = []
+        self.wakeup = asyncio.Event()
+        self.stopping = False
+
+    def start(self) -> None:
+        self.tasks = [asyncio.create_task(self._loop()) for _ in range(self.concurrency)]
+        logger.info(f"Video job worker {WORKER_ID} started with {self.concurrency} loops")
+
+    async def stop(self) -> None:
+        self.stopping = True
+        self.wakeup.set()
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def notify(self) -> None:
+        """Wake idle loops after a job was enqueued locally"""
+        self.wakeup.set()
+
+    async def _loop(self) -> None:
+        while not self.stopping:
+            try:
+                job = await claim(self.db)
+            except Exception as e:
+                logger.error(f"Video job claim failed: {e}")
+                job = None
+            if job is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), IDLE_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                with metrics.IN_FLIGHT.labels(job.get("kind", "video")).track_inprogress():
+                    await run_step(self.db, job)
+            except Exception as e:
+                # The lease expires and another loop retries the step
+                logger.error(f"Video job {job['_id']} step aborted: {e}")
@@ -0,0 +1,116 @@
+"""Atomic, lease-based ownership of generation work across processes.
+
+Any document that is worked on (a generation, a video job) carries
+`lease_owner`, `lease_expires_at` and `lease_epoch`. `claim` takes the lease
+with a single find_one_and_update and bumps the epoch; every later write
+(`heartbeat`, `release`, `complete`, `fail`) is conditional on the owner and
+epoch still matching. A worker that stalled past its lease, on any node,
+therefore can't overwrite the work of whoever claimed the document next.
+"""
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+LEASE_SECONDS = int(os.getenv("GENERATION_LEASE_SECONDS", "60"))
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _free(now: datetime) -> Dict[str, Any]:
+    return {"$or": [{"lease_owner": None}, {"lease_expires_at": {"$lte": now}}]}
+
+
+def _owned(doc: Dict[str, Any]) -> Dict[str, Any]:
+    return {"_id": doc["_id"], "lease_owner": WORKER_ID, "lease_epoch": doc["lease_epoch"]}
+
+
+def new_lease(lease_seconds: int = LEASE_SECONDS) -> Dict[str, Any]:
+    """Lease fields for a document this worker creates and starts working on"""
+    return {"lease_owner": WORKER_ID, "lease_expires_at": utcnow() + timedelta(seconds=lease_seconds), "lease_epoch": 1}
+
+
+async def ensure_indexes(collection) -> None:
+    await collection.create_index([("status", 1), ("lease_expires_at", 1)])
+
+
+async def claim(collection, query: Dict[str, Any], lease_seconds: int = LEASE_SECONDS,
+                sort: Optional[List[Tuple[str, int]]] = None) -> Optional[Dict[str, Any]]:
+    """Lease one unowned (or abandoned) document matching `query`"""
+    now = utcnow()
+    return await collection.find_one_and_update(
+        {"$and": [query, _free(now)]},
+        {
+            "$set": {"lease_owner": WORKER_ID, "lease_expires_at": now + timedelta(seconds=lease_seconds)},
+            "$inc": {"lease_epoch": 1},
+        },
+        sort=sort,
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def heartbeat(collection, doc: Dict[str, Any], lease_seconds: int = LEASE_SECONDS) -> bool:
+    """Extend the lease; False means it was lost to another worker"""
+    result = await collection.update_one(
+        _owned(doc), {"$set": {"lease_expires_at": utcnow() + timedelta(seconds=lease_seconds)}}
+    )
+    return result.matched_count == 1
+
+
+async def release(collection, doc: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+    """Write `fields` and give up the lease"""
+    result = await collection.update_one(
+        _owned(doc),
+        {"$set": {**fields, "lease_owner": None, "lease_expires_at": None, "updated_at": utcnow()}},
+    )
+    return result.matched_count == 1
+
+
+async def complete(collection, doc: Dict[str, Any], fields: Dict[str, Any]) -> bool:
+    return await release(collection, doc, {**fields, "status": "completed", "completed_at": utcnow()})
+
+
+async def fail(collection, doc: Dict[str, Any], error: str, fields: Optional[Dict[str, Any]] = None) -> bool:
+    return await release(collection, doc, {**(fields or {}), "status": "failed", "error": error, "completed_at": utcnow()})
+
+
+async def reap(collection, query: Dict[str, Any], error: str) -> int:
+    """Fail documents matching `query` whose owner stopped heartbeating"""
+    now = utcnow()
+    result = await collection.update_many(
+        {**query, "lease_owner": {"$ne": None}, "lease_expires_at": {"$lte": now}},
+        {"$set": {"status": "failed", "error": error, "lease_owner": None, "lease_expires_at": None,
+                  "completed_at": now, "updated_at": now}},
+    )
+    return result.modified_count
+
+
+@asynccontextmanager
+async def keep_alive(collection, doc: Dict[str, Any], lease_seconds: int = LEASE_SECONDS):
+    """Heartbeat the lease on `doc` while the block runs"""
+    async def beat():
+        while True:
+            await asyncio.sleep(lease_seconds / 3)
+            try:
+                if not await heartbeat(collection, doc, lease_seconds):
+                    logger.warning(f"Lease on {doc['_id']} lost by {WORKER_ID}")
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat for {doc['_id']} failed: {e}")
+
+    task = asyncio.create_task(beat())
+    try:
+        yield
+    finally:
+        task.cancel()
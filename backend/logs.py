@@ -0,0 +1,175 @@
+"""Non-blocking, structured logging.
+
+`configure()` replaces the handlers on the root logger with a QueueHandler.
+A record costs the caller a rate-limit check, a shallow copy and a
+non-blocking put. Formatting, including tracebacks, and the write to stderr
+happen on the QueueListener's thread. When the queue is full the record is
+dropped and counted; the event loop never waits for the log sink.
+
+Records are JSON lines (LOG_FORMAT=json, the default) or plain text. A
+record logged inside a generation trace carries the trace's attributes
+(generation_id, model, lane) and the stage timings so far; `extra=` fields
+are included as well. Messages are cut at LOG_MAX_MESSAGE_CHARS, since
+exception strings can carry whole upstream response bodies.
+
+Each call site (file and line) gets a token bucket of LOG_RATE_PER_SECOND
+with a burst of LOG_RATE_BURST. Records beyond it are suppressed, and the
+next one let through reports how many were, so a provider outage logs a
+handful of "XAI image generation error" lines per second instead of
+thousands.
+"""
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+
+import tracing
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+# 0 disables rate limiting
+LOG_RATE_PER_SECOND = float(os.getenv("LOG_RATE_PER_SECOND", "5"))
+LOG_RATE_BURST = float(os.getenv("LOG_RATE_BURST", "20"))
+
+# Attributes every LogRecord has; anything else came from `extra=`
+STANDARD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+TEXT_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def _truncate(text: str) -> str:
+    if len(text) <= LOG_MAX_MESSAGE_CHARS:
+        return text
+    return f"{text[:LOG_MAX_MESSAGE_CHARS]}… [{len(text) - LOG_MAX_MESSAGE_CHARS} chars truncated]"
+
+
+class CallSiteRateLimit(logging.Filter):
+    """Token bucket per logging call site; suppressed records are counted"""
+
+    def __init__(self, rate: float = LOG_RATE_PER_SECOND, burst: float = LOG_RATE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[Tuple[str, int], list] = {}
+        self._lock = threading.Lock()
+        self.suppressed_total = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rate:
+            return True
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            # [tokens, last refill, suppressed since the last record let through]
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                self.suppressed_total += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Unlike the stock QueueHandler, formatting is left to the listener thread;
+        # only the request context, which lives in this thread's contextvars, is captured
+        record = logging.makeLogRecord(record.__dict__)
+        trace = tracing.current()
+        if trace is not None:
+            for name, value in trace.root.attributes.items():
+                if not hasattr(record, name):
+                    setattr(record, name, value)
+            timings: Dict[str, float] = {}
+            for span in trace.spans:
+                timings[span.name] = round(timings.get(span.name, 0.0) + span.duration_ms, 1)
+            if timings:
+                record.timings = timings
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    converter = time.gmtime
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _truncate(record.getMessage()),
+        }
+        for name, value in record.__dict__.items():
+            if name not in STANDARD_ATTRIBUTES:
+                entry[name] = value
+        if record.exc_info:
+            entry["exception"] = _truncate(self.formatException(record.exc_info))
+        return orjson.dumps(entry, default=str).decode()
+
+
+class TruncatingFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        text = _truncate(super().format(record))
+        suppressed = getattr(record, "suppressed", 0)
+        return f"{text} ({suppressed} similar suppressed)" if suppressed else text
+
+
+rate_limit = CallSiteRateLimit()
+_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(LOG_QUEUE_SIZE)
+handler = NonBlockingQueueHandler(_queue)
+handler.addFilter(rate_limit)
+
+
+def configure() -> None:
+    """Route the root logger through the queue; safe to call more than once"""
+    global _listener
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    if _listener is not None:
+        return
+    sink = logging.StreamHandler(sys.stderr)
+    sink.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TruncatingFormatter(TEXT_FORMAT))
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    _listener = logging.handlers.QueueListener(_queue, sink, respect_handler_level=True)
+    _listener.start()
+    atexit.register(shutdown)
+
+
+def shutdown() -> None:
+    """Flush what is queued and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def stats() -> Dict[str, int]:
+    return {"queued": _queue.qsize(), "dropped": handler.dropped, "suppressed": rate_limit.suppressed_total}
@@ -0,0 +1,124 @@
+"""Low-copy image payload handling.
+
+Providers hand back raw image bytes. The base64 data URLs the frontend expects
+are only produced while the response body is being written, one bounded chunk
+at a time, so a multi-megabyte image never exists as a full base64 `bytes`,
+`str` and JSON-encoded copy at the same time.
+"""
+import binascii
+from typing import Any, Dict, Iterator, NamedTuple, Optional, Sequence, Union
+
+import orjson
+from fastapi.responses import StreamingResponse
+
+# Raw bytes encoded per step; a multiple of 3 so encoded chunks concatenate
+# into one valid base64 string without padding in the middle
+B64_CHUNK_SIZE = 3 * 64 * 1024
+# Size of the reusable output buffer flushed to the client
+WRITE_BUFFER_SIZE = 256 * 1024
+
+
+class ImageData(NamedTuple):
+    mime_type: str
+    data: bytes
+
+
+# Either a raw image or an already-encoded data URL (documents written before
+# images moved out of the generation document)
+StoredImage = Union[ImageData, str]
+
+
+def encoded_length(size: int) -> int:
+    """Length of the base64 encoding of `size` raw bytes"""
+    return 4 * ((size + 2) // 3)
+
+
+def image_from_doc(value: Any) -> StoredImage:
+    """Convert an inline `images` entry of a generation document back to an image"""
+    if isinstance(value, dict):
+        return ImageData(value["mime_type"], bytes(value["data"]))
+    return value
+
+
+class _BufferedWriter:
+    """Packs small and large pieces into one preallocated buffer"""
+
+    def __init__(self, size: int = WRITE_BUFFER_SIZE):
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.pos = 0
+
+    def write(self, piece: bytes) -> Iterator[bytes]:
+        piece = memoryview(piece)
+        while piece:
+            take = min(len(self.buffer) - self.pos, len(piece))
+            self.view[self.pos:self.pos + take] = piece[:take]
+            self.pos += take
+            piece = piece[take:]
+            if self.pos == len(self.buffer):
+                yield bytes(self.view)
+                self.pos = 0
+
+    def flush(self) -> Iterator[bytes]:
+        if self.pos:
+            yield bytes(self.view[:self.pos])
+            self.pos = 0
+
+
+def _data_url_prefix(mime_type: str) -> bytes:
+    # orjson escapes the mime type; drop the closing quote to keep the string open
+    return orjson.dumps(f"data:{mime_type};base64,")[:-1]
+
+
+def _image_length(image: StoredImage) -> int:
+    if isinstance(image, str):
+        return len(orjson.dumps(image))
+    return len(_data_url_prefix(image.mime_type)) + encoded_length(len(image.data)) + 1
+
+
+def _encode_image(image: StoredImage, writer: _BufferedWriter) -> Iterator[bytes]:
+    if isinstance(image, str):
+        yield from writer.write(orjson.dumps(image))
+        return
+    yield from writer.write(_data_url_prefix(image.mime_type))
+    view = memoryview(image.data)
+    for start in range(0, len(view), B64_CHUNK_SIZE):
+        yield from writer.write(binascii.b2a_base64(view[start:start + B64_CHUNK_SIZE], newline=False))
+    yield from writer.write(b'"')
+
+
+def json_with_images(payload: Dict[str, Any], images: Optional[Sequence[StoredImage]], key: str = "images") -> Iterator[bytes]:
+    """Encode `payload` as JSON with `key` holding `images` as data URLs, incrementally"""
+    head = orjson.dumps({k: v for k, v in payload.items() if k != key})
+    writer = _BufferedWriter()
+    if images is None:
+        yield from writer.write(head[:-1] + (b',' if len(head) > 2 else b'') + orjson.dumps(key) + b':null}')
+        yield from writer.flush()
+        return
+    yield from writer.write(head[:-1] + (b',' if len(head) > 2 else b'') + orjson.dumps(key) + b':[')
+    for index, image in enumerate(images):
+        if index:
+            yield from writer.write(b',')
+        yield from _encode_image(image, writer)
+    yield from writer.write(b']}')
+    yield from writer.flush()
+
+
+def json_with_images_length(payload: Dict[str, Any], images: Optional[Sequence[StoredImage]], key: str = "images") -> int:
+    """Exact byte length of `json_with_images` without encoding the images"""
+    head = orjson.dumps({k: v for k, v in payload.items() if k != key})
+    length = len(head) - 1 + (1 if len(head) > 2 else 0) + len(orjson.dumps(key)) + 1
+    if images is None:
+        return length + len(b'null}')
+    length += 1 + max(len(images) - 1, 0) + 2
+    return length + sum(_image_length(image) for image in images)
+
+
+def image_response(payload: Dict[str, Any], images: Optional[Sequence[StoredImage]], status_code: int = 200) -> StreamingResponse:
+    """Stream a JSON response whose `images` field is written chunk by chunk"""
+    return StreamingResponse(
+        json_with_images(payload, images),
+        status_code=status_code,
+        media_type="application/json",
+        headers={"content-length": str(json_with_images_length(payload, images))},
+    )
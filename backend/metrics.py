@@ -0,0 +1,222 @@
+"""Prometheus metrics for the API and its generation hot paths.
+
+Request, provider and Mongo metrics are plain prometheus_client instruments
+updated inline (a dict lookup and a lock per observation). State that other
+modules already keep — admission control, scheduler lanes, API key pools —
+is read only when /metrics is scraped, so it costs nothing per request.
+Set PROMETHEUS_MULTIPROC_DIR when running several uvicorn workers; instruments
+are then summed across workers, while the scrape-time state is that of the
+worker answering the scrape.
+"""
+import os
+import time
+from typing import Dict, Iterator
+
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               disable_created_metrics, generate_latest)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from pymongo import monitoring
+from starlette.routing import Match
+
+import admission
+import credentials
+import logs
+import quotas
+import scheduler
+import upstream
+
+# Halves the number of exported counter/histogram series
+disable_created_metrics()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1, 5)
+
+HTTP_REQUESTS = Counter("lotaya_http_requests_total", "HTTP requests", ["method", "route", "status"])
+HTTP_LATENCY = Histogram("lotaya_http_request_duration_seconds", "HTTP request latency until the response is sent",
+                         ["method", "route"], buckets=LATENCY_BUCKETS)
+PROVIDER_LATENCY = Histogram("lotaya_provider_call_duration_seconds", "Upstream provider call latency by outcome",
+                             ["provider", "outcome"], buckets=LATENCY_BUCKETS)
+PLACEHOLDER_IMAGES = Counter("lotaya_placeholder_images_total", "Placeholder images returned instead of real ones",
+                             ["provider", "reason"])
+IMAGES_PRODUCED = Counter("lotaya_images_produced_total", "Images returned by generation requests", ["model"])
+IMAGE_BYTES = Counter("lotaya_image_bytes_total", "Bytes of images returned by generation requests", ["model"])
+PROMPT_CACHE_LOOKUPS = Counter("lotaya_prompt_cache_lookups_total", "Similar-prompt cache lookups by result", ["result"])
+MONGO_LATENCY = Histogram("lotaya_mongo_command_duration_seconds", "MongoDB command latency",
+                          ["command", "outcome"], buckets=MONGO_BUCKETS)
+IN_FLIGHT = Gauge("lotaya_generations_in_flight", "Generation work running in this process", ["type"],
+                  multiprocess_mode="livesum")
+
+
+class ProviderCall:
+    """Time one upstream call; set `outcome` for results that aren't exceptions"""
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.outcome = "ok"
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.outcome == "ok":
+            self.outcome = classify_error(exc)
+        elapsed = time.perf_counter() - self.started
+        PROVIDER_LATENCY.labels(self.provider, self.outcome).observe(elapsed)
+        scheduler.observe(self.provider, elapsed, self.outcome)
+        return False
+
+
+def classify_error(error: BaseException) -> str:
+    if upstream.is_timeout(error):
+        return "timeout"
+    # SDK errors carry no status code, only the message
+    message = str(error).lower()
+    if any(marker in message for marker in credentials.RATE_LIMITED_MARKERS):
+        return "http_429"
+    return "error"
+
+
+def record_images(model: str, images) -> None:
+    IMAGES_PRODUCED.labels(model).inc(len(images))
+    IMAGE_BYTES.labels(model).inc(sum(len(image.data) for image in images))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Latency of every command the driver runs, via pymongo's command monitoring"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_LATENCY.labels(event.command_name, "ok").observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_LATENCY.labels(event.command_name, "error").observe(event.duration_micros / 1e6)
+
+
+class MetricsMiddleware:
+    """Count and time every HTTP request, labelled by route template"""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: Dict[object, str] = {}
+
+    def _route_label(self, scope) -> str:
+        endpoint = scope.get("endpoint")
+        if endpoint is not None:
+            label = self._routes.get(endpoint)
+            if label is None:
+                label = next((route.path for route in scope["app"].routes
+                              if getattr(route, "endpoint", None) is endpoint), None)
+                if label is None:
+                    # Mounted apps (the frontend) are labelled by their prefix
+                    label = next((f"{route.path}/*" for route in scope["app"].routes
+                                  if getattr(route, "app", None) is endpoint), "unmatched")
+                self._routes[endpoint] = label
+            return label
+        # Answered before routing (shed by admission control, 404s): match the template ourselves
+        for route in scope["app"].routes:
+            if route.matches(scope)[0] == Match.FULL:
+                return route.path
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = self._route_label(scope)
+            HTTP_LATENCY.labels(scope["method"], route).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(scope["method"], route, str(status[0])).inc()
+
+
+class RuntimeCollector:
+    """Scrape-time view of admission, quota, lane, key pool and log pipeline state"""
+
+    def collect(self) -> Iterator:
+        load = admission.monitor.snapshot()
+        lag = GaugeMetricFamily("lotaya_event_loop_lag_seconds", "Smoothed event loop lag")
+        lag.add_metric([], load["loop_lag_ms"] / 1000)
+        executor = GaugeMetricFamily("lotaya_executor_queue_depth", "Work items waiting for the default executor")
+        executor.add_metric([], load["executor_queue"])
+        shed = CounterMetricFamily("lotaya_admission_shed", "Requests rejected by admission control", labels=["reason"])
+        for reason, count in load["shed"].items():
+            shed.add_metric([reason], count)
+        yield from (lag, executor, shed)
+
+        quota_state = quotas.tracker.stats()
+        quota_rejected = CounterMetricFamily("lotaya_quota_rejections", "Requests rejected by per-client quotas",
+                                             labels=["limit"])
+        for limit, count in quota_state["rejected"].items():
+            quota_rejected.add_metric([limit], count)
+        quota_clients = GaugeMetricFamily("lotaya_quota_clients", "Clients with quota state in this process")
+        quota_clients.add_metric([], quota_state["clients"])
+        yield from (quota_rejected, quota_clients)
+
+        queued = GaugeMetricFamily("lotaya_lane_queued", "Requests waiting for a provider slot", labels=["provider", "lane"])
+        running = GaugeMetricFamily("lotaya_lane_running", "Provider calls running", labels=["provider", "lane"])
+        admitted = CounterMetricFamily("lotaya_lane_admitted", "Requests given a provider slot", labels=["provider", "lane"])
+        for provider, provider_stats in scheduler.stats().items():
+            for lane, lane_stats in provider_stats["lanes"].items():
+                queued.add_metric([provider, lane], lane_stats["queued"])
+                running.add_metric([provider, lane], lane_stats["running"])
+                admitted.add_metric([provider, lane], lane_stats["admitted"])
+        yield from (queued, running, admitted)
+        limit = GaugeMetricFamily("lotaya_provider_concurrency_limit", "Current adaptive concurrency limit per provider",
+                                  labels=["provider"])
+        for provider, provider_stats in scheduler.stats().items():
+            limit.add_metric([provider], provider_stats["limit"]["limit"])
+        yield limit
+
+        key_calls = CounterMetricFamily("lotaya_provider_key_calls", "Upstream calls per API key", labels=["provider", "key_id"])
+        key_failures = CounterMetricFamily("lotaya_provider_key_failures", "Failed upstream calls per API key",
+                                           labels=["provider", "key_id", "kind"])
+        key_in_flight = GaugeMetricFamily("lotaya_provider_key_in_flight", "Calls in flight per API key", labels=["provider", "key_id"])
+        key_quarantined = GaugeMetricFamily("lotaya_provider_key_quarantined_seconds", "Remaining quarantine per API key",
+                                            labels=["provider", "key_id"])
+        for provider, keys in credentials.stats().items():
+            for key in keys:
+                labels = [provider, key["key_id"]]
+                key_calls.add_metric(labels, key["calls"])
+                key_failures.add_metric(labels + ["rate_limited"], key["rate_limited"])
+                key_failures.add_metric(labels + ["unauthorized"], key["unauthorized"])
+                key_failures.add_metric(labels + ["other"], key["failures"] - key["rate_limited"] - key["unauthorized"])
+                key_in_flight.add_metric(labels, key["in_flight"])
+                key_quarantined.add_metric(labels, key["quarantined_seconds"])
+        yield from (key_calls, key_failures, key_in_flight, key_quarantined)
+
+        log_state = logs.stats()
+        log_queue = GaugeMetricFamily("lotaya_log_queue_depth", "Log records waiting for the writer thread")
+        log_queue.add_metric([], log_state["queued"])
+        log_lost = CounterMetricFamily("lotaya_log_records_lost", "Log records not written", labels=["reason"])
+        log_lost.add_metric(["queue_full"], log_state["dropped"])
+        log_lost.add_metric(["rate_limited"], log_state["suppressed"])
+        yield from (log_queue, log_lost)
+
+
+runtime = RuntimeCollector()
+REGISTRY.register(runtime)
+
+
+def render() -> bytes:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Instruments are summed over all workers' files; runtime state is the scraped worker's own
+        registry.register(runtime)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
@@ -0,0 +1,245 @@
+"""On-demand diagnostics for a running worker.
+
+- `SamplingProfiler` samples every thread's stack from a background thread
+  (no tracing hooks, so the overhead is one stack walk per interval) and
+  renders the result as a speedscope profile or as collapsed stacks for
+  flamegraph tools.
+- `MemoryTracker` wraps tracemalloc: top allocation sites of a snapshot and
+  the difference against the previous snapshot.
+- `StallDetector` notices when the event loop stops turning for longer than
+  SLOW_CALLBACK_MS and logs the stack of the callback that is blocking it,
+  captured while it is still running.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+SLOW_CALLBACK_MS = float(os.getenv("SLOW_CALLBACK_MS", "0"))
+STALL_HISTORY = 50
+
+Frame = Tuple[str, str, int]
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _stack(frame, current_line: bool = False) -> Tuple[Frame, ...]:
+    """Root-first (function, file, line) tuples of a frame's stack.
+
+    Profiles aggregate by function (its first line); stall reports show the
+    line each frame is executing.
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, frame.f_lineno if current_line else code.co_firstlineno))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+def _format_stack(stack: Tuple[Frame, ...]) -> str:
+    return "\n".join(f"  {file}:{line} in {name}" for name, file, line in stack)
+
+
+class SamplingProfiler:
+    def __init__(self):
+        self.samples: Counter = Counter()
+        self.interval = 0.01
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float) -> None:
+        if self.running:
+            raise ProfilerBusy("A profile is already being recorded")
+        self.samples = Counter()
+        self.interval = interval
+        self.started_at = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="cpu-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = self.started_at + PROFILE_MAX_SECONDS
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    self.samples[(names.get(thread_id, str(thread_id)), _stack(frame))] += 1
+        self.stopped_at = time.monotonic()
+
+    def collapsed(self) -> str:
+        """One `thread;root;...;leaf count` line per distinct stack (flamegraph.pl, speedscope)"""
+        lines = []
+        for (thread, stack), count in self.samples.most_common():
+            frames = ";".join(f"{name} ({os.path.basename(file)}:{line})" for name, file, line in stack)
+            lines.append(f"{thread};{frames} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self) -> Dict[str, Any]:
+        """Sampled profile per thread in speedscope's file format"""
+        frame_index: Dict[Frame, int] = {}
+        by_thread: Dict[str, Dict[str, list]] = {}
+        for (thread, stack), count in self.samples.items():
+            indices = [frame_index.setdefault(frame, len(frame_index)) for frame in stack]
+            profile = by_thread.setdefault(thread, {"samples": [], "weights": []})
+            profile["samples"].append(indices)
+            profile["weights"].append(count * self.interval)
+        duration = (self.stopped_at or time.monotonic()) - self.started_at
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"lotayaai worker {os.getpid()}",
+            "exporter": "lotayaai-profiling",
+            "shared": {"frames": [{"name": name, "file": file, "line": line} for name, file, line in frame_index]},
+            "profiles": [
+                {"type": "sampled", "name": thread, "unit": "seconds", "startValue": 0, "endValue": duration, **profile}
+                for thread, profile in by_thread.items()
+            ],
+        }
+
+
+class MemoryTracker:
+    def __init__(self):
+        self.previous: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def running(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.previous = None
+
+    def stop(self) -> None:
+        tracemalloc.stop()
+        self.previous = None
+
+    @staticmethod
+    def _snapshot() -> tracemalloc.Snapshot:
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ))
+
+    def snapshot(self, limit: int, group_by: str = "lineno") -> Dict[str, Any]:
+        """Top allocation sites now; becomes the baseline for the next `diff`"""
+        snapshot = self._snapshot()
+        self.previous = snapshot
+        stats = snapshot.statistics(group_by)
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "traced_bytes": current,
+            "peak_bytes": peak,
+            "top": [{"site": str(stat.traceback), "size": stat.size, "count": stat.count} for stat in stats[:limit]],
+        }
+
+    def diff(self, limit: int, group_by: str = "lineno") -> Dict[str, Any]:
+        """Largest changes since the previous snapshot (or diff)"""
+        snapshot = self._snapshot()
+        if self.previous is None:
+            self.previous = snapshot
+            return {"baseline": True, "top": []}
+        stats = snapshot.compare_to(self.previous, group_by)
+        self.previous = snapshot
+        return {
+            "baseline": False,
+            "top": [
+                {"site": str(stat.traceback), "size": stat.size, "size_diff": stat.size_diff,
+                 "count": stat.count, "count_diff": stat.count_diff}
+                for stat in stats[:limit]
+            ],
+        }
+
+
+class StallDetector:
+    """Logs the stack of any event loop callback that runs longer than the threshold"""
+
+    def __init__(self):
+        self.threshold = SLOW_CALLBACK_MS / 1000
+        self.stalls: Deque[Dict[str, Any]] = deque(maxlen=STALL_HISTORY)
+        self._last_tick = time.monotonic()
+        self._loop_thread: Optional[int] = None
+        self._ticker: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._ticker is not None
+
+    def start(self, threshold_ms: float) -> None:
+        self.threshold = threshold_ms / 1000
+        if self.running:
+            return
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._ticker = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="stall-detector", daemon=True)
+        self._watchdog.start()
+
+    def stop(self) -> None:
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        self._stop.set()
+        # Wait the thread out, or a quick restart would clear `_stop` under it and leave two watchdogs
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _tick(self) -> None:
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self) -> None:
+        reported_tick = None
+        while not self._stop.wait(self.threshold / 4):
+            tick = self._last_tick
+            blocked = time.monotonic() - tick
+            if blocked < self.threshold or tick == reported_tick:
+                continue
+            # Still inside the slow callback: its stack is the loop thread's current stack
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            reported_tick = tick
+            stack = _stack(frame, current_line=True)
+            self.stalls.append({
+                "at": time.time(),
+                "blocked_ms": round(blocked * 1000, 1),
+                "stack": [f"{file}:{line} in {name}" for name, file, line in stack],
+            })
+            logger.warning(f"Event loop blocked for {blocked * 1000:.0f}ms+, in:\n{_format_stack(stack)}")
+
+    def recent(self) -> List[Dict[str, Any]]:
+        return list(self.stalls)
+
+
+cpu_profiler = SamplingProfiler()
+memory = MemoryTracker()
+stall_detector = StallDetector()
@@ -0,0 +1,212 @@
+"""Near-duplicate prompt cache for image generation.
+
+Opt-in (PROMPT_CACHE_ENABLED). A prompt is canonicalized to its set of
+words — Unicode-normalized, case-folded, punctuation and a few filler words
+dropped — so casing, spacing, punctuation and word order don't matter. Sets
+are indexed by MinHash signatures split into LSH bands; a lookup only
+compares the exact Jaccard similarity against prompts sharing a band with
+it. Entries are scoped to model, style, size and image count, so a reused
+result always matches everything but the wording.
+
+The index lives in memory and in the `prompt_index` collection, which
+expires with the generations it points to. Each worker loads it at startup
+and then pulls entries written by other workers every
+PROMPT_CACHE_SYNC_SECONDS.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import unicodedata
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+import retention
+from lifecycle import utcnow
+
+logger = logging.getLogger(__name__)
+
+PROMPT_CACHE_ENABLED = os.getenv("PROMPT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+# Jaccard similarity of the canonical word sets needed to reuse a result
+PROMPT_CACHE_THRESHOLD = float(os.getenv("PROMPT_CACHE_THRESHOLD", "0.85"))
+PROMPT_CACHE_MAX_ENTRIES = int(os.getenv("PROMPT_CACHE_MAX_ENTRIES", "100000"))
+PROMPT_CACHE_SYNC_SECONDS = float(os.getenv("PROMPT_CACHE_SYNC_SECONDS", "30"))
+
+# 16 bands of 4 rows: pairs at Jaccard 0.5 become candidates ~65% of the
+# time, pairs at 0.85 over 99%
+NUM_PERMUTATIONS = 64
+BANDS = 16
+ROWS = NUM_PERMUTATIONS // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+STOPWORDS = frozenset({"a", "an", "the", "of", "and", "with", "very"})
+WORD = re.compile(r"\w+")
+# Re-reads a little of the past on each sync, for workers whose clocks lag
+SYNC_OVERLAP = timedelta(seconds=5)
+
+_rng = random.Random(0x5EED)
+PERMUTATIONS = [(_rng.randrange(1, MERSENNE_PRIME), _rng.randrange(0, MERSENNE_PRIME)) for _ in range(NUM_PERMUTATIONS)]
+
+
+class Match(NamedTuple):
+    generation_id: str
+    similarity: float
+
+    @property
+    def reusable(self) -> bool:
+        return self.similarity >= PROMPT_CACHE_THRESHOLD
+
+
+class Entry(NamedTuple):
+    generation_id: str
+    scope: str
+    words: FrozenSet[str]
+    bands: Tuple[int, ...]
+
+
+def canonical_words(prompt: str) -> FrozenSet[str]:
+    text = unicodedata.normalize("NFKC", prompt).casefold()
+    return frozenset(word for word in WORD.findall(text.replace("_", " ")) if word not in STOPWORDS)
+
+
+def scope_key(model: str, style: Optional[str], size: Optional[str], num_images: Optional[int]) -> str:
+    return f"{model}\0{style or ''}\0{size or ''}\0{num_images or 1}"
+
+
+def _word_hash(word: str) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+
+
+def minhash(words: FrozenSet[str]) -> List[int]:
+    hashes = [_word_hash(word) for word in words]
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in PERMUTATIONS]
+
+
+def band_keys(scope: str, words: FrozenSet[str]) -> Tuple[int, ...]:
+    signature = minhash(words)
+    return tuple(hash((scope, band, tuple(signature[band * ROWS:(band + 1) * ROWS]))) for band in range(BANDS))
+
+
+def jaccard(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    return len(a & b) / len(a | b)
+
+
+class PromptIndex:
+    def __init__(self, max_entries: int = PROMPT_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[str, Entry]" = OrderedDict()
+        self.buckets: Dict[int, Set[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, generation_id: str, scope: str, words: FrozenSet[str]) -> None:
+        if not words or generation_id in self.entries:
+            return
+        entry = Entry(generation_id, scope, words, band_keys(scope, words))
+        self.entries[generation_id] = entry
+        for key in entry.bands:
+            self.buckets.setdefault(key, set()).add(generation_id)
+        while len(self.entries) > self.max_entries:
+            self.remove(next(iter(self.entries)))
+
+    def remove(self, generation_id: str) -> None:
+        entry = self.entries.pop(generation_id, None)
+        if entry is None:
+            return
+        for key in entry.bands:
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(generation_id)
+                if not bucket:
+                    del self.buckets[key]
+
+    def lookup(self, scope: str, words: FrozenSet[str]) -> Optional[Match]:
+        """Most similar indexed prompt in `scope`, whatever its similarity"""
+        if not words:
+            return None
+        candidates: Set[str] = set()
+        for key in band_keys(scope, words):
+            candidates.update(self.buckets.get(key, ()))
+        best = None
+        for generation_id in candidates:
+            similarity = jaccard(words, self.entries[generation_id].words)
+            if best is None or similarity > best.similarity:
+                best = Match(generation_id, round(similarity, 3))
+        return best
+
+
+index = PromptIndex()
+_synced_until = None
+
+
+def lookup(prompt: str, scope: str) -> Optional[Match]:
+    return index.lookup(scope, canonical_words(prompt))
+
+
+async def forget(db, generation_id: str) -> None:
+    """Drop an entry whose generation can no longer be reused"""
+    index.remove(generation_id)
+    await db.prompt_index.delete_one({"_id": generation_id})
+
+
+async def ensure_indexes(db) -> None:
+    await retention.ensure_ttl_index(db.prompt_index)
+    # Serves the pulls whether or not the TTL index exists; descending, as they sort, and so not
+    # clashing with the TTL index's key pattern
+    await db.prompt_index.create_index([("created_at", -1)])
+
+
+async def remember(db, generation_id: str, prompt: str, scope: str) -> None:
+    words = canonical_words(prompt)
+    if not words:
+        return
+    index.add(generation_id, scope, words)
+    try:
+        await db.prompt_index.insert_one({"_id": generation_id, "scope": scope, "words": sorted(words),
+                                          "created_at": utcnow()})
+    except DuplicateKeyError:
+        pass
+
+
+async def _pull(db, newer_than=None) -> int:
+    global _synced_until
+    query = {"created_at": {"$gt": newer_than - SYNC_OVERLAP}} if newer_than is not None else {}
+    cursor = db.prompt_index.find(query).sort("created_at", -1).limit(index.max_entries)
+    docs = await cursor.to_list(length=None)
+    # Oldest first, so eviction order matches age
+    for doc in reversed(docs):
+        index.add(doc["_id"], doc["scope"], frozenset(doc["words"]))
+    if docs:
+        _synced_until = max(docs[0]["created_at"], _synced_until or docs[0]["created_at"])
+    return len(docs)
+
+
+async def sync_loop(db) -> None:
+    """Load the persisted index, then keep pulling other workers' entries"""
+    global _synced_until
+    _synced_until = utcnow()
+    try:
+        loaded = await _pull(db)
+        logger.info(f"Loaded {loaded} prompt cache entries")
+    except Exception as e:
+        logger.error(f"Prompt cache load error: {e}")
+    while True:
+        await asyncio.sleep(PROMPT_CACHE_SYNC_SECONDS)
+        try:
+            await _pull(db, _synced_until)
+        except Exception as e:
+            logger.error(f"Prompt cache sync error: {e}")
+
+
+def stats() -> Dict[str, object]:
+    return {
+        "enabled": PROMPT_CACHE_ENABLED,
+        "threshold": PROMPT_CACHE_THRESHOLD,
+        "entries": len(index),
+        "buckets": len(index.buckets),
+    }
@@ -0,0 +1,280 @@
+"""Per-client quotas for the generation endpoints.
+
+A client is its X-API-Key (by hash; the key itself is never stored) or,
+without one, its IP address as uvicorn reports it (run with
+`--proxy-headers` behind a proxy, or every client shares the proxy's
+quota). Three limits can be set; each defaults to 0, which disables it:
+
+- QUOTA_REQUESTS_PER_MINUTE generation requests in any 60 seconds;
+- QUOTA_CONCURRENT generations in flight at once;
+- QUOTA_IMAGES_PER_DAY images in any 24 hours, reserved when a request is
+  admitted and refunded if it fails.
+
+Checks never touch Mongo. Sliding windows are approximated from the counts
+of the current and previous fixed window, the previous one weighted by how
+much of it still overlaps, so a client costs two counters per limit. Every
+QUOTA_SYNC_SECONDS each worker adds its new counts to `quota_usage` and
+reads back the totals of all workers, and publishes its in-flight counts to
+`quota_in_flight`. A client spread over several workers is therefore held
+to the same limits, give or take what it manages within one sync interval.
+
+Keys in QUOTA_EXEMPT_KEYS (comma-separated) are not limited.
+"""
+import asyncio
+import hashlib
+import logging
+import math
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from lifecycle import WORKER_ID, utcnow
+
+logger = logging.getLogger(__name__)
+
+QUOTA_REQUESTS_PER_MINUTE = int(os.getenv("QUOTA_REQUESTS_PER_MINUTE", "0"))
+QUOTA_CONCURRENT = int(os.getenv("QUOTA_CONCURRENT", "0"))
+QUOTA_IMAGES_PER_DAY = int(os.getenv("QUOTA_IMAGES_PER_DAY", "0"))
+QUOTA_SYNC_SECONDS = float(os.getenv("QUOTA_SYNC_SECONDS", "5"))
+QUOTA_EXEMPT_KEYS = frozenset(key.strip() for key in os.getenv("QUOTA_EXEMPT_KEYS", "").split(",") if key.strip())
+# Clients idle this long are dropped from memory; their counts live on in Mongo
+IDLE_SECONDS = 600
+
+MINUTE = 60
+DAY = 86400
+
+
+def client_id(api_key: Optional[str], host: Optional[str]) -> Optional[str]:
+    """Quota identity of a request; None for exempt keys"""
+    if api_key:
+        if api_key in QUOTA_EXEMPT_KEYS:
+            return None
+        return "key-" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+    return f"ip-{host or 'unknown'}"
+
+
+class SlidingWindow:
+    """Counts per fixed window of `length` seconds, as [synced total, local increments not yet synced]"""
+
+    __slots__ = ("length", "cells")
+
+    def __init__(self, length: int):
+        self.length = length
+        self.cells: Dict[int, List[int]] = {}
+
+    def start(self, now: float) -> int:
+        return int(now // self.length * self.length)
+
+    def _count(self, start: int) -> int:
+        cell = self.cells.get(start)
+        return cell[0] + cell[1] if cell else 0
+
+    def estimate(self, now: float) -> float:
+        start = self.start(now)
+        overlap = 1 - (now - start) / self.length
+        return self._count(start - self.length) * overlap + self._count(start)
+
+    def add(self, now: float, amount: int) -> int:
+        start = self.start(now)
+        for stale in [cell for cell in self.cells if cell < start - self.length]:
+            del self.cells[stale]
+        self.cells.setdefault(start, [0, 0])[1] += amount
+        return start
+
+    def refund(self, start: int, amount: int) -> None:
+        cell = self.cells.get(start)
+        if cell is not None:
+            cell[1] -= amount
+
+    def retry_after(self, now: float, limit: int, cost: int) -> float:
+        """Seconds until `cost` more fits under `limit`"""
+        start = self.start(now)
+        current, previous = self._count(start), self._count(start - self.length)
+        if current + cost <= limit and previous:
+            # Only the previous window's share is in the way, and it decays linearly
+            needed_overlap = (limit - cost - current) / previous
+            return max(0.0, start + self.length * (1 - needed_overlap) - now)
+        return start + self.length - now
+
+    def pending(self) -> bool:
+        return any(cell[1] for cell in self.cells.values())
+
+
+class ClientUsage:
+    __slots__ = ("requests", "images", "in_flight", "remote_in_flight", "published_in_flight", "last_seen")
+
+    def __init__(self):
+        self.requests = SlidingWindow(MINUTE)
+        self.images = SlidingWindow(DAY)
+        self.in_flight = 0
+        self.remote_in_flight = 0
+        self.published_in_flight = 0
+        self.last_seen = time.time()
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, limit: str, retry_after: float, headers: Dict[str, str]):
+        super().__init__(f"Quota exceeded: {limit}")
+        self.limit = limit
+        self.headers = {**headers, "retry-after": str(max(1, math.ceil(retry_after)))}
+
+
+class Ticket:
+    """An admitted request; `release` when it finishes"""
+
+    __slots__ = ("usage", "images", "images_window", "released")
+
+    def __init__(self, usage: ClientUsage, images: int, images_window: int):
+        self.usage = usage
+        self.images = images
+        self.images_window = images_window
+        self.released = False
+
+    def release(self, failed: bool = False) -> None:
+        if self.released:
+            return
+        self.released = True
+        self.usage.in_flight -= 1
+        if failed and self.images:
+            self.usage.images.refund(self.images_window, self.images)
+
+
+class QuotaTracker:
+    def __init__(self, requests_per_minute: int = QUOTA_REQUESTS_PER_MINUTE, concurrent: int = QUOTA_CONCURRENT,
+                 images_per_day: int = QUOTA_IMAGES_PER_DAY):
+        self.requests_per_minute = requests_per_minute
+        self.concurrent = concurrent
+        self.images_per_day = images_per_day
+        self.clients: Dict[str, ClientUsage] = {}
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"requests": 0, "concurrency": 0, "images": 0}
+
+    def enabled(self) -> bool:
+        return bool(self.requests_per_minute or self.concurrent or self.images_per_day)
+
+    def headers(self, usage: ClientUsage, now: float) -> Dict[str, str]:
+        headers = {}
+        if self.requests_per_minute:
+            headers["x-ratelimit-limit-requests"] = str(self.requests_per_minute)
+            headers["x-ratelimit-remaining-requests"] = str(
+                max(0, math.floor(self.requests_per_minute - usage.requests.estimate(now))))
+        if self.images_per_day:
+            headers["x-ratelimit-limit-images"] = str(self.images_per_day)
+            headers["x-ratelimit-remaining-images"] = str(
+                max(0, math.floor(self.images_per_day - usage.images.estimate(now))))
+        if self.concurrent:
+            headers["x-ratelimit-limit-concurrency"] = str(self.concurrent)
+            headers["x-ratelimit-remaining-concurrency"] = str(
+                max(0, self.concurrent - usage.in_flight - usage.remote_in_flight))
+        return headers
+
+    def admit(self, client: str, images: int = 0) -> Tuple[Ticket, Dict[str, str]]:
+        """Count a request against `client`'s quotas; raises QuotaExceeded instead when it doesn't fit"""
+        now = time.time()
+        usage = self.clients.get(client)
+        if usage is None:
+            usage = self.clients[client] = ClientUsage()
+        usage.last_seen = now
+
+        exceeded = None
+        if self.requests_per_minute and usage.requests.estimate(now) + 1 > self.requests_per_minute:
+            exceeded = ("requests", usage.requests.retry_after(now, self.requests_per_minute, 1))
+        elif self.concurrent and usage.in_flight + usage.remote_in_flight >= self.concurrent:
+            exceeded = ("concurrency", 1.0)
+        elif self.images_per_day and images and usage.images.estimate(now) + images > self.images_per_day:
+            exceeded = ("images", usage.images.retry_after(now, self.images_per_day, images))
+        if exceeded is not None:
+            limit, retry_after = exceeded
+            self.rejected[limit] += 1
+            raise QuotaExceeded(limit, retry_after, self.headers(usage, now))
+
+        usage.requests.add(now, 1)
+        images_window = usage.images.add(now, images) if images else 0
+        usage.in_flight += 1
+        self.admitted += 1
+        return Ticket(usage, images, images_window), self.headers(usage, now)
+
+    async def sync(self, db) -> None:
+        """Publish local counts to Mongo and take in every worker's totals"""
+        now = time.time()
+        usage_ops, in_flight_ops, flushed = [], [], []
+        for client, usage in self.clients.items():
+            for kind, window in (("requests", usage.requests), ("images", usage.images)):
+                for start, cell in window.cells.items():
+                    if cell[1]:
+                        expire_at = datetime.fromtimestamp(start + 2 * window.length, timezone.utc)
+                        usage_ops.append(UpdateOne({"_id": f"{client}|{kind}|{start}"},
+                                                   {"$inc": {"count": cell[1]}, "$setOnInsert": {"expire_at": expire_at}},
+                                                   upsert=True))
+                        flushed.append((cell, cell[1]))
+            if usage.in_flight or usage.published_in_flight:
+                in_flight_ops.append(UpdateOne(
+                    {"_id": f"{client}|{WORKER_ID}"},
+                    {"$set": {"client": client, "worker": WORKER_ID, "in_flight": usage.in_flight,
+                              "expire_at": utcnow() + timedelta(seconds=3 * QUOTA_SYNC_SECONDS)}},
+                    upsert=True,
+                ))
+                usage.published_in_flight = usage.in_flight
+        if usage_ops:
+            await db.quota_usage.bulk_write(usage_ops, ordered=False)
+        if in_flight_ops:
+            await db.quota_in_flight.bulk_write(in_flight_ops, ordered=False)
+        # Requests admitted during the writes stay pending for the next sync
+        for cell, amount in flushed:
+            cell[0] += amount
+            cell[1] -= amount
+
+        for client in [client for client, usage in self.clients.items()
+                       if now - usage.last_seen > IDLE_SECONDS and not usage.in_flight
+                       and not usage.published_in_flight and not usage.requests.pending() and not usage.images.pending()]:
+            del self.clients[client]
+        if not self.clients:
+            return
+
+        cells = {}
+        for client, usage in self.clients.items():
+            for kind, window in (("requests", usage.requests), ("images", usage.images)):
+                current = window.start(now)
+                for start in (current - window.length, current):
+                    cells[f"{client}|{kind}|{start}"] = (window, start)
+        async for doc in db.quota_usage.find({"_id": {"$in": list(cells)}}):
+            window, start = cells[doc["_id"]]
+            window.cells.setdefault(start, [0, 0])[0] = doc["count"]
+
+        remote: Dict[str, int] = {}
+        async for doc in db.quota_in_flight.find({"client": {"$in": list(self.clients)}, "worker": {"$ne": WORKER_ID},
+                                                  "expire_at": {"$gt": utcnow()}}):
+            remote[doc["client"]] = remote.get(doc["client"], 0) + doc["in_flight"]
+        for client, usage in self.clients.items():
+            usage.remote_in_flight = remote.get(client, 0)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "limits": {"requests_per_minute": self.requests_per_minute, "concurrent": self.concurrent,
+                       "images_per_day": self.images_per_day},
+            "clients": len(self.clients),
+            "in_flight": sum(usage.in_flight for usage in self.clients.values()),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+        }
+
+
+tracker = QuotaTracker()
+
+
+async def ensure_indexes(db) -> None:
+    await db.quota_usage.create_index("expire_at", expireAfterSeconds=0)
+    await db.quota_in_flight.create_index("expire_at", expireAfterSeconds=0)
+    await db.quota_in_flight.create_index("client")
+
+
+async def sync_loop(db) -> None:
+    while True:
+        await asyncio.sleep(QUOTA_SYNC_SECONDS)
+        try:
+            await tracker.sync(db)
+        except Exception as e:
+            logger.error(f"Quota sync error: {e}")
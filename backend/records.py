@@ -0,0 +1,94 @@
+"""Compact in-memory records of finished generations.
+
+The status endpoint keeps finished generations in memory (see http_cache),
+tens of thousands of them per worker. A record keeps only what the status
+response and its validators need, in slots instead of dicts:
+
+- status and mime type strings are interned, so each distinct value is
+  stored once however many records use it;
+- images are references (a blob id or an archive location), never bytes;
+- scenes are tuples in SCENE_FIELDS order;
+- the ETag and Last-Modified header values are kept ready to send.
+
+The response dict is only built by `status()` when a response is written.
+"""
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+SCENE_FIELDS = ("index", "status", "progress", "from_cache", "video_url", "error")
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+class ImageRef:
+    """Where an image lives: a hot blob, or a record in an archive segment"""
+
+    __slots__ = ("blob_id", "mime_type", "archive")
+
+    def __init__(self, blob_id: Optional[str], mime_type: str, archive: Optional[Tuple[str, int, int, str]] = None):
+        self.blob_id = blob_id
+        self.mime_type = _intern(mime_type)
+        self.archive = archive
+
+    @classmethod
+    def from_entry(cls, entry: Any) -> Optional["ImageRef"]:
+        """None for inline images, whose bytes are in the generation document itself"""
+        if not isinstance(entry, dict):
+            return None
+        if "archive" in entry:
+            location = entry["archive"]
+            return cls(None, entry["mime_type"],
+                       (location["segment"], location["offset"], location["length"], location["sha256"]))
+        if "blob_id" in entry:
+            return cls(entry["blob_id"], entry.get("mime_type", "image/png"))
+        return None
+
+    def entry(self) -> Dict[str, Any]:
+        """The `images` entry this was read from, as `archive.load_image` takes it"""
+        if self.archive is not None:
+            segment, offset, length, sha256 = self.archive
+            return {"archive": {"segment": segment, "offset": offset, "length": length, "sha256": sha256},
+                    "mime_type": self.mime_type}
+        return {"blob_id": self.blob_id, "mime_type": self.mime_type}
+
+
+class GenerationRecord:
+    __slots__ = ("generation_id", "status_value", "progress", "result_url", "error", "scenes", "images",
+                 "etag", "last_modified", "loaded_at")
+
+    def __init__(self, status: Dict[str, Any], headers: Dict[str, str], entries: List[Any]):
+        self.generation_id = status["generation_id"]
+        self.status_value = _intern(status["status"])
+        self.progress = status["progress"]
+        self.result_url = status["result_url"]
+        self.error = status["error"]
+        self.scenes = (tuple(tuple(_intern(scene[field]) if field == "status" else scene[field]
+                                   for field in SCENE_FIELDS) for scene in status["scenes"])
+                       if "scenes" in status else None)
+        refs = tuple(ImageRef.from_entry(entry) for entry in entries)
+        # Inline images can't be referenced; such a record is only useful while its payload is cached
+        self.images: Optional[Tuple[ImageRef, ...]] = None if None in refs else refs
+        self.etag = headers["etag"]
+        self.last_modified = headers.get("last-modified")
+        self.loaded_at = time.monotonic()
+
+    def status(self) -> Dict[str, Any]:
+        status = {
+            "generation_id": self.generation_id,
+            "status": self.status_value,
+            "progress": self.progress,
+            "result_url": self.result_url,
+            "error": self.error,
+        }
+        if self.scenes is not None:
+            status["scenes"] = [dict(zip(SCENE_FIELDS, scene)) for scene in self.scenes]
+        return status
+
+    def headers(self, cache_control: str) -> Dict[str, str]:
+        headers = {"etag": self.etag, "cache-control": cache_control}
+        if self.last_modified is not None:
+            headers["last-modified"] = self.last_modified
+        return headers
@@ -0,0 +1,102 @@
+"""Retention of generations and their blobs.
+
+Generation, job and scene-cache documents expire through TTL indexes on
+`created_at` once GENERATION_TTL_DAYS is set. It defaults to 0, keeping
+everything: an index on by default would delete existing history on
+upgrade. GridFS can't use a TTL index (the chunks would be orphaned), so
+blobs carry an `expire_at` that is pushed forward whenever a new generation
+references them, and a sweeper deletes expired blobs in batches. With the
+TTL off the sweeper doesn't run and existing blob expiries are cleared.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from pymongo.errors import OperationFailure
+
+from lifecycle import utcnow
+
+logger = logging.getLogger(__name__)
+
+# 0 (the default) keeps everything forever
+GENERATION_TTL_DAYS = float(os.getenv("GENERATION_TTL_DAYS", "0"))
+TTL_SECONDS = int(GENERATION_TTL_DAYS * 86400)
+SWEEP_INTERVAL_SECONDS = int(os.getenv("RETENTION_SWEEP_SECONDS", "300"))
+SWEEP_BATCH = 500
+TTL_INDEX_NAME = "created_at_ttl"
+INDEX_OPTIONS_CONFLICT = 85
+
+
+def expires_at() -> Optional[datetime]:
+    """Expiry for a blob written (or referenced) now"""
+    if not TTL_SECONDS:
+        return None
+    return utcnow() + timedelta(seconds=TTL_SECONDS)
+
+
+async def ensure_ttl_index(collection, ttl_seconds: int = TTL_SECONDS) -> None:
+    existing = await collection.index_information()
+    if not ttl_seconds:
+        if TTL_INDEX_NAME in existing:
+            await collection.drop_index(TTL_INDEX_NAME)
+        return
+    try:
+        await collection.create_index("created_at", name=TTL_INDEX_NAME, expireAfterSeconds=ttl_seconds)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        # The TTL changed since the index was built; update it in place
+        await collection.database.command({
+            "collMod": collection.name,
+            "index": {"name": TTL_INDEX_NAME, "expireAfterSeconds": ttl_seconds},
+        })
+
+
+async def migrate_string_timestamps(collection) -> int:
+    """Replace legacy string `created_at` values with the ObjectId insert time"""
+    result = await collection.update_many(
+        {"created_at": {"$type": "string"}},
+        [{"$set": {"created_at": {"$toDate": "$_id"}}}],
+    )
+    return result.modified_count
+
+
+async def ensure_indexes(db) -> None:
+    for collection in (db.generations, db.video_jobs, db.scene_cache):
+        await ensure_ttl_index(collection)
+    await db["blobs.files"].create_index("expire_at", sparse=True)
+    if not TTL_SECONDS:
+        # Retention is off: keep blobs stamped while it was on, even if it is turned back on later
+        kept = await db["blobs.files"].update_many({"expire_at": {"$exists": True}}, {"$unset": {"expire_at": ""}})
+        if kept.modified_count:
+            logger.info(f"Cleared the expiry of {kept.modified_count} blob(s)")
+    migrated = await migrate_string_timestamps(db.generations)
+    if migrated:
+        logger.info(f"Converted {migrated} legacy generation timestamps")
+
+
+async def sweep_expired_blobs(db) -> int:
+    """Delete a batch of expired blobs and their chunks"""
+    deleted = 0
+    now = utcnow()
+    files = db["blobs.files"]
+    async for file_doc in files.find({"expire_at": {"$lte": now}}, {"_id": 1}).limit(SWEEP_BATCH):
+        # Re-check expiry atomically: a new reference may have just extended it
+        removed = await files.find_one_and_delete({"_id": file_doc["_id"], "expire_at": {"$lte": now}})
+        if removed:
+            await db["blobs.chunks"].delete_many({"files_id": file_doc["_id"]})
+            deleted += 1
+    return deleted
+
+
+async def sweep_loop(db) -> None:
+    while True:
+        await asyncio.sleep(SWEEP_INTERVAL_SECONDS)
+        try:
+            deleted = await sweep_expired_blobs(db)
+            if deleted:
+                logger.info(f"Deleted {deleted} expired blob(s)")
+        except Exception as e:
+            logger.error(f"Blob retention sweep error: {e}")
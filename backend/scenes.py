@@ -0,0 +1,229 @@
+"""Scene pipeline for text-to-video.
+
+A script is segmented into scenes, and each scene becomes its own video job,
+at most SCENE_CONCURRENCY at a time per script. Finished scenes are cached
+by a hash of their text, model and style, so editing one paragraph only
+regenerates that scene. The pipeline itself is a `scenes` job: each step
+looks at the scene entries on the generation document, fills them from the
+cache, submits more scene jobs, and stitches the clips once all are done.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+import blobstore
+import jobs
+import lifecycle
+
+logger = logging.getLogger(__name__)
+
+SCENE_CONCURRENCY = int(os.getenv("SCENE_CONCURRENCY", "3"))
+SCENE_MAX_CHARS = int(os.getenv("SCENE_MAX_CHARS", "600"))
+SCENE_MIN_CHARS = int(os.getenv("SCENE_MIN_CHARS", "80"))
+SCENE_MAX_COUNT = int(os.getenv("SCENE_MAX_COUNT", "50"))
+# Scene jobs wake the pipeline when they finish; this is only a safety net
+PIPELINE_POLL_SECONDS = 15.0
+
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+
+class ScriptTooLong(Exception):
+    pass
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def segment_script(script: str) -> List[str]:
+    """Split a script into scenes along paragraphs, then sentences"""
+    scenes: List[str] = []
+    for paragraph in re.split(r"\n\s*\n", script):
+        paragraph = _normalize(paragraph)
+        if not paragraph:
+            continue
+        pieces = [paragraph]
+        if len(paragraph) > SCENE_MAX_CHARS:
+            pieces = [""]
+            for sentence in SENTENCE_END.split(paragraph):
+                if pieces[-1] and len(pieces[-1]) + len(sentence) + 1 > SCENE_MAX_CHARS:
+                    pieces.append("")
+                pieces[-1] = f"{pieces[-1]} {sentence}".strip()
+        for piece in pieces:
+            # Fold headings and one-liners into the previous scene
+            if scenes and len(piece) < SCENE_MIN_CHARS and len(scenes[-1]) + len(piece) < SCENE_MAX_CHARS:
+                scenes[-1] = f"{scenes[-1]} {piece}"
+            else:
+                scenes.append(piece)
+    if len(scenes) > SCENE_MAX_COUNT:
+        raise ScriptTooLong(f"Script has {len(scenes)} scenes, the limit is {SCENE_MAX_COUNT}")
+    return scenes
+
+
+def scene_key(text: str, model: str, style: Optional[str]) -> str:
+    return hashlib.sha256(f"{model}\0{style or ''}\0{_normalize(text)}".encode()).hexdigest()
+
+
+def scene_prompt(text: str, style: Optional[str]) -> str:
+    return f"{text}\n\nStyle: {style}" if style else text
+
+
+def build_scenes(script: str, model: str, style: Optional[str]) -> List[Dict[str, Any]]:
+    """Scene entries stored on the generation document"""
+    return [
+        {"index": index, "text": text, "key": scene_key(text, model, style),
+         "status": "pending", "progress": 0, "from_cache": False, "video_url": None, "error": None}
+        for index, text in enumerate(segment_script(script))
+    ]
+
+
+async def ensure_indexes(db) -> None:
+    await db.scene_cache.create_index("model")
+
+
+async def start(db, generation_id: str, model: str, style: Optional[str]) -> None:
+    await jobs.enqueue(db, generation_id, model, {"style": style}, kind="scenes")
+
+
+def _write_listing(path: str, clips: List[str]) -> None:
+    """ffmpeg concat demuxer input"""
+    with open(path, "w") as f:
+        f.writelines(f"file '{clip}'\n" for clip in clips)
+
+
+async def _stitch(db, generation_id: str, scenes: List[Dict[str, Any]]) -> str:
+    """Concatenate scene clips into one video, or fall back to a playlist"""
+    blob_ids = [scene["video_url"].rsplit("/", 1)[1] for scene in scenes
+                if (scene["video_url"] or "").startswith("/api/uploads/")]
+    if len(scenes) == 1:
+        return scenes[0]["video_url"]
+    if shutil.which("ffmpeg") is None or len(blob_ids) != len(scenes):
+        # Clips live upstream (or ffmpeg is missing): serve them as a playlist
+        return f"/api/generations/{generation_id}/playlist.m3u"
+
+    # File I/O runs in threads: clips are large, and the loop also serves requests
+    workdir = await asyncio.to_thread(tempfile.mkdtemp, prefix="stitch-")
+    try:
+        paths = []
+        for index, blob_id in enumerate(blob_ids):
+            path = os.path.join(workdir, f"{index}.mp4")
+            _, chunks = await blobstore.open_blob(db, blob_id)
+            f = await asyncio.to_thread(open, path, "wb")
+            try:
+                async for chunk in chunks:
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+            paths.append(path)
+        listing = os.path.join(workdir, "list.txt")
+        await asyncio.to_thread(_write_listing, listing, paths)
+        output = os.path.join(workdir, "out.mp4")
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-loglevel", "error", "-f", "concat", "-safe", "0",
+            "-i", listing, "-c", "copy", output,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await process.communicate()
+        if process.returncode != 0:
+            logger.error(f"Stitching {generation_id} failed: {stderr.decode(errors='replace')[:500]}")
+            return f"/api/generations/{generation_id}/playlist.m3u"
+
+        async def file_chunks():
+            f = await asyncio.to_thread(open, output, "rb")
+            try:
+                while chunk := await asyncio.to_thread(f.read, blobstore.DOWNLOAD_CHUNK_BYTES):
+                    yield chunk
+            finally:
+                await asyncio.to_thread(f.close)
+
+        blob = await blobstore.store_stream(db, file_chunks(), "video/mp4", filename=f"{generation_id}.mp4",
+                                            max_bytes=await asyncio.to_thread(os.path.getsize, output))
+    finally:
+        await asyncio.to_thread(shutil.rmtree, workdir, True)
+    return f"/api/uploads/{blob['blob_id']}"
+
+
+async def run_pipeline_step(db, job: Dict[str, Any]) -> None:
+    generation_id = job["_id"]
+    generation = await db.generations.find_one({"generation_id": generation_id}, {"scenes": 1})
+    if generation is None:
+        await jobs.fail(db, job, "Generation document missing")
+        return
+    scenes = generation.get("scenes", [])
+    updates: Dict[str, Any] = {}
+
+    # Fill pending scenes from the cache
+    pending_keys = [scene["key"] for scene in scenes if scene["status"] == "pending"]
+    cached = {}
+    if pending_keys:
+        async for entry in db.scene_cache.find({"_id": {"$in": pending_keys}}):
+            cached[entry["_id"]] = entry["video_url"]
+    for scene in scenes:
+        if scene["status"] == "pending" and scene["key"] in cached:
+            if cached[scene["key"]].startswith("/api/uploads/"):
+                await blobstore.touch(db, cached[scene["key"]].rsplit("/", 1)[1])
+            prefix = f"scenes.{scene['index']}"
+            scene.update(status="completed", progress=100, from_cache=True, video_url=cached[scene["key"]])
+            updates.update({f"{prefix}.status": "completed", f"{prefix}.progress": 100,
+                            f"{prefix}.from_cache": True, f"{prefix}.video_url": scene["video_url"]})
+
+    failed = [scene for scene in scenes if scene["status"] == "failed"]
+    if failed:
+        if updates:
+            await db.generations.update_one({"generation_id": generation_id}, {"$set": updates})
+        await jobs.fail(db, job, f"Scene {failed[0]['index'] + 1} failed: {failed[0]['error']}")
+        return
+
+    # Keep at most SCENE_CONCURRENCY scene jobs in flight
+    running = sum(1 for scene in scenes if scene["status"] in ("queued", "processing"))
+    for scene in scenes:
+        if running >= SCENE_CONCURRENCY:
+            break
+        if scene["status"] != "pending":
+            continue
+        try:
+            await jobs.enqueue(
+                db, f"{generation_id}:scene:{scene['index']}", job["model"],
+                {"prompt": scene_prompt(scene["text"], job["input"].get("style"))},
+                scene={"generation_id": generation_id, "index": scene["index"]},
+                cache_key=scene["key"],
+            )
+        except DuplicateKeyError:
+            pass  # Enqueued by a step that died before recording it
+        # The scene job may already have moved it past "queued"
+        await db.generations.update_one(
+            {"generation_id": generation_id, f"scenes.{scene['index']}.status": "pending"},
+            {"$set": {f"scenes.{scene['index']}.status": "queued"}},
+        )
+        scene["status"] = "queued"
+        running += 1
+
+    progress = int(sum(scene["progress"] or 0 for scene in scenes) / max(len(scenes), 1))
+    done = all(scene["status"] == "completed" for scene in scenes)
+    if done:
+        # Downloading every clip and concatenating them can outlast the lease
+        async with lifecycle.keep_alive(db.video_jobs, job, jobs.LEASE_SECONDS):
+            video_url = await _stitch(db, generation_id, scenes)
+        if not await jobs.still_owned(db, job):
+            return
+        updates.update({"status": "completed", "progress": 100, "video_url": video_url})
+    else:
+        updates.update({"status": "processing", "progress": progress})
+    await db.generations.update_one({"generation_id": generation_id}, {"$set": updates})
+
+    if done:
+        await jobs.complete(db, job, {"progress": 100})
+    else:
+        await jobs.release(db, job, {"status": "submitted", "progress": progress,
+                                     "next_run_at": jobs.utcnow() + timedelta(seconds=PIPELINE_POLL_SECONDS)})
+
+
+jobs.STEP_HANDLERS["scenes"] = run_pipeline_step
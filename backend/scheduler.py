@@ -0,0 +1,298 @@
+"""Weighted-fair scheduling of provider calls across priority lanes.
+
+Every image model has a fixed number of concurrent upstream calls
+(PROVIDER_CONCURRENCY). Requests that find no free slot wait in the queue of
+their lane; when a slot frees up, the next waiter is picked by stride
+scheduling, so over time each busy lane gets capacity in proportion to its
+weight and an idle lane's share goes to the others. `RESERVED_SLOTS` keeps a
+few slots for the interactive lane only, so a bulk backlog can't make a user
+wait for a whole provider call, and a waiter that has been queued for longer
+than STARVATION_SECONDS is served next regardless of weights.
+
+With ADAPTIVE_CONCURRENCY (the default) that number of slots is only the
+starting point. Every upstream call reports its latency and outcome
+(`metrics.ProviderCall` does this), and the limit follows AIMD: it grows by
+about one slot per limit's worth of healthy calls while the slots are in
+use, and is cut by CONCURRENCY_BACKOFF on a 429, 503/504, timeout, or when
+recent latency exceeds LATENCY_TOLERANCE times the long-run average. Cuts
+are at most one per recent call latency, so one burst of failures from the
+same overload counts once.
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+
+import tracing
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANE_WEIGHTS = {
+    INTERACTIVE: float(os.getenv("LANE_WEIGHT_INTERACTIVE", "8")),
+    BULK: float(os.getenv("LANE_WEIGHT_BULK", "1")),
+}
+DEFAULT_LANE = INTERACTIVE
+PROVIDER_CONCURRENCY = int(os.getenv("PROVIDER_CONCURRENCY", "8"))
+# Slots other lanes may never occupy, so an interactive request never waits behind a full bulk backlog
+RESERVED_SLOTS = {INTERACTIVE: int(os.getenv("LANE_RESERVED_INTERACTIVE", "1"))}
+STARVATION_SECONDS = float(os.getenv("LANE_STARVATION_SECONDS", "30"))
+
+ADAPTIVE_CONCURRENCY = os.getenv("ADAPTIVE_CONCURRENCY", "true").lower() in ("1", "true", "yes")
+MIN_CONCURRENCY = int(os.getenv("PROVIDER_MIN_CONCURRENCY", "1"))
+MAX_CONCURRENCY = int(os.getenv("PROVIDER_MAX_CONCURRENCY", "64"))
+CONCURRENCY_BACKOFF = float(os.getenv("PROVIDER_CONCURRENCY_BACKOFF", "0.7"))
+LATENCY_TOLERANCE = float(os.getenv("PROVIDER_LATENCY_TOLERANCE", "1.5"))
+# Recent latency averages roughly the last 10 calls, the baseline the last 500 (as in Netflix's
+# Gradient2 limiter): a long mean rather than a minimum, so per-call jitter can't pass for overload
+RECENT_LATENCY_SMOOTHING = 0.1
+BASELINE_LATENCY_SMOOTHING = 0.002
+BASELINE_RESET_RATIO = 0.5
+BASELINE_RESET_DECAY = 0.95
+# Provider calls seen before latency can trigger a cut
+LATENCY_WARMUP_CALLS = 10
+OVERLOAD_OUTCOMES = ("http_429", "http_503", "http_504", "timeout")
+MIN_CUT_INTERVAL_SECONDS = 1.0
+
+
+def _parse_key_lanes(value: str) -> Dict[str, str]:
+    """`key1:bulk,key2:interactive` -> {key: lane}"""
+    lanes = {}
+    for item in value.split(","):
+        key, _, lane = item.strip().rpartition(":")
+        if key and lane in LANE_WEIGHTS:
+            lanes[key] = lane
+    return lanes
+
+
+# Per-API-key lane classes, e.g. back-office keys pinned to bulk
+API_KEY_LANES = _parse_key_lanes(os.getenv("API_KEY_LANES", ""))
+
+
+def resolve_lane(priority: Optional[str], api_key: Optional[str]) -> str:
+    """Lane for a request: the API key's class wins over the requested priority"""
+    if api_key and api_key in API_KEY_LANES:
+        return API_KEY_LANES[api_key]
+    if priority in LANE_WEIGHTS:
+        return priority
+    return DEFAULT_LANE
+
+
+class Lane:
+    def __init__(self, name: str, weight: float):
+        self.name = name
+        self.weight = weight
+        self.stride = 1.0 / weight
+        self.pass_value = 0.0
+        self.waiters: Deque[Tuple[asyncio.Future, float]] = deque()
+        self.running = 0
+        self.admitted = 0
+        self.promoted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "weight": self.weight,
+            "queued": len(self.waiters),
+            "running": self.running,
+            "admitted": self.admitted,
+            "starvation_promotions": self.promoted,
+            "avg_wait_ms": round(self.total_wait / self.admitted * 1000, 1) if self.admitted else 0.0,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "oldest_wait_ms": round((time.monotonic() - self.waiters[0][1]) * 1000, 1) if self.waiters else 0.0,
+        }
+
+
+class AdaptiveLimit:
+    """Additive-increase, multiplicative-decrease concurrency limit"""
+
+    def __init__(self, initial: int = PROVIDER_CONCURRENCY, minimum: int = MIN_CONCURRENCY,
+                 maximum: int = MAX_CONCURRENCY, adaptive: bool = ADAPTIVE_CONCURRENCY):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.limit = float(initial)
+        self.adaptive = adaptive
+        self.recent_latency: Optional[float] = None
+        self.baseline_latency: Optional[float] = None
+        self.calls = 0
+        self.latency_samples = 0
+        self.increases = 0
+        self.decreases: Dict[str, int] = {"overload": 0, "latency": 0}
+        self._last_cut = 0.0
+
+    @property
+    def capacity(self) -> int:
+        return int(self.limit)
+
+    def observe(self, seconds: float, outcome: str, running: int) -> None:
+        """Adjust the limit after one upstream call; `running` counts the calls in flight with it"""
+        if not self.adaptive:
+            return
+        self.calls += 1
+        if outcome in OVERLOAD_OUTCOMES:
+            self._cut("overload")
+            return
+        if outcome != "ok":
+            # Bad requests and auth errors say nothing about upstream load
+            return
+        self.latency_samples += 1
+        if self.recent_latency is None:
+            self.recent_latency = self.baseline_latency = seconds
+        else:
+            # Plain means over the first calls, so one lucky early call doesn't become the baseline
+            self.recent_latency += max(RECENT_LATENCY_SMOOTHING, 1 / self.latency_samples) * (seconds - self.recent_latency)
+            self.baseline_latency += (max(BASELINE_LATENCY_SMOOTHING, 1 / self.latency_samples)
+                                      * (seconds - self.baseline_latency))
+            if self.recent_latency < BASELINE_RESET_RATIO * self.baseline_latency:
+                # The load that inflated the baseline is gone; don't wait out the long average
+                self.baseline_latency *= BASELINE_RESET_DECAY
+        if (self.latency_samples > LATENCY_WARMUP_CALLS
+                and self.recent_latency > LATENCY_TOLERANCE * self.baseline_latency):
+            self._cut("latency")
+        elif running * 2 >= self.capacity:
+            # Only grow while the slots are actually in use; an idle provider proves nothing
+            grown = min(self.maximum, self.limit + 1 / self.limit)
+            if int(grown) > self.capacity:
+                self.increases += 1
+            self.limit = grown
+
+    def _cut(self, reason: str) -> None:
+        now = time.monotonic()
+        if now - self._last_cut < max(MIN_CUT_INTERVAL_SECONDS, self.recent_latency or 0.0):
+            return
+        self._last_cut = now
+        self.limit = max(float(self.minimum), self.limit * CONCURRENCY_BACKOFF)
+        self.decreases[reason] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "adaptive": self.adaptive,
+            "limit": round(self.limit, 2),
+            "recent_latency_ms": round(self.recent_latency * 1000, 1) if self.recent_latency is not None else None,
+            "baseline_latency_ms": round(self.baseline_latency * 1000, 1) if self.baseline_latency is not None else None,
+            "increases": self.increases,
+            "decreases": dict(self.decreases),
+        }
+
+
+class FairScheduler:
+    """Concurrency limit for one provider, shared fairly between lanes"""
+
+    def __init__(self, capacity: int = PROVIDER_CONCURRENCY, weights: Dict[str, float] = LANE_WEIGHTS,
+                 adaptive: bool = ADAPTIVE_CONCURRENCY):
+        self.limiter = AdaptiveLimit(capacity, adaptive=adaptive)
+        self.lanes = {name: Lane(name, weight) for name, weight in weights.items()}
+        self.running = 0
+
+    @property
+    def capacity(self) -> int:
+        return self.limiter.capacity
+
+    def observe(self, seconds: float, outcome: str) -> None:
+        """Feed one upstream call's result to the adaptive limit"""
+        before = self.capacity
+        self.limiter.observe(seconds, outcome, self.running)
+        if self.capacity > before:
+            self._dispatch()
+
+    def _can_run(self, lane: Lane) -> bool:
+        """A free slot exists and the lane is under its cap (capacity minus other lanes' reserves)"""
+        reserved = sum(slots for name, slots in RESERVED_SLOTS.items() if name != lane.name)
+        return self.running < self.capacity and lane.running < max(1, self.capacity - reserved)
+
+    def _grant(self, lane: Lane, waited: float) -> None:
+        self.running += 1
+        lane.running += 1
+        lane.admitted += 1
+        lane.total_wait += waited
+        lane.max_wait = max(lane.max_wait, waited)
+        lane.pass_value += lane.stride
+
+    def _next_lane(self) -> Optional[Lane]:
+        now = time.monotonic()
+        eligible = [lane for lane in self.lanes.values() if lane.waiters and self._can_run(lane)]
+        if not eligible:
+            return None
+        starving = [lane for lane in eligible if now - lane.waiters[0][1] > STARVATION_SECONDS]
+        if starving:
+            lane = min(starving, key=lambda lane: lane.waiters[0][1])
+            lane.promoted += 1
+            return lane
+        return min(eligible, key=lambda lane: lane.pass_value)
+
+    def _dispatch(self) -> None:
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            future, enqueued = lane.waiters.popleft()
+            if future.done():
+                continue
+            self._grant(lane, time.monotonic() - enqueued)
+            future.set_result(None)
+
+    async def acquire(self, lane_name: str) -> None:
+        lane = self.lanes[lane_name]
+        if not lane.waiters:
+            # A lane coming back from idle doesn't get to spend credit it banked while idle
+            active = [other.pass_value for other in self.lanes.values() if other.waiters]
+            if active:
+                lane.pass_value = max(lane.pass_value, min(active))
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, time.monotonic())
+        lane.waiters.append(entry)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.cancelled():
+                # A dispatch between the cancellation and this handler may already have dropped it
+                if entry in lane.waiters:
+                    lane.waiters.remove(entry)
+            else:
+                # Granted just before the cancellation landed: hand the slot on
+                self.release(lane_name)
+            raise
+
+    def release(self, lane_name: str) -> None:
+        self.running -= 1
+        self.lanes[lane_name].running -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, lane_name: str):
+        with tracing.span("queue", lane=lane_name):
+            await self.acquire(lane_name)
+        try:
+            yield
+        finally:
+            self.release(lane_name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "running": self.running,
+            "limit": self.limiter.stats(),
+            "lanes": {name: lane.stats() for name, lane in self.lanes.items()},
+        }
+
+
+_schedulers: Dict[str, FairScheduler] = {}
+
+
+def for_provider(name: str) -> FairScheduler:
+    if name not in _schedulers:
+        _schedulers[name] = FairScheduler()
+    return _schedulers[name]
+
+
+def observe(provider: str, seconds: float, outcome: str) -> None:
+    scheduler = _schedulers.get(provider)
+    if scheduler is not None:
+        scheduler.observe(seconds, outcome)
+
+
+def stats() -> Dict[str, Any]:
+    return {name: scheduler.stats() for name, scheduler in _schedulers.items()}
@@ -1,29 +1,58 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File
+from fastapi import Depends, FastAPI, Header, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import ORJSONResponse, PlainTextResponse, Response, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReadPreference, WriteConcern
 from pydantic import BaseModel
 import os
+import secrets
 from dotenv import load_dotenv
-import uvicorn
-from typing import Optional, List
+from typing import Optional, List, Tuple
+from bson import ObjectId
+from bson.errors import InvalidId
+import orjson
 import logging
 import base64
 import uuid
-from emergentintegrations.llm.gemeni.image_generation import GeminiImageGeneration
-import httpx
 import asyncio
 from io import BytesIO
 import json
+from datetime import datetime
+from contextlib import nullcontext
 
-# Load environment variables
+# Load environment variables (before the local modules, which read their config on import)
 load_dotenv()
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from media import ImageData, image_response
+import admission
+import archive
+import blobstore
+import credentials
+import frontend
+import http_cache
+import idempotency
+import jobs
+import lifecycle
+import logs
+import metrics
+import profiling
+import prompt_cache
+import quotas
+import records
+import retention
+import scenes
+import scheduler
+import tracing
+import upstream
+
+# Configure logging: JSON lines written off the request path, rate-limited per call site
+logs.configure()
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="LotayaAI API", version="1.0.0")
+app = FastAPI(title="LotayaAI API", version="1.0.0", default_response_class=ORJSONResponse)
+
+# Sheds generation requests under overload; added first so CORS wraps its 503s
+app.add_middleware(admission.AdmissionMiddleware)
 
 # CORS middleware
 app.add_middleware(
@@ -34,32 +63,112 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request counts and latency per route, including requests shed above
+app.add_middleware(metrics.MetricsMiddleware)
+
 # MongoDB connection
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017/lotayaai")
+# Acknowledged by a majority so a status read on any node sees the write
+MONGO_WRITE_CONCERN = os.getenv("MONGO_WRITE_CONCERN", "majority")
 client = None
 db = None
+video_worker = None
+background_tasks = []
+
+# Public origin of this API, used to hand uploaded media to upstream providers
+PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+
+# Token for every endpoint under /api/admin (stats and diagnostics); unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 
-# API Keys
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+# API Keys (Gemini and XAI keys are pooled, see credentials.py)
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
-XAI_API_KEY = os.getenv("XAI_API_KEY")
+
+# Upstream endpoints; point them at benchmarks/stub_providers.py to run offline
+XAI_API_BASE = os.getenv("XAI_API_BASE", "https://api.x.ai/v1").rstrip("/")
+# Set to call the Imagen REST API directly instead of going through the SDK
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "").rstrip("/")
+GEMINI_IMAGE_MODEL = "imagen-3.0-generate-002"
 
 @app.on_event("startup")
 async def startup_event():
-    global client, db
+    global client, db, video_worker
+    admission.monitor.start()
+    if profiling.SLOW_CALLBACK_MS:
+        profiling.stall_detector.start(profiling.SLOW_CALLBACK_MS)
     try:
-        client = AsyncIOMotorClient(MONGO_URL)
-        db = client.get_database()
+        client = AsyncIOMotorClient(MONGO_URL, tz_aware=True, event_listeners=[metrics.MongoCommandMetrics()])
+        db = client.get_database(
+            write_concern=WriteConcern(w=int(MONGO_WRITE_CONCERN) if MONGO_WRITE_CONCERN.isdigit() else MONGO_WRITE_CONCERN),
+            read_preference=ReadPreference.PRIMARY
+        )
         logger.info("Connected to MongoDB successfully")
     except Exception as e:
         logger.error(f"Failed to connect to MongoDB: {e}")
+    
+    if db is not None:
+        # Independent of each other, so they run concurrently: startup waits for the slowest, not the sum
+        results = await asyncio.gather(
+            db.generations.create_index("generation_id", unique=True),
+            # Keyset pagination for the history endpoint
+            db.generations.create_index([("created_at", -1), ("_id", -1)]),
+            db.generations.create_index([("type", 1), ("created_at", -1), ("_id", -1)]),
+            retention.ensure_indexes(db),
+            lifecycle.ensure_indexes(db.generations),
+            blobstore.ensure_indexes(db),
+            jobs.ensure_indexes(db),
+            idempotency.ensure_indexes(db),
+            scenes.ensure_indexes(db),
+            prompt_cache.ensure_indexes(db),
+            archive.ensure_indexes(db),
+            quotas.ensure_indexes(db),
+            return_exceptions=True,
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"Failed to create indexes: {result}")
+        
+        # Resumes any jobs left in flight by a previous process
+        video_worker = jobs.JobWorker(db)
+        video_worker.start()
+        background_tasks.append(asyncio.create_task(reap_abandoned_generations()))
+        if retention.TTL_SECONDS:
+            background_tasks.append(asyncio.create_task(retention.sweep_loop(db)))
+        if prompt_cache.PROMPT_CACHE_ENABLED:
+            background_tasks.append(asyncio.create_task(prompt_cache.sync_loop(db)))
+        if archive.enabled():
+            background_tasks.append(asyncio.create_task(archive.compaction_loop(db)))
+        if quotas.tracker.enabled():
+            background_tasks.append(asyncio.create_task(quotas.sync_loop(db)))
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    for task in background_tasks:
+        task.cancel()
+    await admission.monitor.stop()
+    profiling.stall_detector.stop()
+    if video_worker:
+        await video_worker.stop()
+    await upstream.close()
     if client:
         client.close()
         logger.info("Disconnected from MongoDB")
 
+async def reap_abandoned_generations():
+    """Fail image generations whose worker stopped heartbeating (crash, OOM kill)"""
+    while True:
+        await asyncio.sleep(lifecycle.LEASE_SECONDS)
+        try:
+            reaped = await lifecycle.reap(
+                db.generations,
+                {"type": "image", "status": "processing"},
+                "Worker stopped before the generation finished"
+            )
+            if reaped:
+                logger.warning(f"Failed {reaped} abandoned image generation(s)")
+        except Exception as e:
+            logger.error(f"Generation reaper error: {e}")
+
 # Pydantic models
 class ImageGenerationRequest(BaseModel):
     prompt: str
@@ -67,11 +176,14 @@ class ImageGenerationRequest(BaseModel):
     style: Optional[str] = None
     size: Optional[str] = "1024x1024"
     num_images: Optional[int] = 1
+    priority: Optional[str] = None  # interactive (default) or bulk; overridden by the API key's lane
 
 class VideoGenerationRequest(BaseModel):
     prompt: str
     model: str = "runway"  # runway, kling, veo3, sora
     duration: Optional[int] = 10
+    image_id: Optional[str] = None  # Upload ID of the source image (image-to-video)
+    reference_id: Optional[str] = None  # Upload ID of the reference media (reference-to-video)
 
 class TextToVideoRequest(BaseModel):
     script: str
@@ -84,33 +196,73 @@ class GenerationResponse(BaseModel):
     model_used: str
     prompt: str
     generation_id: str
-    images: Optional[List[str]] = None  # Base64 encoded images
+    images: Optional[List[str]] = None  # Base64 data URLs, streamed by media.image_response
     video_url: Optional[str] = None
     error: Optional[str] = None
 
 # AI Image Generation Functions
-async def generate_image_gemini(prompt: str, num_images: int = 1) -> List[str]:
+async def generate_image_gemini(prompt: str, num_images: int = 1) -> List[ImageData]:
     """Generate images using Gemini API"""
     try:
-        image_gen = GeminiImageGeneration(api_key=GEMINI_API_KEY)
-        images = await image_gen.generate_images(
-            prompt=prompt,
-            model="imagen-3.0-generate-002",
-            number_of_images=num_images
-        )
+        if GEMINI_API_BASE:
+            return await generate_image_gemini_rest(prompt, num_images)
         
-        # Convert image bytes to base64
-        base64_images = []
-        for image_bytes in images:
-            base64_str = base64.b64encode(image_bytes).decode('utf-8')
-            base64_images.append(f"data:image/png;base64,{base64_str}")
+        from emergentintegrations.llm.gemeni.image_generation import GeminiImageGeneration
         
-        return base64_images
+        with credentials.pool("gemini").use() as key:
+            image_gen = GeminiImageGeneration(api_key=key.secret)
+            with metrics.ProviderCall("gemini"), tracing.span("gemini.generate"):
+                images = await image_gen.generate_images(
+                    prompt=prompt,
+                    model=GEMINI_IMAGE_MODEL,
+                    number_of_images=num_images
+                )
+        
+        return [ImageData("image/png", image_bytes) for image_bytes in images]
     except Exception as e:
         logger.error(f"Gemini image generation error: {e}")
         raise HTTPException(status_code=500, detail=f"Gemini image generation failed: {str(e)}")
 
-async def generate_image_groq(prompt: str, num_images: int = 1) -> List[str]:
+async def generate_image_gemini_rest(prompt: str, num_images: int = 1) -> List[ImageData]:
+    """Imagen `predict` call against GEMINI_API_BASE"""
+    http = upstream.client()
+    with credentials.pool("gemini").use() as key:
+        with metrics.ProviderCall("gemini") as call, tracing.span("gemini.generate"):
+            response = await http.post(
+                f"{GEMINI_API_BASE}/models/{GEMINI_IMAGE_MODEL}:predict",
+                json={"instances": [{"prompt": prompt}], "parameters": {"sampleCount": num_images}},
+                headers={"x-goog-api-key": key.secret},
+                timeout=120.0
+            )
+            if response.status_code != 200:
+                call.outcome = f"http_{response.status_code}"
+        key.observe(response.status_code, response.headers)
+    
+    if response.status_code != 200:
+        raise Exception(f"Imagen API request failed with HTTP {response.status_code}")
+    return [
+        ImageData(prediction.get("mimeType", "image/png"), base64.b64decode(prediction["bytesBase64Encoded"]))
+        for prediction in response.json().get("predictions", [])
+    ]
+
+def render_placeholder(label: str, prompt: str, shades: Tuple[int, int], text_fill: Tuple[int, int, int]) -> bytes:
+    """PNG of a random-coloured square captioned with the prompt (CPU-bound: run it off the event loop)"""
+    from PIL import Image, ImageDraw
+    import random
+    
+    img = Image.new('RGB', (1024, 1024), color=(
+        random.randint(*shades),
+        random.randint(*shades),
+        random.randint(*shades)
+    ))
+    draw = ImageDraw.Draw(img)
+    draw.text((50, 50), f"{label} Generated Image\n{prompt[:50]}...", fill=text_fill)
+    
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+async def generate_image_groq(prompt: str, num_images: int = 1) -> List[ImageData]:
     """Generate images using GROQ API (using placeholder since GROQ doesn't support image generation)"""
     try:
         # Note: GROQ's Llama 3.2 models are primarily for image understanding/reasoning
@@ -119,91 +271,75 @@ async def generate_image_groq(prompt: str, num_images: int = 1) -> List[str]:
         placeholder_images = []
         for i in range(num_images):
             # Create a simple colored rectangle as placeholder
-            from PIL import Image, ImageDraw
-            import random
-            
-            img = Image.new('RGB', (1024, 1024), color=(
-                random.randint(50, 200),
-                random.randint(50, 200),
-                random.randint(50, 200)
-            ))
-            draw = ImageDraw.Draw(img)
-            draw.text((50, 50), f"GROQ Generated Image\n{prompt[:50]}...", fill=(255, 255, 255))
-            
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            base64_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            placeholder_images.append(f"data:image/png;base64,{base64_str}")
+            with tracing.span("placeholder.render"):
+                png = await asyncio.to_thread(render_placeholder, "GROQ", prompt, (50, 200), (255, 255, 255))
+            placeholder_images.append(ImageData("image/png", png))
         
+        metrics.PLACEHOLDER_IMAGES.labels("groq", "unsupported").inc(num_images)
         return placeholder_images
                 
     except Exception as e:
         logger.error(f"GROQ image generation error: {e}")
         raise HTTPException(status_code=500, detail=f"GROQ image generation failed: {str(e)}")
 
-async def generate_image_xai(prompt: str, num_images: int = 1) -> List[str]:
+async def generate_image_xai(prompt: str, num_images: int = 1) -> List[ImageData]:
     """Generate images using XAI Grok API"""
     try:
-        async with httpx.AsyncClient() as client:
+        http = upstream.client()
+        data = {
+            "model": "grok-2-image-1212",
+            "prompt": prompt,
+            "num_images": min(num_images, 10),  # XAI allows max 10 images per request
+            "size": "1024x1024"
+        }
+        
+        # Least-loaded key of the pool; 401/429 responses quarantine it
+        with credentials.pool("xai").use() as key:
             headers = {
-                "Authorization": f"Bearer {XAI_API_KEY}",
+                "Authorization": f"Bearer {key.secret}",
                 "Content-Type": "application/json"
             }
+            with metrics.ProviderCall("xai") as call, tracing.span("xai.request"):
+                response = await http.post(
+                    f"{XAI_API_BASE}/images/generations",
+                    json=data,
+                    headers=headers,
+                    timeout=120.0
+                )
+                if response.status_code != 200:
+                    call.outcome = f"http_{response.status_code}"
+            key.observe(response.status_code, response.headers)
+        
+        if response.status_code == 200:
+            result = response.json()
+            images = []
             
-            data = {
-                "model": "grok-2-image-1212",
-                "prompt": prompt,
-                "num_images": min(num_images, 10),  # XAI allows max 10 images per request
-                "size": "1024x1024"
-            }
+            # Extract images from XAI response
+            for img_data in result.get("data", []):
+                if "url" in img_data:
+                    # Download the image, kept as raw bytes until the response is written
+                    with tracing.span("xai.download"):
+                        img_response = await http.get(img_data["url"])
+                    if img_response.status_code == 200:
+                        mime_type = img_response.headers.get("content-type", "image/jpeg").split(";")[0]
+                        images.append(ImageData(mime_type, img_response.content))
+                elif "b64_json" in img_data:
+                    # Direct base64 data
+                    images.append(ImageData("image/jpeg", base64.b64decode(img_data["b64_json"])))
             
-            response = await client.post(
-                "https://api.x.ai/v1/images/generations",
-                json=data,
-                headers=headers,
-                timeout=120.0
-            )
+            return images
+        else:
+            raise HTTPException(status_code=response.status_code, detail="XAI API request failed")
             
-            if response.status_code == 200:
-                result = response.json()
-                images = []
-                
-                # Extract images from XAI response
-                for img_data in result.get("data", []):
-                    if "url" in img_data:
-                        # Download the image and convert to base64
-                        img_response = await client.get(img_data["url"])
-                        if img_response.status_code == 200:
-                            base64_str = base64.b64encode(img_response.content).decode('utf-8')
-                            images.append(f"data:image/jpeg;base64,{base64_str}")
-                    elif "b64_json" in img_data:
-                        # Direct base64 data
-                        images.append(f"data:image/jpeg;base64,{img_data['b64_json']}")
-                
-                return images
-            else:
-                raise HTTPException(status_code=response.status_code, detail="XAI API request failed")
-                
     except Exception as e:
         logger.error(f"XAI image generation error: {e}")
+        metrics.PLACEHOLDER_IMAGES.labels("xai", "error").inc(num_images)
         # Create placeholder image as fallback
-        from PIL import Image, ImageDraw
-        import random
-        
         placeholder_images = []
         for i in range(num_images):
-            img = Image.new('RGB', (1024, 1024), color=(
-                random.randint(100, 255),
-                random.randint(100, 255),
-                random.randint(100, 255)
-            ))
-            draw = ImageDraw.Draw(img)
-            draw.text((50, 50), f"XAI Generated Image\n{prompt[:50]}...", fill=(0, 0, 0))
-            
-            buffer = BytesIO()
-            img.save(buffer, format='PNG')
-            base64_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
-            placeholder_images.append(f"data:image/png;base64,{base64_str}")
+            with tracing.span("placeholder.render"):
+                png = await asyncio.to_thread(render_placeholder, "XAI", prompt, (100, 255), (0, 0, 0))
+            placeholder_images.append(ImageData("image/png", png))
         
         return placeholder_images
 
@@ -212,20 +348,237 @@ async def generate_image_xai(prompt: str, num_images: int = 1) -> List[str]:
 async def health_check():
     return {"status": "healthy", "message": "LotayaAI API is running"}
 
-@app.get("/api/models")
-async def get_available_models():
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+@app.get("/api/admin/admission", dependencies=[Depends(require_admin)])
+async def admission_status():
+    """Current load signals, shedding thresholds and shed counts"""
+    return admission.monitor.snapshot()
+
+@app.get("/api/admin/lanes", dependencies=[Depends(require_admin)])
+async def lane_status():
+    """Per-provider scheduler capacity and per-lane queue metrics"""
+    return scheduler.stats()
+
+@app.get("/api/admin/credentials", dependencies=[Depends(require_admin)])
+async def credential_status():
+    """Per-key usage and quarantine state of the provider key pools"""
+    return credentials.stats()
+
+@app.get("/api/admin/prompt-cache", dependencies=[Depends(require_admin)])
+async def prompt_cache_status():
+    """Size and settings of the similar-prompt cache"""
+    return prompt_cache.stats()
+
+@app.get("/api/admin/quotas", dependencies=[Depends(require_admin)])
+async def quota_status():
+    """Per-client quota limits, tracked clients and rejections"""
+    return quotas.tracker.stats()
+
+@app.get("/api/admin/archive", dependencies=[Depends(require_admin)])
+async def archive_status():
+    """Cold tier size and compaction progress"""
+    return archive.stats()
+
+@app.get("/api/admin/generation-cache", dependencies=[Depends(require_admin)])
+async def generation_cache_status():
+    """Size and hit rate of the finished-generation cache"""
+    return http_cache.generations.stats()
+
+@app.post("/api/admin/profile/start", dependencies=[Depends(require_admin)])
+async def start_cpu_profile(interval_ms: float = 10):
+    """Start sampling all thread stacks of this worker"""
+    try:
+        profiling.cpu_profiler.start(max(1.0, interval_ms) / 1000)
+    except profiling.ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"profiling": True, "interval_ms": max(1.0, interval_ms), "max_seconds": profiling.PROFILE_MAX_SECONDS}
+
+@app.post("/api/admin/profile/stop", dependencies=[Depends(require_admin)])
+async def stop_cpu_profile(format: str = "speedscope"):
+    """Stop sampling; returns a speedscope profile or collapsed stacks (format=collapsed)"""
+    if not profiling.cpu_profiler.samples and not profiling.cpu_profiler.running:
+        raise HTTPException(status_code=409, detail="No profile has been recorded")
+    await asyncio.to_thread(profiling.cpu_profiler.stop)
+    if format == "collapsed":
+        return PlainTextResponse(profiling.cpu_profiler.collapsed())
+    return profiling.cpu_profiler.speedscope()
+
+@app.post("/api/admin/memory/start", dependencies=[Depends(require_admin)])
+async def start_memory_tracing(frames: int = 1):
+    profiling.memory.start(max(1, min(frames, 50)))
+    return {"tracing": True}
+
+@app.post("/api/admin/memory/snapshot", dependencies=[Depends(require_admin)])
+async def memory_snapshot(limit: int = 20, group_by: str = "lineno"):
+    """Top allocation sites; also the baseline for the next diff"""
+    if not profiling.memory.running:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    return await asyncio.to_thread(profiling.memory.snapshot, limit, group_by)
+
+@app.post("/api/admin/memory/diff", dependencies=[Depends(require_admin)])
+async def memory_diff(limit: int = 20, group_by: str = "lineno"):
+    """Allocation growth since the previous snapshot or diff"""
+    if not profiling.memory.running:
+        raise HTTPException(status_code=409, detail="Memory tracing is not running")
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be lineno, filename or traceback")
+    return await asyncio.to_thread(profiling.memory.diff, limit, group_by)
+
+@app.post("/api/admin/memory/stop", dependencies=[Depends(require_admin)])
+async def stop_memory_tracing():
+    profiling.memory.stop()
+    return {"tracing": False}
+
+@app.get("/api/admin/stalls", dependencies=[Depends(require_admin)])
+async def event_loop_stalls():
+    """Recent event loop stalls with the stack that caused them"""
     return {
-        "image_models": ["gemini", "groq", "xai"],
-        "video_models": ["runway", "kling", "veo3", "sora", "seedance", "hailuo"],
-        "effects": ["ai_hug", "ai_kissing", "french_kiss", "decapitate", "eye_pop"]
+        "detecting": profiling.stall_detector.running,
+        "threshold_ms": profiling.stall_detector.threshold * 1000,
+        "stalls": profiling.stall_detector.recent()
     }
 
+@app.post("/api/admin/stalls/start", dependencies=[Depends(require_admin)])
+async def start_stall_detection(threshold_ms: float = 100):
+    profiling.stall_detector.start(max(10.0, threshold_ms))
+    return {"detecting": True, "threshold_ms": profiling.stall_detector.threshold * 1000}
+
+@app.post("/api/admin/stalls/stop", dependencies=[Depends(require_admin)])
+async def stop_stall_detection():
+    profiling.stall_detector.stop()
+    return {"detecting": False}
+
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    return Response(metrics.render(), headers={"content-type": metrics.CONTENT_TYPE_LATEST})
+
+AVAILABLE_MODELS = {
+    "image_models": ["gemini", "groq", "xai"],
+    "video_models": ["runway", "kling", "veo3", "sora", "seedance", "hailuo"],
+    "effects": ["ai_hug", "ai_kissing", "french_kiss", "decapitate", "eye_pop"]
+}
+AVAILABLE_MODELS_HEADERS = {"etag": http_cache.etag(orjson.dumps(AVAILABLE_MODELS)), "cache-control": "public, max-age=60"}
+
+@app.get("/api/models")
+async def get_available_models(request: Request):
+    if http_cache.not_modified(request.headers, AVAILABLE_MODELS_HEADERS["etag"]):
+        return http_cache.not_modified_response(AVAILABLE_MODELS_HEADERS)
+    return ORJSONResponse(AVAILABLE_MODELS, headers=AVAILABLE_MODELS_HEADERS)
+
+REPLAYED_HEADERS = {"Idempotent-Replayed": "true"}
+
+async def claim_idempotency_key(scope: str, key: str, request: BaseModel, generation_id: str):
+    """Returns the earlier request's record when `key` was used before"""
+    try:
+        return await idempotency.claim(db, scope, key, request.model_dump(), generation_id)
+    except idempotency.IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+async def wait_for_original(record):
+    try:
+        return await idempotency.wait(db, record)
+    except idempotency.IdempotencyTimeout as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+async def replay_image_generation(record, request: ImageGenerationRequest):
+    """Answer a repeated image request from the generation it started"""
+    generation_id = record["generation_id"]
+    final = await wait_for_original(record)
+    generation = await db.generations.find_one({"generation_id": generation_id}) if db is not None else None
+    
+    if final is None or (generation is not None and generation.get("status") == "failed"):
+        return ORJSONResponse(GenerationResponse(
+            success=False,
+            message="Image generation failed",
+            model_used=request.model,
+            prompt=request.prompt,
+            generation_id=generation_id,
+            error=generation.get("error") if generation else "Original request failed"
+        ).model_dump(), headers=REPLAYED_HEADERS)
+    
+    images = [await archive.load_image(db, entry) for entry in generation.get("images", [])] if generation else []
+    if generation is None or None in images:
+        # Succeeded, but its generation or images are gone (no database, expired): nothing true to replay
+        raise HTTPException(status_code=409,
+                            detail="The result of the original request with this Idempotency-Key is no longer available")
+    response = GenerationResponse(
+        success=True,
+        message="Image generation completed successfully",
+        model_used=request.model,
+        prompt=request.prompt,
+        generation_id=generation_id
+    )
+    replay = image_response(response.model_dump(), images)
+    replay.headers.update(REPLAYED_HEADERS)
+    return replay
+
+async def replay_job_request(record):
+    """Answer a repeated video/convert request with the original response"""
+    final = await wait_for_original(record)
+    if final is None or final.get("response") is None:
+        raise HTTPException(status_code=500, detail="Original request with this Idempotency-Key failed")
+    return ORJSONResponse(final["response"], headers=REPLAYED_HEADERS)
+
+async def load_similar_generation(match: prompt_cache.Match):
+    """Images and blob references of a cached generation, or None if it can't be reused"""
+    generation = await db.generations.find_one({"generation_id": match.generation_id, "status": "completed"},
+                                               {"images": 1})
+    refs = generation.get("images") if generation else None
+    if refs:
+        images = await asyncio.gather(*(archive.load_image(db, entry) for entry in refs))
+        if all(image is not None for image in images):
+            # The new generation references the blobs too (an archived image's hot thumbnail included),
+            # so they live as long as it does
+            blob_ids = [archive.thumbnail_id(ref) for ref in refs]
+            await asyncio.gather(*(blobstore.touch(db, blob_id) for blob_id in blob_ids if blob_id))
+            return list(images), refs
+    await prompt_cache.forget(db, match.generation_id)
+    return None
+
+IMAGE_PROVIDERS = {
+    "gemini": generate_image_gemini,
+    "groq": generate_image_groq,
+    "xai": generate_image_xai
+}
+
+def admit_client(http_request: Request, api_key: Optional[str], images: int = 0):
+    """Count a request against its client's quotas: (ticket or None, rate limit headers)"""
+    client_id = quotas.client_id(api_key, http_request.client.host if http_request.client else None)
+    if client_id is None or not quotas.tracker.enabled():
+        return None, {}
+    try:
+        return quotas.tracker.admit(client_id, images)
+    except quotas.QuotaExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers=e.headers)
+
 @app.post("/api/generate/image")
-async def generate_image(request: ImageGenerationRequest):
+async def generate_image(request: ImageGenerationRequest, http_request: Request,
+                         idempotency_key: Optional[str] = Header(None), x_api_key: Optional[str] = Header(None)):
+    generation_id = str(uuid.uuid4())
+    lane = scheduler.resolve_lane(request.priority, x_api_key)
+    generation_doc = None
+    if idempotency_key:
+        previous = await claim_idempotency_key("generate_image", idempotency_key, request, generation_id)
+        if previous is not None:
+            return await replay_image_generation(previous, request)
+    
+    # Replays above are free; new work counts against the client's quotas
     try:
-        generation_id = str(uuid.uuid4())
-        
-        # Store generation request in database
+        ticket, quota_headers = admit_client(http_request, x_api_key, request.num_images)
+    except HTTPException:
+        if idempotency_key:
+            await idempotency.release(db, "generate_image", idempotency_key)
+        raise
+    
+    # Per-stage timings: Server-Timing header, generation document, optional span export
+    trace = tracing.Trace("generate_image", model=request.model, lane=lane, generation_id=generation_id)
+    try:
+        # Store generation request in database, leased to this worker until it finishes
         if db is not None:
             generation_doc = {
                 "generation_id": generation_id,
@@ -235,97 +588,176 @@ async def generate_image(request: ImageGenerationRequest):
                 "style": request.style,
                 "size": request.size,
                 "num_images": request.num_images,
+                "lane": lane,
                 "status": "processing",
-                "created_at": "2025-01-27T14:00:00Z"
+                **lifecycle.new_lease(),
+                "created_at": lifecycle.utcnow()
             }
-            await db.generations.insert_one(generation_doc)
+            with tracing.span("db.insert"):
+                await db.generations.insert_one(generation_doc)
         
-        # Generate images based on model
-        images = []
-        if request.model == "gemini":
-            images = await generate_image_gemini(request.prompt, request.num_images)
-        elif request.model == "groq":
-            images = await generate_image_groq(request.prompt, request.num_images)
-        elif request.model == "xai":
-            images = await generate_image_xai(request.prompt, request.num_images)
-        else:
+        provider = IMAGE_PROVIDERS.get(request.model)
+        if provider is None:
             raise HTTPException(status_code=400, detail="Unsupported model")
         
+        # Reuse the result of a near-identical earlier prompt; the decision is kept on the document
+        images = refs = cache_decision = None
+        cache_scope = prompt_cache.scope_key(request.model, request.style, request.size, request.num_images)
+        if prompt_cache.PROMPT_CACHE_ENABLED and generation_doc is not None:
+            with tracing.span("prompt_cache.lookup"):
+                match = prompt_cache.lookup(request.prompt, cache_scope)
+                reused = match is not None and match.reusable and await load_similar_generation(match)
+            if reused:
+                images, refs = reused
+            if match is not None:
+                cache_decision = {"matched_generation_id": match.generation_id, "similarity": match.similarity,
+                                  "reused": bool(reused)}
+            metrics.PROMPT_CACHE_LOOKUPS.labels(
+                "hit" if reused else "miss" if match is None else "stale" if match.reusable else "below_threshold"
+            ).inc()
+        
+        if images is None:
+            # Generate images based on model, heartbeating the lease meanwhile
+            lease = lifecycle.keep_alive(db.generations, generation_doc) if generation_doc is not None else nullcontext()
+            with metrics.IN_FLIGHT.labels("image").track_inprogress():
+                async with lease:
+                    # Waits for a provider slot; interactive requests are served ahead of bulk ones
+                    async with scheduler.for_provider(request.model).slot(lane):
+                        with tracing.span("provider", model=request.model):
+                            images = await provider(request.prompt, request.num_images)
+        metrics.record_images(request.model, images)
+        
         # Update database with results
-        if db is not None:
-            await db.generations.update_one(
-                {"generation_id": generation_id},
-                {"$set": {"status": "completed", "images": images}}
-            )
+        if generation_doc is not None:
+            generated = refs is None
+            if generated:
+                with tracing.span("blob.store", images=len(images)):
+                    refs = await asyncio.gather(*(blobstore.store_image(db, image, generation_id) for image in images))
+            fields = {"images": list(refs), "timings": trace.to_doc()}
+            if cache_decision:
+                fields["prompt_cache"] = cache_decision
+            with tracing.span("db.complete"):
+                await lifecycle.complete(db.generations, generation_doc, fields)
+            # Placeholders stand in for a failed or unsupported provider; never hand them out again
+            if generated and prompt_cache.PROMPT_CACHE_ENABLED and not any(
+                    span.name == "placeholder.render" for span in trace.spans):
+                await prompt_cache.remember(db, generation_id, request.prompt, cache_scope)
+        if idempotency_key:
+            await idempotency.finish(db, "generate_image", idempotency_key)
         
-        return GenerationResponse(
+        response = GenerationResponse(
             success=True,
             message="Image generation completed successfully",
             model_used=request.model,
             prompt=request.prompt,
-            generation_id=generation_id,
-            images=images
+            generation_id=generation_id
         )
+        streamed = image_response(response.model_dump(), images)
+        streamed.headers["server-timing"] = trace.server_timing()
+        streamed.headers.update(quota_headers)
+        if cache_decision and cache_decision["reused"]:
+            streamed.headers["x-prompt-cache"] = f"hit; generation={cache_decision['matched_generation_id']}"
+        # Base64 encoding happens while the body streams; that span is only in the export
+        streamed.body_iterator = trace.stream(streamed.body_iterator)
+        return streamed
         
     except Exception as e:
         logger.error(f"Image generation error: {e}")
+        if ticket is not None:
+            # Failed generations don't use up the daily image quota
+            ticket.release(failed=True)
         
         # Update database with error
-        if db is not None:
-            await db.generations.update_one(
-                {"generation_id": generation_id},
-                {"$set": {"status": "failed", "error": str(e)}}
-            )
+        if generation_doc is not None:
+            await lifecycle.fail(db.generations, generation_doc, str(e), {"timings": trace.to_doc()})
+        if idempotency_key:
+            await idempotency.release(db, "generate_image", idempotency_key)
         
-        return GenerationResponse(
+        trace.close()
+        trace.export()
+        return ORJSONResponse(GenerationResponse(
             success=False,
             message="Image generation failed",
             model_used=request.model,
             prompt=request.prompt,
             generation_id=generation_id,
             error=str(e)
-        )
+        ).model_dump(), headers={"server-timing": trace.server_timing(), **quota_headers})
+    except BaseException:
+        # Cancelled (client gone, admission timeout): the key must not stay claimed by work nobody finishes
+        if idempotency_key:
+            await idempotency.release(db, "generate_image", idempotency_key)
+        raise
+    finally:
+        if ticket is not None:
+            ticket.release()
+        trace.detach()
+
+def upload_url(upload_id: Optional[str]) -> Optional[str]:
+    """Absolute URL of an upload, for providers that fetch media themselves"""
+    if not upload_id:
+        return None
+    return f"{PUBLIC_BASE_URL}/api/uploads/{upload_id}"
 
 @app.post("/api/generate/video")
-async def generate_video(request: VideoGenerationRequest):
+async def generate_video(request: VideoGenerationRequest, idempotency_key: Optional[str] = Header(None)):
+    generation_id = str(uuid.uuid4())
+    
+    # Jobs are durable, so there is nothing to run them on without the database
+    if db is None:
+        raise HTTPException(status_code=503, detail="Job store unavailable")
+    
+    if idempotency_key:
+        previous = await claim_idempotency_key("generate_video", idempotency_key, request, generation_id)
+        if previous is not None:
+            return await replay_job_request(previous)
+    
+    # Referenced uploads must exist before any work is queued
+    for upload_id in (request.image_id, request.reference_id):
+        if upload_id and await blobstore.touch(db, upload_id) is None:
+            raise HTTPException(status_code=400, detail=f"Unknown upload: {upload_id}")
+    
     try:
-        generation_id = str(uuid.uuid4())
-        
         # Store generation request in database
-        if db is not None:
-            generation_doc = {
-                "generation_id": generation_id,
-                "type": "video",
-                "prompt": request.prompt,
-                "model": request.model,
-                "duration": request.duration,
-                "status": "processing",
-                "created_at": "2025-01-27T14:00:00Z"
-            }
-            await db.generations.insert_one(generation_doc)
-        
-        # TODO: Implement actual video generation with different models
-        # For now, return placeholder response
-        video_url = f"https://placeholder-video-url.com/{generation_id}.mp4"
+        generation_doc = {
+            "generation_id": generation_id,
+            "type": "video",
+            "prompt": request.prompt,
+            "model": request.model,
+            "duration": request.duration,
+            "image_id": request.image_id,
+            "reference_id": request.reference_id,
+            "status": "queued",
+            "progress": 0,
+            "created_at": lifecycle.utcnow()
+        }
+        await db.generations.insert_one(generation_doc)
         
-        # Update database with results
-        if db is not None:
-            await db.generations.update_one(
-                {"generation_id": generation_id},
-                {"$set": {"status": "completed", "video_url": video_url}}
-            )
+        await jobs.enqueue(db, generation_id, request.model, {
+            "prompt": request.prompt,
+            "duration": request.duration,
+            "image_url": upload_url(request.image_id),
+            "reference_url": upload_url(request.reference_id)
+        })
+        video_worker.notify()
         
-        return {
+        response = {
             "success": True,
             "message": "Video generation initiated",
             "model_used": request.model,
             "prompt": request.prompt,
-            "video_url": video_url,
+            "status": "queued",
+            "video_url": None,
             "generation_id": generation_id
         }
+        if idempotency_key:
+            await idempotency.finish(db, "generate_video", idempotency_key, response)
+        return response
         
     except Exception as e:
         logger.error(f"Video generation error: {e}")
+        if idempotency_key:
+            await idempotency.release(db, "generate_video", idempotency_key)
         
         # Update database with error
         if db is not None:
@@ -335,47 +767,67 @@ async def generate_video(request: VideoGenerationRequest):
             )
         
         raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        if idempotency_key:
+            await idempotency.release(db, "generate_video", idempotency_key)
+        raise
 
 @app.post("/api/convert/text-to-video")
-async def text_to_video(request: TextToVideoRequest):
+async def text_to_video(request: TextToVideoRequest, idempotency_key: Optional[str] = Header(None)):
+    generation_id = str(uuid.uuid4())
+    
+    if db is None:
+        raise HTTPException(status_code=503, detail="Job store unavailable")
+    
+    try:
+        script_scenes = scenes.build_scenes(request.script, request.model, request.style)
+    except scenes.ScriptTooLong as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not script_scenes:
+        raise HTTPException(status_code=400, detail="Script is empty")
+    
+    if idempotency_key:
+        previous = await claim_idempotency_key("text_to_video", idempotency_key, request, generation_id)
+        if previous is not None:
+            return await replay_job_request(previous)
+    
     try:
-        generation_id = str(uuid.uuid4())
-        
         # Store generation request in database
-        if db is not None:
-            generation_doc = {
-                "generation_id": generation_id,
-                "type": "text_to_video",
-                "script": request.script,
-                "model": request.model,
-                "style": request.style,
-                "status": "processing",
-                "created_at": "2025-01-27T14:00:00Z"
-            }
-            await db.generations.insert_one(generation_doc)
-        
-        # TODO: Implement actual text to video conversion
-        # For now, return placeholder response
-        video_url = f"https://placeholder-video-url.com/{generation_id}.mp4"
+        generation_doc = {
+            "generation_id": generation_id,
+            "type": "text_to_video",
+            "script": request.script,
+            "model": request.model,
+            "style": request.style,
+            "scenes": script_scenes,
+            "status": "queued",
+            "progress": 0,
+            "created_at": lifecycle.utcnow()
+        }
+        await db.generations.insert_one(generation_doc)
         
-        # Update database with results
-        if db is not None:
-            await db.generations.update_one(
-                {"generation_id": generation_id},
-                {"$set": {"status": "completed", "video_url": video_url}}
-            )
+        # Scenes are generated in parallel by the job workers, then stitched
+        await scenes.start(db, generation_id, request.model, request.style)
+        video_worker.notify()
         
-        return {
+        response = {
             "success": True,
             "message": "Text to video conversion initiated",
             "script": request.script,
             "model_used": request.model,
-            "video_url": video_url,
+            "status": "queued",
+            "video_url": None,
+            "scene_count": len(script_scenes),
             "conversion_id": generation_id
         }
+        if idempotency_key:
+            await idempotency.finish(db, "text_to_video", idempotency_key, response)
+        return response
         
     except Exception as e:
         logger.error(f"Text to video conversion error: {e}")
+        if idempotency_key:
+            await idempotency.release(db, "text_to_video", idempotency_key)
         
         # Update database with error
         if db is not None:
@@ -385,21 +837,187 @@ async def text_to_video(request: TextToVideoRequest):
             )
         
         raise HTTPException(status_code=500, detail=str(e))
+    except BaseException:
+        if idempotency_key:
+            await idempotency.release(db, "text_to_video", idempotency_key)
+        raise
+
+@app.post("/api/uploads")
+async def upload_media(request: Request, filename: str = "upload"):
+    """Stream a raw image/video request body into the blob store"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Storage unavailable")
+    
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if not content_type.startswith(blobstore.ALLOWED_UPLOAD_PREFIXES):
+        raise HTTPException(status_code=415, detail="Only image/* and video/* uploads are supported")
+    
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > blobstore.MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Upload exceeds {blobstore.MAX_UPLOAD_BYTES} bytes")
+    
+    try:
+        blob = await blobstore.store_stream(
+            db,
+            request.stream(),
+            content_type,
+            filename=filename,
+            expected_sha256=request.headers.get("x-content-sha256", "").lower() or None
+        )
+    except blobstore.BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except blobstore.BlobDigestMismatch as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Upload error: {e}")
+        raise HTTPException(status_code=500, detail="Upload failed")
+    
+    return {"success": True, "upload_id": blob["blob_id"], **blob}
+
+@app.get("/api/uploads/{upload_id}")
+async def download_media(upload_id: str):
+    if db is None:
+        raise HTTPException(status_code=503, detail="Storage unavailable")
+    
+    file_doc, chunks = await blobstore.open_blob(db, upload_id)
+    if file_doc is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    
+    info = blobstore.blob_info(file_doc)
+    return StreamingResponse(
+        chunks,
+        media_type=info["content_type"],
+        headers={
+            "content-length": str(info["size"]),
+            "etag": f'"{upload_id}"',
+            # Content-addressed: the bytes behind an ID never change
+            "cache-control": "public, max-age=31536000, immutable"
+        }
+    )
+
+HISTORY_PROJECTION = {
+    "generation_id": 1, "type": 1, "model": 1, "prompt": 1, "script": 1, "status": 1,
+    "progress": 1, "video_url": 1, "images.blob_id": 1, "images.thumbnail_blob_id": 1, "error": 1, "created_at": 1
+}
+
+def encode_cursor(created_at: datetime, doc_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(orjson.dumps([created_at.isoformat(), str(doc_id)])).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        created_at, doc_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return datetime.fromisoformat(created_at), ObjectId(doc_id)
+    except (ValueError, TypeError, InvalidId, orjson.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/api/generations")
+async def list_generations(limit: int = 20, cursor: Optional[str] = None, type: Optional[str] = None,
+                           status: Optional[str] = None):
+    """Generation history, newest first, paginated on (created_at, _id)"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Storage unavailable")
+    
+    limit = max(1, min(limit, 100))
+    query = {}
+    if type:
+        query["type"] = type
+    if status:
+        query["status"] = status
+    if cursor:
+        created_at, doc_id = decode_cursor(cursor)
+        query["$or"] = [
+            {"created_at": {"$lt": created_at}},
+            {"created_at": created_at, "_id": {"$lt": doc_id}}
+        ]
+    
+    docs = await db.generations.find(query, HISTORY_PROJECTION).sort(
+        [("created_at", -1), ("_id", -1)]
+    ).limit(limit + 1).to_list(limit + 1)
+    
+    items = []
+    for doc in docs[:limit]:
+        items.append({
+            "generation_id": doc["generation_id"],
+            "type": doc.get("type"),
+            "model": doc.get("model"),
+            "prompt": doc.get("prompt") or (doc.get("script") or "")[:200],
+            "status": doc.get("status"),
+            "progress": doc.get("progress"),
+            "video_url": doc.get("video_url"),
+            # Archived generations keep only a thumbnail in the hot store
+            "image_urls": [f"/api/uploads/{blob_id}" for blob_id in map(archive.thumbnail_id, doc.get("images", [])) if blob_id],
+            "error": doc.get("error"),
+            "created_at": doc["created_at"]
+        })
+    
+    next_cursor = None
+    if len(docs) > limit:
+        last = docs[limit - 1]
+        next_cursor = encode_cursor(last["created_at"], last["_id"])
+    return {"items": items, "next_cursor": next_cursor}
+
+def generation_headers(status: dict, generation: dict) -> dict:
+    """ETag from the status and image references, so it is known before any blob is read"""
+    refs = generation.get("images", [])
+    image_keys = [archive.image_key(ref) or index for index, ref in enumerate(refs)]
+    headers = {"etag": http_cache.etag(orjson.dumps(status), *image_keys)}
+    if status["status"] in http_cache.TERMINAL_STATUSES:
+        headers["cache-control"] = http_cache.TERMINAL_CACHE_CONTROL
+        if isinstance(generation.get("completed_at"), datetime):
+            headers["last-modified"] = http_cache.http_date(generation["completed_at"])
+    else:
+        headers["cache-control"] = "no-cache"
+    return headers
 
 @app.get("/api/generations/{generation_id}")
-async def get_generation_status(generation_id: str):
+async def get_generation_status(generation_id: str, request: Request):
+    # Finished generations never change: answer repeated polls from memory
+    cached = http_cache.generations.get(generation_id)
+    if cached is not None:
+        headers = cached.headers
+        if http_cache.not_modified(request.headers, headers["etag"], headers.get("last-modified")):
+            return http_cache.not_modified_response(headers)
+        images = cached.images
+        if images is None and cached.record.images is not None and db is not None:
+            # The record says where the images are; only their bytes need loading
+            loaded = [await archive.load_image(db, ref.entry()) for ref in cached.record.images]
+            if None not in loaded:
+                images = loaded
+                http_cache.generations.put_images(generation_id, images)
+        if images is not None:
+            response = image_response(cached.record.status(), images)
+            response.headers.update(headers)
+            return response
+    
     try:
         if db is not None:
             generation = await db.generations.find_one({"generation_id": generation_id})
             if generation:
-                return {
+                status = {
                     "generation_id": generation_id,
                     "status": generation.get("status", "unknown"),
-                    "progress": 100 if generation.get("status") == "completed" else 50,
+                    "progress": generation.get("progress", 100 if generation.get("status") == "completed" else 50),
                     "result_url": generation.get("video_url"),
-                    "images": generation.get("images", []),
                     "error": generation.get("error")
                 }
+                if "scenes" in generation:
+                    status["scenes"] = [
+                        {key: scene.get(key) for key in ("index", "status", "progress", "from_cache", "video_url", "error")}
+                        for scene in generation["scenes"]
+                    ]
+                headers = generation_headers(status, generation)
+                if http_cache.not_modified(request.headers, headers["etag"], headers.get("last-modified")):
+                    return http_cache.not_modified_response(headers)
+                
+                images = [await archive.load_image(db, entry) for entry in generation.get("images", [])]
+                loaded = [image for image in images if image is not None]
+                # A missing blob may be mid-expiry; only cache complete results
+                if status["status"] in http_cache.TERMINAL_STATUSES and len(loaded) == len(images):
+                    record = records.GenerationRecord(status, headers, generation.get("images", []))
+                    http_cache.generations.put(record, loaded)
+                response = image_response(status, loaded)
+                response.headers.update(headers)
+                return response
         
         return {
             "generation_id": generation_id,
@@ -412,5 +1030,29 @@ async def get_generation_status(generation_id: str):
         logger.error(f"Status check error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/generations/{generation_id}/playlist.m3u")
+async def get_generation_playlist(generation_id: str):
+    """Scene clips in order, for pipelines whose clips could not be concatenated"""
+    if db is None:
+        raise HTTPException(status_code=503, detail="Storage unavailable")
+    
+    generation = await db.generations.find_one({"generation_id": generation_id}, {"scenes": 1})
+    if not generation or not generation.get("scenes"):
+        raise HTTPException(status_code=404, detail="Generation has no scenes")
+    
+    lines = ["#EXTM3U"]
+    for scene in generation["scenes"]:
+        if scene.get("video_url"):
+            lines.append(f"#EXTINF:-1,Scene {scene['index'] + 1}")
+            lines.append(scene["video_url"])
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="audio/x-mpegurl")
+
+# Last, so every API route above takes precedence over the catch-all mount
+if frontend.SERVE_FRONTEND:
+    app.mount("/", frontend.FrontendFiles(), name="frontend")
+
 if __name__ == "__main__":
+    # Only needed here; workers started by `uvicorn server:app` already have it
+    import uvicorn
+
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
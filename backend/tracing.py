@@ -0,0 +1,159 @@
+"""Per-request timing spans.
+
+A request handler starts a `Trace`; code anywhere below it (provider
+functions, blob storage) wraps its stages in `span(...)`, which finds the
+trace through a context variable and is a no-op outside of one. A finished
+trace becomes a `Server-Timing` header, a compact `timings` list stored on
+the generation document and, when TRACE_EXPORT_FILE is set, OpenTelemetry
+style span records (one JSON object per line) written by a background
+thread so the event loop never waits on the file.
+"""
+import contextvars
+import os
+import queue
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import orjson
+
+TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE")
+SERVICE_NAME = "lotayaai-api"
+
+_current: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+_current_span: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    __slots__ = ("span_id", "parent_id", "name", "start_ns", "end_ns", "attributes")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = self.start_ns
+        self.attributes = attributes
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(name, None, attributes)
+        self.spans: List[Span] = []
+        self._token = _current.set(self)
+        self._span_token = _current_span.set(self.root.span_id)
+
+    def close(self) -> None:
+        self.root.end_ns = time.time_ns()
+
+    def detach(self) -> None:
+        """Stop collecting spans from the current context"""
+        _current.reset(self._token)
+        _current_span.reset(self._span_token)
+
+    def server_timing(self) -> str:
+        """Stages summed by name (repeated stages, e.g. downloads, report a call count)"""
+        totals: Dict[str, List[float]] = {}
+        for span in self.spans:
+            total = totals.setdefault(span.name, [0.0, 0])
+            total[0] += span.duration_ms
+            total[1] += 1
+        entries = [
+            f'{name};dur={duration:.1f}' + (f';desc="{count} calls"' if count > 1 else "")
+            for name, (duration, count) in totals.items()
+        ]
+        entries.append(f"total;dur={(time.time_ns() - self.root.start_ns) / 1e6:.1f}")
+        return ", ".join(entries)
+
+    def to_doc(self) -> List[Dict[str, Any]]:
+        """Stage offsets and durations in ms, for the generation document"""
+        return [
+            {"name": span.name, "start_ms": round((span.start_ns - self.root.start_ns) / 1e6, 1),
+             "duration_ms": round(span.duration_ms, 1)}
+            for span in self.spans
+        ]
+
+    def export(self) -> None:
+        if TRACE_EXPORT_FILE:
+            _exporter.submit(self)
+
+    async def stream(self, chunks: AsyncIterator[bytes], name: str = "response.stream") -> AsyncIterator[bytes]:
+        """Time a streamed response body, then export the whole trace"""
+        response_span = Span(name, self.root.span_id, {})
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            response_span.end_ns = time.time_ns()
+            self.spans.append(response_span)
+            self.close()
+            self.export()
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    trace = _current.get()
+    if trace is None:
+        yield None
+        return
+    current_span = Span(name, _current_span.get(), attributes)
+    token = _current_span.set(current_span.span_id)
+    try:
+        yield current_span
+    finally:
+        current_span.end_ns = time.time_ns()
+        _current_span.reset(token)
+        trace.spans.append(current_span)
+
+
+def _otel_span(trace: Trace, span: Span) -> Dict[str, Any]:
+    return {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "parentSpanId": span.parent_id or "",
+        "name": span.name,
+        "startTimeUnixNano": span.start_ns,
+        "endTimeUnixNano": span.end_ns,
+        "attributes": [{"key": key, "value": {"stringValue": str(value)}} for key, value in span.attributes.items()],
+    }
+
+
+class FileSpanExporter:
+    """Appends finished traces to a file from a daemon thread"""
+
+    def __init__(self, path: Optional[str]):
+        self.path = path
+        self.queue: "queue.SimpleQueue[Trace]" = queue.SimpleQueue()
+        self.thread: Optional[threading.Thread] = None
+
+    def submit(self, trace: Trace) -> None:
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+            self.thread.start()
+        self.queue.put(trace)
+
+    def _run(self) -> None:
+        with open(self.path, "ab") as output:
+            while True:
+                trace = self.queue.get()
+                record = {
+                    "resource": {"service.name": SERVICE_NAME},
+                    "spans": [_otel_span(trace, span) for span in [trace.root, *trace.spans]],
+                }
+                output.write(orjson.dumps(record) + b"\n")
+                if self.queue.empty():
+                    output.flush()
+
+
+_exporter = FileSpanExporter(TRACE_EXPORT_FILE)
@@ -0,0 +1,67 @@
+"""The shared HTTP client for provider traffic, with record/replay.
+
+Every provider call goes through `client()`: one connection pool and one
+TLS context for the whole process instead of one per call. httpx itself is
+only imported when the first call creates it. The transport depends on
+UPSTREAM_MODE:
+
+- `live` (default): straight to the network.
+- `record`: to the network, and every request/response pair is appended to
+  the cassette directory UPSTREAM_CASSETTE, with the time the upstream took.
+- `replay`: nothing leaves the process; responses come from the cassette,
+  delayed by their recorded timing (scaled by UPSTREAM_REPLAY_SPEED, 0 for
+  no delay), so a captured production trace can be re-run offline.
+
+The cassette format and matching rules are described in cassette.py.
+"""
+import asyncio
+import os
+import sys
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    import httpx
+
+UPSTREAM_MODE = os.getenv("UPSTREAM_MODE", "live")
+UPSTREAM_CASSETTE = os.getenv("UPSTREAM_CASSETTE", "upstream_cassette")
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "200"))
+
+_client: Optional["httpx.AsyncClient"] = None
+
+
+def _transport() -> "httpx.AsyncBaseTransport":
+    import httpx
+
+    limits = httpx.Limits(max_connections=UPSTREAM_MAX_CONNECTIONS, max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS // 4)
+    live = httpx.AsyncHTTPTransport(limits=limits)
+    if UPSTREAM_MODE == "live":
+        return live
+    import cassette
+
+    if UPSTREAM_MODE == "record":
+        return cassette.RecordingTransport(cassette.Cassette(UPSTREAM_CASSETTE), live)
+    return cassette.ReplayTransport(cassette.Cassette(UPSTREAM_CASSETTE))
+
+
+def client() -> "httpx.AsyncClient":
+    global _client
+    if _client is None:
+        import httpx
+
+        _client = httpx.AsyncClient(transport=_transport())
+    return _client
+
+
+def is_timeout(error: BaseException) -> bool:
+    if isinstance(error, asyncio.TimeoutError):
+        return True
+    # Without httpx loaded, no httpx timeout can have been raised
+    httpx = sys.modules.get("httpx")
+    return httpx is not None and isinstance(error, httpx.TimeoutException)
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
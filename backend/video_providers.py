@@ -0,0 +1,257 @@
+"""Upstream video generation providers.
+
+A provider turns a job into an upstream task (`submit`) and reports that
+task's state (`poll`). Models without configured credentials run on the
+local stub provider, the same way image models fall back to placeholders.
+"""
+import hashlib
+import os
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, AsyncIterator, Dict, NamedTuple, Optional
+
+import upstream
+
+if TYPE_CHECKING:
+    import httpx
+
+RUNWAY_API_KEY = os.getenv("RUNWAY_API_KEY")
+RUNWAY_MODEL = os.getenv("RUNWAY_MODEL", "gen4_turbo")
+KLING_ACCESS_KEY = os.getenv("KLING_ACCESS_KEY")
+KLING_SECRET_KEY = os.getenv("KLING_SECRET_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+SORA_MODEL = os.getenv("SORA_MODEL", "sora-2")
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+VEO_MODEL = os.getenv("VEO_MODEL", "veo-3.0-generate-001")
+# Force every video model onto the stub (tests, local development)
+VIDEO_PROVIDER_OVERRIDE = os.getenv("VIDEO_PROVIDER_OVERRIDE")
+STUB_VIDEO_SECONDS = float(os.getenv("STUB_VIDEO_SECONDS", "20"))
+STUB_VIDEO_FAILURE_RATE = float(os.getenv("STUB_VIDEO_FAILURE_RATE", "0"))
+
+REQUEST_TIMEOUT = 30.0
+
+
+class UpstreamStatus(NamedTuple):
+    state: str  # running, completed, failed
+    progress: Optional[int] = None  # 0-100, None when the upstream doesn't report it
+    result_url: Optional[str] = None
+    error: Optional[str] = None
+    eta_seconds: Optional[float] = None
+
+
+class UpstreamError(Exception):
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _check(response: "httpx.Response", action: str) -> Dict[str, Any]:
+    if response.status_code == 429 or response.status_code >= 500:
+        raise UpstreamError(f"{action} failed with HTTP {response.status_code}")
+    if response.status_code >= 400:
+        raise UpstreamError(f"{action} failed with HTTP {response.status_code}", retryable=False)
+    return response.json()
+
+
+class VideoProvider:
+    name = "base"
+
+    async def submit(self, job_input: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    async def poll(self, upstream_id: str) -> UpstreamStatus:
+        raise NotImplementedError
+
+    def result_request(self, upstream_id: str, status: UpstreamStatus) -> Optional[Dict[str, Any]]:
+        """Request (url, headers) to copy the result into the blob store, or None to link it"""
+        return {"url": status.result_url, "headers": {}}
+
+
+class StubVideoProvider(VideoProvider):
+    """Local provider whose tasks progress linearly over STUB_VIDEO_SECONDS.
+
+    All state is encoded in the upstream ID, so polling keeps working across
+    restarts exactly like a real upstream would.
+    """
+    name = "stub"
+
+    def __init__(self, seconds: float = STUB_VIDEO_SECONDS, failure_rate: float = STUB_VIDEO_FAILURE_RATE):
+        self.seconds = seconds
+        self.failure_rate = failure_rate
+
+    async def submit(self, job_input: Dict[str, Any]) -> str:
+        return f"stub-{uuid.uuid4().hex}-{int(time.time() * 1000)}"
+
+    async def poll(self, upstream_id: str) -> UpstreamStatus:
+        submitted_at = int(upstream_id.rsplit("-", 1)[1]) / 1000
+        elapsed = time.time() - submitted_at
+        if elapsed < self.seconds:
+            return UpstreamStatus("running", int(100 * elapsed / self.seconds), eta_seconds=self.seconds - elapsed)
+        roll = int(hashlib.sha256(upstream_id.encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+        if roll < self.failure_rate:
+            return UpstreamStatus("failed", error="Stub provider failure")
+        return UpstreamStatus("completed", 100, result_url=f"https://placeholder-video-url.com/{upstream_id}.mp4")
+
+    def result_request(self, upstream_id: str, status: UpstreamStatus) -> Optional[Dict[str, Any]]:
+        return None
+
+
+class RunwayProvider(VideoProvider):
+    name = "runway"
+    base_url = "https://api.dev.runwayml.com/v1"
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {RUNWAY_API_KEY}", "X-Runway-Version": "2024-11-06"}
+
+    async def submit(self, job_input: Dict[str, Any]) -> str:
+        data = {
+            "model": RUNWAY_MODEL,
+            "promptText": job_input["prompt"][:1000],
+            "ratio": "1280:720",
+            "duration": 10 if (job_input.get("duration") or 5) > 5 else 5,
+        }
+        path = "text_to_video"
+        if job_input.get("image_url"):
+            data["promptImage"] = job_input["image_url"]
+            path = "image_to_video"
+        response = await upstream.client().post(f"{self.base_url}/{path}", json=data, headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        return _check(response, "Runway submit")["id"]
+
+    async def poll(self, upstream_id: str) -> UpstreamStatus:
+        response = await upstream.client().get(f"{self.base_url}/tasks/{upstream_id}", headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        task = _check(response, "Runway poll")
+        status = task.get("status")
+        if status == "SUCCEEDED":
+            return UpstreamStatus("completed", 100, result_url=(task.get("output") or [None])[0])
+        if status in ("FAILED", "CANCELLED"):
+            return UpstreamStatus("failed", error=task.get("failure") or status.lower())
+        progress = task.get("progress")
+        return UpstreamStatus("running", int(progress * 100) if progress is not None else None)
+
+
+class KlingProvider(VideoProvider):
+    name = "kling"
+    base_url = "https://api.klingai.com/v1/videos"
+
+    def _headers(self) -> Dict[str, str]:
+        from jose import jwt
+
+        now = int(time.time())
+        token = jwt.encode({"iss": KLING_ACCESS_KEY, "exp": now + 1800, "nbf": now - 5}, KLING_SECRET_KEY, algorithm="HS256")
+        return {"Authorization": f"Bearer {token}"}
+
+    async def submit(self, job_input: Dict[str, Any]) -> str:
+        data = {"model_name": "kling-v1", "prompt": job_input["prompt"][:2500],
+                "duration": "10" if (job_input.get("duration") or 5) > 5 else "5"}
+        path = "text2video"
+        if job_input.get("image_url"):
+            data["image"] = job_input["image_url"]
+            path = "image2video"
+        response = await upstream.client().post(f"{self.base_url}/{path}", json=data, headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        # The poll endpoint depends on the task type, so keep it in the ID
+        return f"{path}:{_check(response, 'Kling submit')['data']['task_id']}"
+
+    async def poll(self, upstream_id: str) -> UpstreamStatus:
+        path, task_id = upstream_id.split(":", 1)
+        response = await upstream.client().get(f"{self.base_url}/{path}/{task_id}", headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        task = _check(response, "Kling poll")["data"]
+        status = task.get("task_status")
+        if status == "succeed":
+            videos = (task.get("task_result") or {}).get("videos") or [{}]
+            return UpstreamStatus("completed", 100, result_url=videos[0].get("url"))
+        if status == "failed":
+            return UpstreamStatus("failed", error=task.get("task_status_msg") or "failed")
+        return UpstreamStatus("running")
+
+
+class SoraProvider(VideoProvider):
+    name = "sora"
+    base_url = "https://api.openai.com/v1/videos"
+
+    def _headers(self) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+
+    async def submit(self, job_input: Dict[str, Any]) -> str:
+        seconds = min((4, 8, 12), key=lambda s: abs(s - (job_input.get("duration") or 4)))
+        data = {"model": SORA_MODEL, "prompt": job_input["prompt"], "seconds": str(seconds)}
+        response = await upstream.client().post(self.base_url, json=data, headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        return _check(response, "Sora submit")["id"]
+
+    async def poll(self, upstream_id: str) -> UpstreamStatus:
+        response = await upstream.client().get(f"{self.base_url}/{upstream_id}", headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        video = _check(response, "Sora poll")
+        if video.get("status") == "completed":
+            return UpstreamStatus("completed", 100, result_url=f"{self.base_url}/{upstream_id}/content")
+        if video.get("status") == "failed":
+            return UpstreamStatus("failed", error=(video.get("error") or {}).get("message", "failed"))
+        return UpstreamStatus("running", video.get("progress"))
+
+    def result_request(self, upstream_id: str, status: UpstreamStatus) -> Optional[Dict[str, Any]]:
+        return {"url": status.result_url, "headers": self._headers()}
+
+
+class VeoProvider(VideoProvider):
+    name = "veo3"
+    base_url = "https://generativelanguage.googleapis.com/v1beta"
+
+    def _headers(self) -> Dict[str, str]:
+        return {"x-goog-api-key": GEMINI_API_KEY}
+
+    async def submit(self, job_input: Dict[str, Any]) -> str:
+        data = {"instances": [{"prompt": job_input["prompt"]}], "parameters": {"aspectRatio": "16:9"}}
+        response = await upstream.client().post(f"{self.base_url}/models/{VEO_MODEL}:predictLongRunning", json=data,
+                                         headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        return _check(response, "Veo submit")["name"]
+
+    async def poll(self, upstream_id: str) -> UpstreamStatus:
+        response = await upstream.client().get(f"{self.base_url}/{upstream_id}", headers=self._headers(), timeout=REQUEST_TIMEOUT)
+        operation = _check(response, "Veo poll")
+        if not operation.get("done"):
+            return UpstreamStatus("running")
+        if "error" in operation:
+            return UpstreamStatus("failed", error=operation["error"].get("message", "failed"))
+        samples = operation.get("response", {}).get("generateVideoResponse", {}).get("generatedSamples") or [{}]
+        return UpstreamStatus("completed", 100, result_url=samples[0].get("video", {}).get("uri"))
+
+    def result_request(self, upstream_id: str, status: UpstreamStatus) -> Optional[Dict[str, Any]]:
+        return {"url": status.result_url, "headers": self._headers()}
+
+
+stub_provider = StubVideoProvider()
+
+
+def get_provider(model: str) -> VideoProvider:
+    """Provider for a video model, or the stub when it isn't configured"""
+    if VIDEO_PROVIDER_OVERRIDE == "stub":
+        return stub_provider
+    if model == "runway" and RUNWAY_API_KEY:
+        return RunwayProvider()
+    if model == "kling" and KLING_ACCESS_KEY and KLING_SECRET_KEY:
+        return KlingProvider()
+    if model == "sora" and OPENAI_API_KEY:
+        return SoraProvider()
+    if model == "veo3" and GEMINI_API_KEY:
+        return VeoProvider()
+    return stub_provider
+
+
+PROVIDER_CLASSES = {provider.name: provider for provider in (RunwayProvider, KlingProvider, SoraProvider, VeoProvider)}
+
+
+def provider_by_name(name: str) -> VideoProvider:
+    """The provider a task was submitted to, whatever `get_provider` would pick for its model now"""
+    if name == stub_provider.name:
+        return stub_provider
+    if name not in PROVIDER_CLASSES:
+        raise UpstreamError(f"Unknown video provider: {name}", retryable=False)
+    return PROVIDER_CLASSES[name]()
+
+
+async def stream_result(request: Dict[str, Any]) -> AsyncIterator[bytes]:
+    """Stream a finished upstream video without holding it in memory"""
+    async with upstream.client().stream("GET", request["url"], headers=request["headers"], timeout=120.0,
+                                        follow_redirects=True) as response:
+        if response.status_code != 200:
+            raise UpstreamError(f"Result download failed with HTTP {response.status_code}")
+        async for chunk in response.aiter_bytes():
+            yield chunk
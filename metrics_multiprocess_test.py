@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+LotayaAI Multi-Process Metrics Test
+Runs metrics.py the way several uvicorn workers do, with PROMETHEUS_MULTIPROC_DIR
+set: worker processes record provider calls and images, then a scrape from
+another process must show the instruments summed over every worker plus its
+own scrape-time runtime gauges (admission, lanes, concurrency limits, logs).
+
+Usage: python metrics_multiprocess_test.py
+"""
+
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+WORKERS = int(os.getenv("TEST_WORKERS", "3"))
+RUNTIME_METRICS = ("lotaya_event_loop_lag_seconds", "lotaya_lane_queued", "lotaya_provider_concurrency_limit",
+                   "lotaya_log_queue_depth")
+
+
+def run_worker():
+    """Record one provider call and two images, as a generation request would"""
+    import metrics
+
+    with metrics.ProviderCall("xai"):
+        pass
+    metrics.IMAGES_PRODUCED.labels("xai").inc(2)
+
+
+class MetricsTester:
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, test_name: str, success: bool, details: str = ""):
+        """Log test results"""
+        status = "✅ PASS" if success else "❌ FAIL"
+        print(f"{status} {test_name}")
+        if details:
+            print(f"   Details: {details}")
+        self.test_results.append({"test": test_name, "success": success, "details": details})
+
+    def check(self):
+        import metrics
+        import scheduler
+        from prometheus_client.parser import text_string_to_metric_families
+
+        # The scraped worker has served xai requests too, so it has a scheduler (and limit) for it
+        scheduler.for_provider("xai")
+
+        samples = {}
+        for family in text_string_to_metric_families(metrics.render().decode()):
+            for sample in family.samples:
+                samples.setdefault(sample.name, []).append(sample)
+
+        images = sum(s.value for s in samples.get("lotaya_images_produced_total", []) if s.labels.get("model") == "xai")
+        self.log_test("Counters summed across workers", images == 2 * WORKERS, f"{images:g} images from {WORKERS} workers")
+
+        calls = sum(s.value for s in samples.get("lotaya_provider_call_duration_seconds_count", [])
+                    if s.labels.get("provider") == "xai")
+        self.log_test("Histograms summed across workers", calls == WORKERS, f"{calls:g} provider calls")
+
+        missing = [name for name in RUNTIME_METRICS if name not in samples]
+        self.log_test("Runtime gauges exported", not missing, f"missing: {missing}" if missing else "")
+
+        limits = {s.labels["provider"]: s.value for s in samples.get("lotaya_provider_concurrency_limit", [])}
+        self.log_test("Concurrency limit per provider", "xai" in limits, f"limits: {limits}")
+
+    def run_all_tests(self):
+        directory = tempfile.mkdtemp(prefix="lotaya-metrics-")
+        # Read by prometheus_client at import, in the workers and in this process alike
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = directory
+        try:
+            print(f"🔗 Testing metrics with {WORKERS} worker processes in {directory}")
+            context = multiprocessing.get_context("spawn")
+            for _ in range(WORKERS):
+                worker = context.Process(target=run_worker)
+                worker.start()
+                worker.join()
+            self.check()
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+        passed = sum(1 for result in self.test_results if result["success"])
+        print(f"\n📊 {passed}/{len(self.test_results)} tests passed")
+        return passed == len(self.test_results)
+
+
+if __name__ == "__main__":
+    success = MetricsTester().run_all_tests()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+LotayaAI Multi-Worker Lifecycle Test
+Starts several worker processes against one local MongoDB and checks that the
+lease-based generation lifecycle (claim, heartbeat, complete, fail) never lets
+two workers own the same work, that work abandoned by a crashed worker is
+picked up by another one, and that an Idempotency-Key held by a crashed
+worker is freed once its generation is reaped or its lease runs out.
+
+Usage: MONGO_URL=mongodb://localhost:27017 python multiworker_test.py
+"""
+
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+
+MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
+DB_NAME = "lotayaai_multiworker_test"
+WORKERS = int(os.getenv("TEST_WORKERS", "4"))
+TASKS = int(os.getenv("TEST_TASKS", "200"))
+CRASH_LEASE_SECONDS = 2
+
+
+def get_db():
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(MONGO_URL)[DB_NAME]
+
+
+def run_worker(crash: bool):
+    """Claim and finish tasks until none are left; optionally die holding one"""
+    async def work():
+        import lifecycle
+
+        db = get_db()
+        while True:
+            lease = CRASH_LEASE_SECONDS if crash else 30
+            task = await lifecycle.claim(db.tasks, {"status": "queued"}, lease, sort=[("_id", 1)])
+            if task is None:
+                if await db.tasks.count_documents({"status": "queued"}) == 0:
+                    return
+                await asyncio.sleep(0.2)
+                continue
+            await db.work_log.insert_one({"task": task["_id"], "worker": lifecycle.WORKER_ID, "epoch": task["lease_epoch"]})
+            if crash:
+                # Simulate a killed worker: the lease is never released
+                os._exit(0)
+            async with lifecycle.keep_alive(db.tasks, task, lease):
+                await asyncio.sleep(random.uniform(0, 0.02))
+            if task["_id"] % 10 == 0:
+                await lifecycle.fail(db.tasks, task, "simulated failure")
+            else:
+                await lifecycle.complete(db.tasks, task, {"worker": lifecycle.WORKER_ID})
+
+    asyncio.run(work())
+
+
+def run_idempotent_requests():
+    """Claim Idempotency-Keys and die mid-generation, as a killed worker would"""
+    async def work():
+        import idempotency
+        import lifecycle
+
+        db = get_db()
+        for key in ("crash-reaped", "crash-expired"):
+            await idempotency.claim(db, "generate_image", key, {"prompt": key}, f"{key}-original")
+            await db.generations.insert_one({
+                "generation_id": f"{key}-original", "type": "image", "status": "processing",
+                **lifecycle.new_lease(CRASH_LEASE_SECONDS), "created_at": lifecycle.utcnow(),
+            })
+        os._exit(0)
+
+    asyncio.run(work())
+
+
+class MultiWorkerTester:
+    def __init__(self):
+        self.test_results = []
+
+    def log_test(self, test_name: str, success: bool, details: str = ""):
+        """Log test results"""
+        status = "✅ PASS" if success else "❌ FAIL"
+        print(f"{status} {test_name}")
+        if details:
+            print(f"   Details: {details}")
+        self.test_results.append({"test": test_name, "success": success, "details": details})
+
+    async def seed(self):
+        db = get_db()
+        await db.client.drop_database(DB_NAME)
+        await db.tasks.insert_many([
+            {"_id": i, "status": "queued", "lease_owner": None, "lease_expires_at": None, "lease_epoch": 0}
+            for i in range(TASKS)
+        ])
+
+    async def check(self):
+        import lifecycle
+
+        db = get_db()
+        log = await db.work_log.find().to_list(None)
+        tasks = await db.tasks.find().to_list(None)
+        by_task = {}
+        for entry in log:
+            by_task.setdefault(entry["task"], []).append(entry)
+
+        unfinished = [t["_id"] for t in tasks if t["status"] not in ("completed", "failed")]
+        self.log_test("All tasks finished", not unfinished, f"unfinished: {unfinished[:10]}" if unfinished else f"{len(tasks)} tasks")
+
+        duplicates = {task: entries for task, entries in by_task.items() if len(entries) > 1}
+        crashed = [task for task, entries in duplicates.items() if len(entries) == 2]
+        self.log_test("Only the crashed task was worked twice",
+                      len(duplicates) == 1 and len(crashed) == 1,
+                      f"tasks worked more than once: {sorted(duplicates)}")
+        if crashed:
+            epochs = sorted(entry["epoch"] for entry in duplicates[crashed[0]])
+            self.log_test("Reclaim bumped the lease epoch", epochs == [1, 2], f"epochs: {epochs}")
+
+        owners = {entry["worker"] for entry in log}
+        self.log_test("Load shared across workers", len(owners) >= min(WORKERS, 2), f"{len(owners)} distinct workers")
+
+        failed = sorted(t["_id"] for t in tasks if t["status"] == "failed")
+        self.log_test("Failures recorded", failed == list(range(0, TASKS, 10)), f"{len(failed)} failed tasks")
+
+        # A stale owner (old epoch) must not be able to overwrite a finished task
+        stale = {"_id": 1, "lease_epoch": 0}
+        overwritten = await lifecycle.complete(db.tasks, stale, {"worker": "stale"})
+        self.log_test("Stale owner write rejected", not overwritten)
+
+    async def check_idempotency(self):
+        import idempotency
+        import lifecycle
+
+        db = get_db()
+        replay = await idempotency.claim(db, "generate_image", "crash-expired", {"prompt": "crash-expired"}, "early-retry")
+        self.log_test("Retry within the crashed worker's lease replays the original",
+                      replay is not None and replay["generation_id"] == "crash-expired-original",
+                      f"claim returned {replay and replay['generation_id']}")
+
+        await asyncio.sleep(CRASH_LEASE_SECONDS + 0.5)
+        reaped = await lifecycle.reap(db.generations, {"generation_id": "crash-reaped-original", "status": "processing"},
+                                      "Worker stopped before the generation finished")
+        for key, how in (("crash-reaped", "reaped"), ("crash-expired", "lease-expired")):
+            replay = await idempotency.claim(db, "generate_image", key, {"prompt": key}, f"{key}-retry")
+            stored = await db.idempotency_keys.find_one({"_id": idempotency.record_id("generate_image", key)})
+            self.log_test(f"Retry after a {how} generation takes over the key",
+                          replay is None and stored["generation_id"] == f"{key}-retry",
+                          f"reaped {reaped}, key bound to {stored and stored['generation_id']}")
+
+        await db.client.drop_database(DB_NAME)
+
+    def run_all_tests(self):
+        print(f"🔗 Testing lifecycle with {WORKERS} workers against {MONGO_URL}")
+        asyncio.run(self.seed())
+
+        context = multiprocessing.get_context("spawn")
+        crasher = context.Process(target=run_worker, args=(True,))
+        crasher.start()
+        crasher.join()
+
+        started = time.time()
+        workers = [context.Process(target=run_worker, args=(False,)) for _ in range(WORKERS)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        print(f"   {TASKS} tasks processed in {time.time() - started:.1f}s")
+
+        asyncio.run(self.check())
+
+        crasher = context.Process(target=run_idempotent_requests)
+        crasher.start()
+        crasher.join()
+        asyncio.run(self.check_idempotency())
+
+        passed = sum(1 for result in self.test_results if result["success"])
+        print(f"\n📊 {passed}/{len(self.test_results)} tests passed")
+        return passed == len(self.test_results)
+
+
+if __name__ == "__main__":
+    success = MultiWorkerTester().run_all_tests()
+    sys.exit(0 if success else 1)